@@ -0,0 +1,1070 @@
+#!/usr/bin/python
+# coding=utf-8
+
+######   LIBRARIES ########
+import os
+import sys
+import time
+import json
+import random
+import base64
+import hashlib
+import socket
+import argparse
+import shutil
+import tempfile
+import datetime
+import threading
+import functools
+import multiprocessing
+import subprocess
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+######   CONSTANTS ########
+
+# Fake Slack bot id used by every benchmark
+FAKE_BOT_ID = 'UBENCHBOT'
+# Delay between two reads of the former polling receive loop (rtm benchmark, mode='poll')
+READ_WEBSOCKET_DELAY = 1
+
+# The bot reads its configuration when imported, so provide dummy credentials
+for variable, value in [('BOT_ID', FAKE_BOT_ID),
+                        ('SLACK_BOT_TOKEN', 'xoxb-benchmark'),
+                        ('FOOD2FORK_KEY', 'benchmark'),
+                        ('VISUAL_RECOGNITION_KEY', 'benchmark'),
+                        ('CONVERSATION_USERNAME', 'benchmark'),
+                        ('CONVERSATION_PASSWORD', 'benchmark'),
+                        ('CONVERSATION_WORKSPACE', 'benchmark')]:
+    os.environ.setdefault(variable, value)
+
+import smart_fridge
+from smart_fridge import SmartFridge, ChannelDispatcher, AT_BOT
+from websocket import WebSocketConnectionClosedException
+from local_nlu import LocalClassifier, load_workspace, confident_intent
+from sessions import session_key
+from dialog import DialogEngine
+from transport import HttpTransport
+from food_classifier import WatsonFoodClassifier, LocalFoodClassifier, BatchingClassifier
+from recipe_index import RecipeIndex
+from recipe_scoring import FridgeScorer
+from slack_outbox import SlackOutbox
+from events_api import EventIngress, EventsServer, slack_signature, start_workers, stop_workers
+import inventory
+from inventory import InventoryService, ChangeFeed
+from expiry import ExpiryTracker
+from database import DatabasePool
+from tenants import DEFAULT_FRIDGE_ID
+
+# Queries used by get_db_summary before the single pass summary
+LEGACY_SUMMARY_QUERIES = [
+    "SELECT name FROM products ORDER by name",
+    "SELECT name FROM products WHERE date(expiration_date)<=current_date ORDER by name",
+    "SELECT name FROM products WHERE date(expiration_date)>current_date "
+    "AND date(expiration_date)<=current_date + interval '{} days' ORDER by name".format(smart_fridge.DAYS_TO_EXPIRE),
+]
+
+# Magic string used in the websocket opening handshake (RFC 6455)
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+# SQL files loaded, in order, into the disposable Postgres of the replay benchmark
+SEED_SQL_FILES = [os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts', name)
+                  for name in ('database_bck_plain.sql', 'summary.sql', 'ingredient_search.sql', 'expiry.sql',
+                               'inventory.sql', 'tenants.sql')]
+# Seconds the fake remote services take to answer during a replay
+REPLAY_DELAYS = {'conversation': 0.15, 'ingredients': 0.3, 'top_rated': 0.2, 'trending': 0.25, 'get': 0.2}
+# Scripted conversations replayed by every user (None stands for a photo of food)
+REPLAY_SCRIPTS = [
+    ['hello', 'I want a recipe', 'lasagna', 'thanks', 'bye'],
+    ['hello', 'suggest me a dish', 'mexican', 'no', 'whatever', '2', 'bye'],
+    ['what do I have in the fridge?', 'do I have eggs?', 'thanks'],
+    ['hello', None, 'thanks'],
+]
+# Seconds a user waits before sending the next message of the script
+REPLAY_THINK_TIME = 0.2
+# Seconds a replayed message can wait for its reply before the run is failed
+REPLAY_TIMEOUT = 60
+# Number of fridges of the successive runs of the tenants benchmark
+TENANT_SCALES = (100, 1000, 10000)
+# Products of every fridge of the tenants benchmark
+TENANT_PRODUCTS = 50
+
+
+######   FAKE SLACK RTM ########
+"""
+    Minimal websocket server that plays the role of the Slack RTM
+    firehose. Events are pushed as text frames and the sending
+    time of every event is recorded to compute reply latencies.
+"""
+class FakeRTMServer():
+    def __init__(self, host='127.0.0.1', port=0):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(1)
+        self.client = None
+        self.connected = threading.Event()
+        self.send_lock = threading.Lock()
+        self.sent_at = {}
+
+    @property
+    def url(self):
+        host, port = self.listener.getsockname()
+        return 'ws://{0}:{1}/'.format(host, port)
+
+    def start(self):
+        thread = threading.Thread(target=self.accept, daemon=True)
+        thread.start()
+
+    def accept(self):
+        self.client, _ = self.listener.accept()
+        request = b''
+        while b'\r\n\r\n' not in request:
+            request += self.client.recv(1024)
+        key = ''
+        for line in request.decode().split('\r\n'):
+            if line.lower().startswith('sec-websocket-key:'):
+                key = line.split(':', 1)[1].strip()
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        self.client.sendall('HTTP/1.1 101 Switching Protocols\r\n'
+                            'Upgrade: websocket\r\n'
+                            'Connection: Upgrade\r\n'
+                            'Sec-WebSocket-Accept: {}\r\n\r\n'.format(accept).encode())
+        self.connected.set()
+
+    def send_event(self, event_id, event):
+        payload = json.dumps(event).encode()
+        if len(payload) < 126:
+            header = bytes([0x81, len(payload)])
+        elif len(payload) < 65536:
+            header = bytes([0x81, 126]) + len(payload).to_bytes(2, 'big')
+        else:
+            header = bytes([0x81, 127]) + len(payload).to_bytes(8, 'big')
+        # several simulated users send at the same time
+        with self.send_lock:
+            self.sent_at[event_id] = time.perf_counter()
+            self.client.sendall(header + payload)
+
+    def close(self):
+        if self.client:
+            self.client.close()
+        self.listener.close()
+
+
+######   FAKE FOOD2FORK ########
+"""
+    Local Food2fork API answering /search and /get with generated
+    recipes. delays maps a request kind ('ingredients', 'top_rated',
+    'trending' or 'get') to the seconds the answer is held back.
+"""
+class FakeFood2ForkServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, delays=None, host='127.0.0.1', port=0):
+        super().__init__((host, port), Food2ForkHandler)
+        self.delays = delays or {}
+        self.requests = 0
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return 'http://{0}:{1}/api'.format(host, port)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class Food2ForkHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        self.server.requests += 1
+        if url.path.endswith('/get'):
+            kind = 'get'
+            body = {'recipe': fake_recipe(params.get('rId', '0'))}
+        else:
+            if params.get('q'):
+                kind = 'ingredients'
+            elif params.get('sort') == 't':
+                kind = 'trending'
+            else:
+                kind = 'top_rated'
+            body = {'count': 30, 'recipes': [fake_recipe('{0}-{1}'.format(kind, i), params.get('q'))
+                                             for i in range(30)]}
+        time.sleep(self.server.delays.get(kind, 0))
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def fake_recipe(recipe_id, query=None):
+    ingredients = (query or 'flour, eggs, milk').split(', ') + ['1 tsp salt', '2 tbsp olive oil']
+    return {'recipe_id': recipe_id,
+            'title': 'Recipe {}'.format(recipe_id),
+            'source_url': 'http://localhost/recipes/{}'.format(recipe_id),
+            'ingredients': ingredients}
+
+
+######   STUBBED BOT ########
+"""
+    SmartFridge without external services: no database, and the
+    Slack Web API is replaced by a recorder. Every command is echoed
+    back so the reply can be matched with the event that caused it.
+"""
+class ReplayFridge(SmartFridge):
+    def __init__(self):
+        self.replied_at = {}
+        self.replied_to = {}
+        self.replies = threading.Condition()
+        super().__init__()
+        self.slack_client.api_call = self.record_api_call
+
+    def database_connection(self, str_db_connection):
+        pass
+
+    def get_top_expired_ingredients_from_db(self, n_ingredients=2):
+        return ['onion', 'tomatoes'][:n_ingredients]
+
+    def handle_command(self, command, channel):
+        self.send_response(command, channel)
+
+    # Replies are recorded as soon as they are sent, without the outbound queue
+    def send_response(self, response, channel):
+        return self.post_message(channel, response)
+
+    def record_api_call(self, method, **kwargs):
+        with self.replies:
+            self.replied_at[kwargs.get('text')] = time.perf_counter()
+            self.replied_to.setdefault(kwargs.get('channel'), []).append(kwargs.get('text'))
+            self.replies.notify_all()
+        return {'ok': True}
+
+
+def percentile(values, p):
+    if len(values) == 0:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(name, latencies, elapsed):
+    print('{0:<24} n={1:<6} p50={2:8.2f}ms  p95={3:8.2f}ms  p99={4:8.2f}ms  {5:10.1f} msg/s'
+          .format(name, len(latencies),
+                  percentile(latencies, 50) * 1000,
+                  percentile(latencies, 95) * 1000,
+                  percentile(latencies, 99) * 1000,
+                  len(latencies) / elapsed if elapsed > 0 else 0.0))
+
+
+######   FAKE SLACK WEB API ########
+"""
+    Stubbed chat.postMessage: every call takes rtt seconds and a channel
+    receiving more than one message per second gets 'ratelimited' with
+    Retry-After, as Slack does.
+"""
+class FakeSlackWebAPI():
+    def __init__(self, rtt=0.1):
+        self.rtt = rtt
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.rate_limited = 0
+        self.last_post = {}
+
+    def post(self, channel, text):
+        time.sleep(self.rtt)
+        with self.lock:
+            self.calls += 1
+            now = time.time()
+            if now - self.last_post.get(channel, 0) < 1.0:
+                self.rate_limited += 1
+                return {'ok': False, 'error': 'ratelimited', 'headers': {'Retry-After': '1'}}
+            self.last_post[channel] = now
+        return {'ok': True}
+
+
+######   EVENTS API ########
+
+# Worker process of the Events API benchmark: every command burns work seconds of CPU,
+# as the local NLU, dialog engine and recipe ranking do, and is reported on done
+def bench_event_worker(work, done, number, commands):
+    while True:
+        item = commands.get()
+        if item is None:
+            break
+        command, event = item
+        end = time.process_time() + work
+        while time.process_time() < end:
+            hashlib.sha256(command.encode()).digest()
+        done.put(event['ts'])
+
+
+def send_signed_event(url, secret, payload):
+    body = json.dumps(payload).encode()
+    timestamp = str(int(time.time()))
+    request = urllib.request.Request(url, data=body, headers={
+        'Content-Type': 'application/json',
+        'X-Slack-Request-Timestamp': timestamp,
+        'X-Slack-Signature': slack_signature(secret, timestamp, body)})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except urllib.error.HTTPError as inst:
+        return inst.code
+
+
+######   FAKE VISUAL RECOGNITION ########
+"""
+    Stands for the Watson Visual Recognition service: answers every
+    classify call with the same food after the given delay, which
+    plays the role of the upload and the remote classification.
+"""
+class FakeVisualRecognition():
+    def __init__(self, delay):
+        self.delay = delay
+
+    # an in-memory file is only accepted by Watson with its name and content type
+    def classify(self, images_file=None, classifier_ids=None, images_filename=None, images_file_content_type=None):
+        if images_filename is None or images_file_content_type is None:
+            raise ValueError('images_filename and images_file_content_type are required')
+        images_file.read()
+        time.sleep(self.delay)
+        return {'images': [{'classifiers': [{'classes': [{'class': 'pizza', 'score': 0.9}]}]}]}
+
+
+# Random photos and a random two layer NumPy model in the .npz format of LocalFoodClassifier
+def fake_food_model(directory, n_images, image_size=64, n_classes=100):
+    import numpy as np
+    from PIL import Image
+    generator = np.random.default_rng(0)
+    paths = []
+    for i in range(n_images):
+        path = os.path.join(directory, 'photo{}.jpg'.format(i))
+        Image.fromarray(generator.integers(0, 255, (480, 640, 3), dtype=np.uint8)).save(path)
+        paths.append(path)
+    model_path = os.path.join(directory, 'food.npz')
+    n_features = image_size * image_size * 3
+    np.savez(model_path, labels=np.array(['food{}'.format(i) for i in range(n_classes)]),
+             image_size=image_size,
+             w0=generator.normal(0, 0.01, (n_features, 256)).astype(np.float32), b0=np.zeros(256, np.float32),
+             w1=generator.normal(0, 0.01, (256, n_classes)).astype(np.float32), b1=np.zeros(n_classes, np.float32))
+    return paths, model_path
+
+
+######   FAKE WATSON CONVERSATION ########
+"""
+    Stands for the Watson Conversation service: runs the exported
+    workspace with the local dialog engine after the given delay, which
+    plays the role of the network round trip.
+"""
+class FakeConversation():
+    def __init__(self, delay, workspace_file=None):
+        workspace = load_workspace(workspace_file or smart_fridge.CONVERSATION_WORKSPACE_FILE)
+        self.engine = DialogEngine(workspace, LocalClassifier.from_workspace(workspace))
+        self.delay = delay
+
+    def message(self, **kwargs):
+        time.sleep(self.delay)
+        return self.engine.message(**kwargs)
+
+
+######   DISPOSABLE POSTGRES ########
+"""
+    Throwaway Postgres cluster (initdb + pg_ctl) in a temporary directory,
+    listening only on a Unix socket and seeded with the given SQL files.
+    The dates of the products are moved so that the dump looks as fresh
+    as the day it was taken. Needs the Postgres server binaries (in PATH
+    or reported by pg_config) and a non-root user, as initdb requires.
+"""
+class DisposablePostgres():
+    def __init__(self, seed_files=SEED_SQL_FILES):
+        self.seed_files = seed_files
+        self.directory = None
+        # only names the socket file, which lives in the temporary directory
+        self.port = 54329
+
+    @property
+    def dsn(self):
+        return 'host={0} port={1} user=postgres dbname=postgres'.format(self.directory, self.port)
+
+    def binary(self, name):
+        path = shutil.which(name)
+        if path is None:
+            bindir = subprocess.run(['pg_config', '--bindir'], stdout=subprocess.PIPE, check=True,
+                                    universal_newlines=True).stdout.strip()
+            path = os.path.join(bindir, name)
+        return path
+
+    def start(self):
+        self.directory = tempfile.mkdtemp(prefix='smartfridge-pg-')
+        data = os.path.join(self.directory, 'data')
+        subprocess.run([self.binary('initdb'), '-D', data, '-U', 'postgres', '-A', 'trust'],
+                       stdout=subprocess.DEVNULL, check=True)
+        subprocess.run([self.binary('pg_ctl'), '-D', data, '-l', os.path.join(self.directory, 'postgres.log'),
+                        '-w', '-o', "-p {0} -k {1} -c listen_addresses=''".format(self.port, self.directory),
+                        'start'], stdout=subprocess.DEVNULL, check=True)
+        for path in self.seed_files:
+            self.psql('-f', path)
+        self.psql('-c', "UPDATE products SET registered = registered + shift, modified = modified + shift, "
+                        "expiration_date = expiration_date + shift "
+                        "FROM (SELECT now() - max(modified) AS shift FROM products) AS dump")
+
+    def psql(self, *args):
+        subprocess.run([self.binary('psql'), '-X', '-q', '-v', 'ON_ERROR_STOP=1', '-h', self.directory,
+                        '-p', str(self.port), '-U', 'postgres', '-d', 'postgres'] + list(args),
+                       stdout=subprocess.DEVNULL, check=True)
+
+    def stop(self):
+        if self.directory is None:
+            return
+        subprocess.run([self.binary('pg_ctl'), '-D', os.path.join(self.directory, 'data'), '-m', 'immediate',
+                        'stop'], stdout=subprocess.DEVNULL)
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.directory = None
+
+
+######   OFFLINE BOT ########
+"""
+    The whole SmartFridge (conversation, sessions, caches, database
+    queries, Food2Fork and image classification code paths) with every
+    remote service replaced by a local stand-in. Slack replies are
+    recorded, and the end of every command is signalled per channel.
+"""
+class OfflineFridge(SmartFridge):
+    def __init__(self, delays, classify_delay):
+        self.completed = {}
+        self.replies = threading.Condition()
+        super().__init__()
+        self.slack_client.api_call = lambda method, **kwargs: {'ok': True}
+        self.conversation = FakeConversation(delays.get('conversation', 0))
+        self.food_classifier = WatsonFoodClassifier(FakeVisualRecognition(classify_delay),
+                                                    self.visual_recognition_http)
+
+    # Slack files are not downloaded, every photo is different so none is cached
+    def download_image(self, url):
+        return url.encode() + os.urandom(1024)
+
+    def handle_command(self, command, channel, user=None, team=None, file=None):
+        try:
+            super().handle_command(command, channel, user, team, file)
+        finally:
+            with self.replies:
+                self.completed[channel] = self.completed.get(channel, 0) + 1
+                self.replies.notify_all()
+
+    def wait_completed(self, channel, count, timeout):
+        deadline = time.perf_counter() + timeout
+        with self.replies:
+            while self.completed.get(channel, 0) < count:
+                if not self.replies.wait(max(0, deadline - time.perf_counter())):
+                    return False
+        return True
+
+
+######   SYNTHETIC RECIPES ########
+
+# n_recipes recipes of 5 to 15 ingredients drawn from a vocabulary of n_ingredients
+# made up names, the first ones much more frequent (as onion or garlic)
+def fake_recipes(n_recipes, n_ingredients=2000, seed=0):
+    generator = random.Random(seed)
+    letters = 'abcdefghijklmnoprstuvz'
+
+    def word():
+        return ''.join(generator.choice(letters) for _ in range(generator.randint(5, 8)))
+
+    vocabulary = [word() if generator.random() < 0.7 else word() + ' ' + word() for _ in range(n_ingredients)]
+    weights = [1.0 / (i + 1) for i in range(n_ingredients)]
+    recipes = []
+    for i in range(n_recipes):
+        ingredients = set(generator.choices(vocabulary, weights, k=generator.randint(5, 15)))
+        recipes.append({'recipe_id': str(i), 'title': 'Recipe {}'.format(i),
+                        'social_rank': generator.random() * 100,
+                        'ingredients': ['{0} cups {1}'.format(generator.randint(1, 4), name) for name in ingredients]})
+    return recipes, vocabulary
+
+
+######   BENCHMARKS ########
+
+# Replays n_events RTM messages against the receive loop and measures event-to-reply latency.
+# mode='event' uses the select based loop, mode='poll' the former rtm_read + sleep loop.
+def bench_rtm_latency(n_events=50, interval=0.05, mode='event'):
+    server = FakeRTMServer()
+    server.start()
+
+    fridge = ReplayFridge()
+    fridge.slack_client.server.connect_slack_websocket(server.url)
+    server.connected.wait()
+
+    stop = threading.Event()
+
+    def receive_loop():
+        while not stop.is_set():
+            try:
+                if mode == 'event':
+                    events = fridge.read_slack_events(timeout=0.5)
+                else:
+                    try:
+                        events = fridge.slack_client.rtm_read()
+                    except BlockingIOError:
+                        events = []
+            except (WebSocketConnectionClosedException, OSError):
+                # the fake server is closed at the end of the run
+                return
+            for command, event in fridge.parse_slack_events(events):
+                fridge.handle_command(command, event['channel'])
+            if mode != 'event':
+                time.sleep(READ_WEBSOCKET_DELAY)
+
+    thread = threading.Thread(target=receive_loop, daemon=True)
+    thread.start()
+
+    start = time.perf_counter()
+    for i in range(n_events):
+        event_id = 'event {}'.format(i)
+        server.send_event(event_id, {'type': 'message', 'channel': 'CBENCH', 'user': 'UBENCH',
+                                     'text': '{0} {1}'.format(AT_BOT, event_id)})
+        time.sleep(interval)
+
+    deadline = time.perf_counter() + READ_WEBSOCKET_DELAY + 5
+    with fridge.replies:
+        while len(fridge.replied_at) < n_events and time.perf_counter() < deadline:
+            fridge.replies.wait(0.1)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    server.close()
+
+    latencies = [fridge.replied_at[e] - server.sent_at[e] for e in server.sent_at if e in fridge.replied_at]
+    report('rtm ({})'.format(mode), latencies, elapsed)
+    return latencies
+
+
+# Load test: n_channels users send n_commands each at the same time. Every command
+# blocks work seconds, as a photo classification or Food2Fork search would do.
+def bench_dispatch(n_channels=20, n_commands=5, work=0.1, concurrent=True):
+    fridge = ReplayFridge()
+
+    def slow_command(command, channel):
+        time.sleep(work)
+        fridge.handle_command(command, channel)
+
+    commands = [('C{0:04d}'.format(c), 'command {0} {1}'.format(c, i))
+                for i in range(n_commands) for c in range(n_channels)]
+
+    start = time.perf_counter()
+    sent_at = {}
+    if concurrent:
+        dispatcher = ChannelDispatcher()
+        for channel, command in commands:
+            sent_at[command] = time.perf_counter()
+            dispatcher.submit(channel, slow_command, command, channel)
+        dispatcher.shutdown(wait=True)
+    else:
+        for channel, command in commands:
+            sent_at[command] = time.perf_counter()
+            slow_command(command, channel)
+    elapsed = time.perf_counter() - start
+
+    latencies = [fridge.replied_at[c] - sent_at[c] for c in sent_at]
+    report('dispatch ({})'.format('concurrent' if concurrent else 'sequential'), latencies, elapsed)
+    return latencies
+
+
+# Wall time of a yum suggestion with the three recipe sources answering with the
+# given latencies. Caches are emptied before every request.
+def bench_suggestion(n_requests=10, delays=None, concurrent=True):
+    delays = delays or {'ingredients': 0.3, 'top_rated': 0.2, 'trending': 0.25}
+    server = FakeFood2ForkServer(delays)
+    server.start()
+    smart_fridge.FOOD2FORK_URL = server.url
+
+    fridge = ReplayFridge()
+    # the recipe sources are called directly, outside handle_command
+    fridge.local.key = session_key('TBENCH', 'CBENCH', 'UBENCH')
+    fridge.local.session = fridge.sessions.get(fridge.local.key)
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(n_requests):
+        fridge.search_cache.clear()
+        fridge.session.recipe_options = []
+        begin = time.perf_counter()
+        if concurrent:
+            fridge.yum_suggestion()
+        else:
+            fridge.get_recipe_options_from_available_ingredients(n_options=6)
+            fridge.get_top_rated_recipe_options(n_options=6)
+            fridge.get_trending_recipe_options(n_options=6)
+        latencies.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - start
+    server.stop()
+
+    name = 'suggestion ({})'.format('concurrent' if concurrent else 'sequential')
+    report(name, latencies, elapsed)
+    return latencies
+
+
+# Inventory summary on a generated products table of n_products rows, in a
+# throwaway schema of the database given by dsn (e.g. a local disposable Postgres)
+def bench_summary(dsn, n_products=1000000, n_requests=10):
+    import psycopg2
+
+    schema = 'bench_{}'.format(os.getpid())
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cursor.execute('CREATE SCHEMA {0}; SET search_path = {0}'.format(schema))
+    try:
+        cursor.execute("CREATE TABLE products (name character varying(50), id bigint PRIMARY KEY, "
+                       "registered timestamp with time zone, modified timestamp with time zone, "
+                       "expiration_date timestamp with time zone, quantity double precision, fridge_id integer)")
+        # Expiration dates spread over one year around today: ~8% expired, ~2% to expire
+        cursor.execute("INSERT INTO products "
+                       "SELECT 'product ' || i, i, now(), now(), "
+                       "now() + (random() * 365 - 30) * interval '1 day', random() * 1000, %s "
+                       "FROM generate_series(1, %s) AS i", (DEFAULT_FRIDGE_ID, n_products))
+        cursor.execute("CREATE INDEX products_fridge_expiration_idx "
+                       "ON products (fridge_id, expiration_date, quantity DESC)")
+        cursor.execute("ANALYZE products")
+        cursor.execute("PREPARE inventory_summary (integer) AS {}".format(
+            smart_fridge.DB_STATEMENTS['inventory_summary'][1]))
+
+        for name, queries in [('summary (3 queries)', LEGACY_SUMMARY_QUERIES),
+                              ('summary (single pass)', ['EXECUTE inventory_summary ({})'.format(DEFAULT_FRIDGE_ID)])]:
+            latencies = []
+            start = time.perf_counter()
+            for _ in range(n_requests):
+                begin = time.perf_counter()
+                for query in queries:
+                    cursor.execute(query)
+                    cursor.fetchall()
+                latencies.append(time.perf_counter() - begin)
+            report(name, latencies, time.perf_counter() - start)
+    finally:
+        cursor.execute('DROP SCHEMA {} CASCADE'.format(schema))
+        conn.close()
+
+
+# k-fold cross validation of the local classifier over the workspace examples: accuracy of
+# the predicted intent and, for several confidence thresholds and margins over the second
+# intent (to calibrate LOCAL_NLU_CONFIDENCE and LOCAL_NLU_MARGIN), share of the turns answered
+# locally and precision of every intent answered locally (share of the turns answered with
+# it that are examples of it), and classification time
+def bench_local_nlu(n_folds=5, thresholds=(0.4, 0.5, 0.6, 0.7, 0.8, 0.9), margins=(0, 0.1, 0.2, 0.3, 0.4)):
+    workspace = load_workspace(smart_fridge.CONVERSATION_WORKSPACE_FILE)
+    examples = [(intent['intent'], example['text'])
+                for intent in workspace['intents'] for example in intent['examples']]
+    random.Random(0).shuffle(examples)
+
+    predictions = []
+    latencies = []
+    for fold in range(n_folds):
+        classifier = LocalClassifier.from_workspace({'intents': [], 'entities': workspace['entities']})
+        for i, (intent, text) in enumerate(examples):
+            if i % n_folds != fold:
+                classifier.add_example(intent, text)
+        classifier.train()
+        for intent, text in examples[fold::n_folds]:
+            begin = time.perf_counter()
+            intents, _ = classifier.classify(text)
+            latencies.append(time.perf_counter() - begin)
+            predictions.append((intent, intents))
+
+    n = len(examples)
+    correct = sum(1 for intent, intents in predictions if intents and intents[0]['intent'] == intent)
+    print('{0}-fold, {1} examples: accuracy {2:.1%}'.format(n_folds, n, correct / n))
+    for threshold in thresholds:
+        for margin in margins:
+            # (expected, answered) of the turns answered locally
+            answered = [(intent, confident_intent(intents, threshold, margin)) for intent, intents in predictions]
+            answered = [(intent, local) for intent, local in answered if local in smart_fridge.LOCAL_NLU_INTENTS]
+            precisions = []
+            for local_intent in smart_fridge.LOCAL_NLU_INTENTS:
+                hits = [intent == local for intent, local in answered if local == local_intent]
+                precision = '{:5.1%}'.format(sum(hits) / len(hits)) if hits else '    -'
+                precisions.append('{0} {1} ({2})'.format(local_intent, precision, len(hits)))
+            current = (threshold, margin) == (smart_fridge.LOCAL_NLU_CONFIDENCE, smart_fridge.LOCAL_NLU_MARGIN)
+            print('confidence >= {0:.1f}, margin >= {1:.1f}: answered locally {2:5.1%}, {3}{4}'
+                  .format(threshold, margin, len(answered) / n, ', '.join(precisions),
+                          '  <- current' if current else ''))
+    print('classify p50={0:.1f}us  p99={1:.1f}us'
+          .format(percentile(latencies, 50) * 1e6, percentile(latencies, 99) * 1e6))
+
+
+# Runs n_conversations scripted conversations through the local dialog engine
+def bench_dialog(n_conversations=50):
+    workspace = load_workspace(smart_fridge.CONVERSATION_WORKSPACE_FILE)
+    engine = DialogEngine(workspace, LocalClassifier.from_workspace(workspace))
+    script = ['', 'hello', 'I want a recipe', 'lasagna', 'whatever', '2', 'suggest me a dish',
+              'mexican', 'no', 'do I have eggs?', 'thanks', 'bye']
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(n_conversations):
+        context = {}
+        for text in script:
+            begin = time.perf_counter()
+            context = engine.message(message_input={'text': text}, context=context)['context']
+            latencies.append(time.perf_counter() - begin)
+    report('local dialog turn', latencies, time.perf_counter() - start)
+
+
+# Classifies n_images photos with each food classifier backend, one at a time (latency)
+# and from n_threads threads at once (throughput, the local model batches them)
+def bench_food_classifier(n_images=50, delay=0.8, n_threads=8):
+    with tempfile.TemporaryDirectory() as directory:
+        paths, model_path = fake_food_model(directory, n_images)
+        local = LocalFoodClassifier(model_path)
+        backends = [('watson (fake)', WatsonFoodClassifier(FakeVisualRecognition(delay), HttpTransport('bench'))),
+                    ('local', local),
+                    ('local batched', BatchingClassifier(local))]
+        for name, backend in backends:
+            latencies = []
+            start = time.perf_counter()
+            for path in paths:
+                begin = time.perf_counter()
+                backend.classify([path])
+                latencies.append(time.perf_counter() - begin)
+            report('{} sequential'.format(name), latencies, time.perf_counter() - start)
+
+            def classify(path):
+                begin = time.perf_counter()
+                backend.classify([path])
+                return time.perf_counter() - begin
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=n_threads) as executor:
+                latencies = list(executor.map(classify, paths))
+            report('{} x{} threads'.format(name, n_threads), latencies, time.perf_counter() - start)
+
+
+# Builds the local recipe index with n_recipes synthetic recipes and ranks them
+# for n_queries fridges of n_ingredients ingredients about to expire
+def bench_recipe_index(n_recipes=100000, n_queries=200, n_ingredients=10):
+    recipes, vocabulary = fake_recipes(n_recipes)
+    index = RecipeIndex()
+    start = time.perf_counter()
+    index.build(recipes)
+    print('recipe index: {0} recipes, {1} terms built in {2:.1f}s'
+          .format(n_recipes, len(index.snapshot[1]), time.perf_counter() - start))
+
+    generator = random.Random(1)
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(n_queries):
+        fridge = generator.sample(vocabulary[:300], n_ingredients)
+        begin = time.perf_counter()
+        index.search(fridge, smart_fridge.TOTAL_NUMBER_OPTIONS)
+        latencies.append(time.perf_counter() - begin)
+    report('recipe index query', latencies, time.perf_counter() - start)
+
+
+# Ranks batches of n_candidates synthetic recipes against a fridge of n_products products,
+# as rank_recipe_options does with the candidates of every suggestion
+def bench_fridge_scoring(n_candidates=1000, n_batches=50, n_products=200):
+    recipes, vocabulary = fake_recipes(n_candidates)
+    generator = random.Random(2)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    inventory = [(name, now + datetime.timedelta(days=generator.uniform(-2, 30)), generator.choice([150, 500, 1000]))
+                 for name in generator.sample(vocabulary[:1000], n_products)]
+    ingredients = [recipe['ingredients'] for recipe in recipes]
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(n_batches):
+        begin = time.perf_counter()
+        FridgeScorer(inventory, smart_fridge.DAYS_TO_EXPIRE).rank(ingredients)
+        latencies.append(time.perf_counter() - begin)
+    report('fridge scoring of {} candidates'.format(n_candidates), latencies, time.perf_counter() - start)
+
+
+# End to end replay: n_users users talk to the bot at the same time through the RTM firehose,
+# each one following a script of REPLAY_SCRIPTS and waiting for the reply to every message.
+# Food2Fork, Watson and Postgres are local stand-ins. Reports the reply latency (message sent
+# to command handled) and fails when the p95 is above max_p95 seconds, e.g. in CI.
+def bench_replay(n_users=20, classify_delay=0.8, max_p95=None, delays=None):
+    delays = delays or REPLAY_DELAYS
+    postgres = DisposablePostgres()
+    food2fork = FakeFood2ForkServer(delays)
+    server = FakeRTMServer()
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            postgres.start()
+            food2fork.start()
+            server.start()
+            smart_fridge.DB_STRING_CONNECTION = postgres.dsn
+            smart_fridge.FOOD2FORK_URL = food2fork.url
+            smart_fridge.SESSION_DB_PATH = os.path.join(directory, 'sessions.db')
+
+            fridge = OfflineFridge(delays, classify_delay)
+            fridge.start_expiry_tracker()
+            fridge.slack_client.server.connect_slack_websocket(server.url)
+            server.connected.wait()
+            dispatcher = ChannelDispatcher()
+            stop = threading.Event()
+
+            def receive_loop():
+                while not stop.is_set():
+                    try:
+                        events = fridge.read_slack_events(timeout=0.5)
+                    except (WebSocketConnectionClosedException, OSError):
+                        return
+                    for command, event in fridge.parse_slack_events(events):
+                        dispatcher.submit(event['channel'], fridge.handle_command, command, event['channel'],
+                                          event.get('user'), event.get('team'), event.get('file'))
+
+            threading.Thread(target=receive_loop, daemon=True).start()
+
+            def user(number):
+                channel = 'D{:04d}'.format(number)
+                latencies = []
+                for turn, text in enumerate(REPLAY_SCRIPTS[number % len(REPLAY_SCRIPTS)]):
+                    event_id = '{0} {1}'.format(channel, turn)
+                    event = {'type': 'message', 'channel': channel, 'user': 'U{:04d}'.format(number)}
+                    if text is None:
+                        event['file'] = {'url_private_download': 'http://files.local/{}.jpg'.format(event_id),
+                                         'size': 1024}
+                    else:
+                        event['text'] = '{0} {1}'.format(AT_BOT, text)
+                    server.send_event(event_id, event)
+                    if not fridge.wait_completed(channel, turn + 1, REPLAY_TIMEOUT):
+                        raise RuntimeError('{} was not answered'.format(event_id))
+                    latencies.append(time.perf_counter() - server.sent_at[event_id])
+                    time.sleep(REPLAY_THINK_TIME)
+                return latencies
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=n_users) as executor:
+                latencies = [latency for user_latencies in executor.map(user, range(n_users))
+                             for latency in user_latencies]
+            elapsed = time.perf_counter() - start
+            stop.set()
+            dispatcher.shutdown(wait=True)
+            fridge.expiry_tracker.stop()
+        finally:
+            server.close()
+            food2fork.stop()
+            postgres.stop()
+
+    report('replay ({} users)'.format(n_users), latencies, elapsed)
+    print('Food2fork requests: {}'.format(food2fork.requests))
+    if max_p95 is not None and percentile(latencies, 95) > max_p95:
+        print('p95 reply latency above {:.0f}ms'.format(max_p95 * 1000))
+        sys.exit(1)
+    return latencies
+
+
+# n_channels users send n_turns commands each; every command replies three times (hourglass,
+# conversation text and answer) with work seconds between them, as a photo turn does. Posting
+# directly blocks the handler on every call and loses the rate limited replies; the outbound
+# queue merges them and retries.
+def bench_outbox(n_channels=20, n_turns=3, work=0.05):
+    replies = ['Please, give me a second... :hourglass_flowing_sand:', 'Let me see what I can cook with it',
+               'I found *Recipe 1*. To cook this you need the following *ingredients*: ...']
+    for mode in ('direct', 'outbox'):
+        slack = FakeSlackWebAPI()
+        outbox = SlackOutbox(slack.post) if mode == 'outbox' else None
+        send = outbox.send if outbox else slack.post
+
+        def user(channel):
+            latencies = []
+            for _ in range(n_turns):
+                begin = time.perf_counter()
+                for reply in replies:
+                    send(channel, reply)
+                    time.sleep(work)
+                latencies.append(time.perf_counter() - begin)
+            return latencies
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=n_channels) as executor:
+            latencies = [latency for channel_latencies in executor.map(user, ['C{:04d}'.format(c)
+                                                                              for c in range(n_channels)])
+                         for latency in channel_latencies]
+        elapsed = time.perf_counter() - start
+        if outbox:
+            outbox.flush()
+        report('{} handler'.format(mode), latencies, elapsed)
+        print('{0}: {1} replies, {2} chat.postMessage calls, {3} rate limited, all sent after {4:.1f}s'
+              .format(mode, n_channels * n_turns * len(replies), slack.calls, slack.rate_limited,
+                      time.perf_counter() - start))
+
+
+# Sends n_events signed Events API callbacks (every one twice, as a Slack retry) from n_clients
+# threads to the ingress with 1, 2, 4, ... worker processes, and measures the commands handled
+# per second. Each command costs work seconds of CPU in its worker.
+def bench_events(n_events=2000, work=0.005, n_clients=8, max_workers=None):
+    secret = 'benchmark-secret'
+    n_workers = 1
+    while n_workers <= (max_workers or os.cpu_count() or 1):
+        done = multiprocessing.Queue()
+        queues, processes = start_workers(n_workers, functools.partial(bench_event_worker, work, done))
+        ingress = EventIngress(secret, queues, smart_fridge.slack_commands)
+        server = EventsServer(ingress, host='127.0.0.1', port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:{}/slack/events'.format(server.server_address[1])
+
+        def send(i):
+            payload = {'type': 'event_callback', 'team_id': 'TBENCH', 'event_id': 'Ev{}'.format(i),
+                       'event': {'type': 'message', 'channel': 'C{:04d}'.format(i % 100), 'user': 'UBENCH',
+                                 'ts': '{}.000100'.format(i), 'text': '{0} command {1}'.format(AT_BOT, i)}}
+            return [send_signed_event(url, secret, payload) for _ in range(2)]
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=n_clients) as executor:
+            statuses = [status for pair in executor.map(send, range(n_events)) for status in pair]
+        handled = set()
+        while len(handled) < n_events:
+            handled.add(done.get(timeout=60))
+        elapsed = time.perf_counter() - start
+        server.shutdown()
+        server.server_close()
+        stop_workers(queues, processes)
+
+        print('events api, {0} workers: {1} events in {2:.2f}s, {3:.0f} events/s, {4} duplicates dropped, '
+              'HTTP {5}'.format(n_workers, n_events, elapsed, n_events / elapsed, ingress.duplicates,
+                                sorted(set(statuses))))
+        n_workers *= 2
+
+
+# On a disposable Postgres: loads n_products products with a multi-row upsert and with COPY,
+# then measures the time from each inventory write (add, consume) to the in-memory snapshot
+# of the expiry tracker showing it, through the change feed
+def bench_inventory(n_products=100000, n_writes=50):
+    postgres = DisposablePostgres()
+    try:
+        postgres.start()
+        database = DatabasePool(postgres.dsn, statements=smart_fridge.DB_STATEMENTS)
+        service = InventoryService(database)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for name, copy_rows in [('upsert', n_products), ('copy', 0)]:
+            items = [('{0} product {1}'.format(name, i), 100.0, now + datetime.timedelta(days=i % 60))
+                     for i in range(n_products)]
+            inventory.COPY_BATCH_ROWS = copy_rows
+            start = time.perf_counter()
+            service.add(DEFAULT_FRIDGE_ID, items)
+            elapsed = time.perf_counter() - start
+            print('inventory load ({0}): {1} rows in {2:.2f}s, {3:.0f} rows/s'
+                  .format(name, n_products, elapsed, n_products / elapsed))
+
+        tracker = ExpiryTracker(database, smart_fridge.DAYS_TO_EXPIRE, interval=3600)
+        tracker.start()
+        changed = threading.Event()
+
+        def on_change(notifications):
+            tracker.apply_changes(notifications)
+            changed.set()
+
+        feed = ChangeFeed(postgres.dsn, on_change)
+        feed.start()
+        time.sleep(1)
+        latencies = []
+        start = time.perf_counter()
+        for i in range(n_writes):
+            changed.clear()
+            begin = time.perf_counter()
+            if i % 2 == 0:
+                service.add(DEFAULT_FRIDGE_ID, [('bench milk', 1000.0, now + datetime.timedelta(days=3))])
+            else:
+                service.consume(DEFAULT_FRIDGE_ID, 'bench milk', 1000.0)
+            changed.wait(5)
+            latencies.append(time.perf_counter() - begin)
+        report('write to snapshot', latencies, time.perf_counter() - start)
+        feed.stop()
+        tracker.stop()
+        database.close()
+    finally:
+        postgres.stop()
+
+
+# On a disposable Postgres holding TENANT_SCALES fridges of n_products products each: latency
+# of the queries of the bot for the fridge of a random user (summary, top expired ingredients,
+# ingredient search), which should not grow with the number of fridges
+def bench_tenants(n_requests=50, n_products=TENANT_PRODUCTS):
+    postgres = DisposablePostgres()
+    try:
+        postgres.start()
+        database = DatabasePool(postgres.dsn, statements=smart_fridge.DB_STATEMENTS)
+        generator = random.Random(0)
+        # the fridge of the dump, ids of the new fridges follow
+        n_fridges = DEFAULT_FRIDGE_ID
+
+        def add_fridges(cursor, n_new):
+            cursor.execute("INSERT INTO fridges (name) "
+                           "SELECT 'bench fridge ' || i FROM generate_series(1, %s) AS i", (n_new,))
+            # Expiration dates spread over one year around today, as in the summary benchmark
+            cursor.execute("INSERT INTO products (fridge_id, name, expiration_date, quantity) "
+                           "SELECT fridges.id, 'product ' || i, "
+                           "now() + (random() * 365 - 30) * interval '1 day', random() * 1000 "
+                           "FROM fridges, generate_series(1, %s) AS i "
+                           "WHERE fridges.id > %s", (n_products, n_fridges))
+            cursor.execute("ANALYZE products")
+
+        for scale in TENANT_SCALES:
+            start = time.perf_counter()
+            database.transaction(functools.partial(add_fridges, n_new=scale - n_fridges))
+            n_fridges = scale
+            print('{0} fridges, {1} products loaded in {2:.1f}s'
+                  .format(n_fridges, database.fetch_all("SELECT count(*) FROM products")[0][0],
+                          time.perf_counter() - start))
+            for name, statement, params in [
+                    ('summary', 'inventory_summary', lambda fridge_id: (fridge_id,)),
+                    ('top expired', 'top_expired_ingredients', lambda fridge_id: (fridge_id, 2)),
+                    ('ingredient search', 'ingredient_information',
+                     lambda fridge_id: (fridge_id, 'product {}'.format(generator.randint(1, n_products))))]:
+                latencies = []
+                start = time.perf_counter()
+                for _ in range(n_requests):
+                    fridge_id = generator.randint(1, n_fridges)
+                    begin = time.perf_counter()
+                    database.execute(statement, params(fridge_id))
+                    latencies.append(time.perf_counter() - begin)
+                report('{0} ({1})'.format(name, n_fridges), latencies, time.perf_counter() - start)
+        database.close()
+    finally:
+        postgres.stop()
+
+
+BENCHMARKS = {
+    'rtm': lambda args: [bench_rtm_latency(args.n, args.interval, mode) for mode in ('event', 'poll')],
+    'dispatch': lambda args: [bench_dispatch(args.n, concurrent=mode) for mode in (True, False)],
+    'suggestion': lambda args: [bench_suggestion(args.n, concurrent=mode) for mode in (True, False)] +
+                               # the trending source misses its deadline, the others fill the six options
+                               [bench_suggestion(args.n, {'trending': smart_fridge.RECIPE_SOURCE_DEADLINE + 1})],
+    'summary': lambda args: bench_summary(args.dsn, args.rows, args.n),
+    'nlu': lambda args: bench_local_nlu(),
+    'dialog': lambda args: bench_dialog(args.n),
+    'vision': lambda args: bench_food_classifier(args.n, args.delay),
+    'recipes': lambda args: bench_recipe_index(args.recipes, args.n),
+    'ranking': lambda args: [bench_fridge_scoring(n_candidates, args.n) for n_candidates in (18, 1000, 10000)],
+    'outbox': lambda args: bench_outbox(args.n),
+    'inventory': lambda args: bench_inventory(args.rows, args.n),
+    'tenants': lambda args: bench_tenants(args.n),
+    'events': lambda args: bench_events(),
+    'replay': lambda args: bench_replay(args.n, args.delay, args.max_p95 / 1000.0 if args.max_p95 else None),
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Smartfridge offline benchmarks')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS.keys()))
+    parser.add_argument('-n', type=int, default=50, help='number of events/requests')
+    parser.add_argument('--interval', type=float, default=0.05, help='seconds between events')
+    parser.add_argument('--dsn', default=smart_fridge.DB_STRING_CONNECTION, help='Postgres connection string')
+    parser.add_argument('--delay', type=float, default=0.8, help='seconds of a remote image classification')
+    parser.add_argument('--rows', type=int, default=1000000, help='rows of the generated products table')
+    parser.add_argument('--recipes', type=int, default=100000, help='recipes of the synthetic recipe index')
+    parser.add_argument('--max-p95', type=float, help='replay fails (exit code 1) above this p95, in ms')
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
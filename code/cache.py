@@ -0,0 +1,120 @@
+#!/usr/bin/python
+# coding=utf-8
+
+######   LIBRARIES ########
+import os
+import time
+import json
+import threading
+from collections import OrderedDict
+
+
+"""
+    Thread safe LRU cache with per entry expiration time (TTL).
+    When an entry is evicted because the cache is full or because
+    it has expired, on_evict(key, value) is called so the owner
+    can spill it to a slower storage.
+    Entries whose values are JSON serializable can be persisted with
+    dump() and loaded back with load(), e.g. to start warm after a restart.
+"""
+class TTLCache():
+    def __init__(self, maxsize=1024, ttl=None, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        # key -> (expiration timestamp or None, value), least recently used first
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires, value = entry
+            if expires is not None and expires <= time.time():
+                self.evict(key)
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    # Value of a live entry, without counting a hit or a miss nor refreshing its LRU position
+    def peek(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or (entry[0] is not None and entry[0] <= time.time()):
+                return default
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        with self.lock:
+            self.entries[key] = (time.time() + ttl if ttl else None, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.evict(next(iter(self.entries)))
+
+    def pop(self, key, default=None):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            return default if entry is None else entry[1]
+
+    def evict(self, key):
+        expires, value = self.entries.pop(key)
+        if self.on_evict:
+            self.on_evict(key, value)
+
+    # Removes every expired entry, returns how many were evicted
+    def expire(self):
+        now = time.time()
+        with self.lock:
+            expired = [key for key, (expires, _) in self.entries.items()
+                       if expires is not None and expires <= now]
+            for key in expired:
+                self.evict(key)
+        return len(expired)
+
+    def values(self):
+        with self.lock:
+            return [(key, value) for key, (_, value) in self.entries.items()]
+
+    def stats(self):
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+    def dump(self, path):
+        with self.lock:
+            entries = [[key, expires, value] for key, (expires, value) in self.entries.items()]
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        if not os.path.exists(path):
+            return 0
+        with open(path) as f:
+            entries = json.load(f)
+        now = time.time()
+        with self.lock:
+            for key, expires, value in entries:
+                if expires is None or expires > now:
+                    self.entries[key] = (expires, value)
+                    self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return len(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __contains__(self, key):
+        return self.peek(key) is not None
+
+    def __len__(self):
+        return len(self.entries)
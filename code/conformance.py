@@ -0,0 +1,119 @@
+#!/usr/bin/python
+# coding=utf-8
+
+######   LIBRARIES ########
+import os
+import sys
+import json
+import argparse
+from local_nlu import LocalClassifier, load_workspace
+from dialog import DialogEngine
+
+######   CONSTANTS ########
+
+# Same default as CONVERSATION_WORKSPACE_FILE in smart_fridge.py
+WORKSPACE_FILE = os.environ.get('CONVERSATION_WORKSPACE_FILE', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'conversation', 'json backups',
+    'workspace-e8744a2e-ace8-43a4-b4e8-8882043e67e7_20180319_B.json'))
+# Context variables owned by each dialog runtime, not compared
+RUNTIME_CONTEXT = ('system', 'conversation_id')
+
+
+"""
+    Stub of the remote Watson Conversation service: answers each message
+    with the next recorded response (CONVERSATION_RECORD_FILE of
+    smart_fridge.py), checking that the input is the recorded one.
+"""
+class RecordedConversation():
+    def __init__(self, records):
+        self.records = records
+        self.position = 0
+
+    def message(self, workspace_id=None, message_input=None, context=None, **kwargs):
+        record = self.records[self.position]
+        self.position += 1
+        expected = record['request']['input'].get('text', '')
+        if (message_input or {}).get('text', '') != expected:
+            raise ValueError('Turn {0}: expected input {1!r}'.format(self.position, expected))
+        return record['response']
+
+
+def load_records(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# Differences between the local and the remote response of a turn. Texts chosen at random
+# by a node are only compared when both runtimes went through the same nodes.
+def differences(engine, local, remote, compare_nlu):
+    found = []
+    if compare_nlu:
+        local_intent = local['intents'][0]['intent'] if local['intents'] else None
+        remote_intent = remote['intents'][0]['intent'] if remote['intents'] else None
+        if local_intent != remote_intent:
+            found.append('intent: {0!r} != {1!r}'.format(local_intent, remote_intent))
+        local_entities = [(e['entity'], e['value']) for e in local['entities']]
+        remote_entities = [(e['entity'], e['value']) for e in remote['entities']]
+        if sorted(local_entities) != sorted(remote_entities):
+            found.append('entities: {0} != {1}'.format(local_entities, remote_entities))
+
+    for key in sorted(set(local['context']) | set(remote['context'])):
+        if key not in RUNTIME_CONTEXT and local['context'].get(key) != remote['context'].get(key):
+            found.append('context {0}: {1!r} != {2!r}'.format(key, local['context'].get(key),
+                                                             remote['context'].get(key)))
+
+    local_nodes = local['output'].get('nodes_visited')
+    remote_nodes = remote['output'].get('nodes_visited')
+    if remote_nodes is not None and local_nodes != remote_nodes:
+        found.append('nodes visited: {0} != {1}'.format(local_nodes, remote_nodes))
+
+    random_text = any(((engine.nodes[node].get('output') or {}).get('text') or {}).get('selection_policy') == 'random'
+                      for node in local_nodes if node in engine.nodes and
+                      isinstance((engine.nodes[node].get('output') or {}).get('text'), dict))
+    if not random_text and local['output']['text'] != [t for t in remote['output']['text'] if t.strip()]:
+        found.append('text: {0} != {1}'.format(local['output']['text'], remote['output']['text']))
+    return found
+
+
+# Sends every recorded turn to the stub and to the local engine. Each turn starts from the
+# recorded request context (it includes the changes made by the bot between turns), with
+# the dialog position the local engine reached in the previous turn of the conversation.
+def replay(records, engine, remote, compare_nlu=False):
+    dialog_positions = {}
+    mismatches = 0
+    for i, record in enumerate(records):
+        request = record['request']
+        remote_response = remote.message(message_input=request['input'], context=request['context'])
+
+        context = dict(request['context'] or {})
+        conversation_id = remote_response['context'].get('conversation_id')
+        if conversation_id in dialog_positions:
+            context['system'] = dialog_positions[conversation_id]
+        arguments = {} if compare_nlu else {'intents': remote_response['intents'],
+                                            'entities': remote_response['entities']}
+        local_response = engine.message(message_input=request['input'], context=context, **arguments)
+        dialog_positions[conversation_id] = local_response['context']['system']
+
+        found = differences(engine, local_response, remote_response, compare_nlu)
+        if found:
+            mismatches += 1
+            print('Turn {0} {1!r}:'.format(i + 1, request['input'].get('text', '')))
+            for difference in found:
+                print('    ' + difference)
+    print('{0} turns, {1} mismatches'.format(len(records), mismatches))
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replays recorded Watson Conversation turns '
+                                                 'against the local dialog engine')
+    parser.add_argument('records', help='file written with CONVERSATION_RECORD_FILE')
+    parser.add_argument('--workspace', default=WORKSPACE_FILE, help='exported workspace JSON')
+    parser.add_argument('--nlu', action='store_true',
+                        help='predict intents and entities locally instead of using the recorded ones')
+    args = parser.parse_args()
+
+    workspace = load_workspace(args.workspace)
+    engine = DialogEngine(workspace, LocalClassifier.from_workspace(workspace))
+    records = load_records(args.records)
+    sys.exit(1 if replay(records, engine, RecordedConversation(records), args.nlu) else 0)
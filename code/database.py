@@ -0,0 +1,171 @@
+#!/usr/bin/python
+# coding=utf-8
+
+######   LIBRARIES ########
+import os
+import time
+import threading
+from contextlib import contextmanager
+import psycopg2
+import psycopg2.pool
+import psycopg2.errors
+import psycopg2.extensions
+from metrics import span
+
+######   CONSTANTS ########
+
+# Postgres database connection string, one database for every fridge (scripts/tenants.sql).
+# Shared by the bot and the command line tools, which do not need the Slack configuration
+DB_STRING_CONNECTION = os.environ.get('DB_STRING_CONNECTION',
+                                      "host='localhost' dbname='smartfridge' user='postgres' password='postgres'")
+# Maximum number of simultaneous database connections
+DB_POOL_SIZE = 8
+# Seconds a pooled connection can stay idle before it is checked with a round trip
+DB_HEALTH_CHECK_INTERVAL = 30
+
+# Errors meaning that the connection is unusable and must be replaced
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+"""
+    Postgres connection carrying its pool bookkeeping, so it goes away
+    with the connection (an id() can be reused by a new connection)
+"""
+class PooledConnection(psycopg2.extensions.connection):
+    # the named statements are prepared on this connection
+    prepared = False
+    # last time it was returned to the pool
+    last_used = 0
+
+
+"""
+    Thread safe pool of Postgres connections. Borrowers block while
+    every connection is in use, broken connections are replaced
+    transparently, and the named statements are prepared once per
+    connection (PREPARE name AS ...) and run with EXECUTE. Every
+    connection stays open in the pool once created, so its statements
+    are not prepared again on the next checkout.
+
+    statements maps a name to (argument types, query), e.g.
+    {'top_expired': (['integer'], 'SELECT name FROM products LIMIT $1')}
+"""
+class DatabasePool():
+    def __init__(self, dsn, maxconn=DB_POOL_SIZE, statements=None):
+        self.dsn = dsn
+        self.maxconn = maxconn
+        self.statements = statements or {}
+        # last time a connection was lost: the connections used before are checked again
+        self.failed_at = 0
+        # the pool closes the returned connections above minconn
+        self.pool = psycopg2.pool.ThreadedConnectionPool(maxconn, maxconn, dsn,
+                                                         connection_factory=PooledConnection)
+        self.available = threading.BoundedSemaphore(maxconn)
+
+    @contextmanager
+    def connection(self):
+        self.available.acquire()
+        conn = None
+        try:
+            conn = self.checkout()
+            yield conn
+        except CONNECTION_ERRORS:
+            # e.g. a database restart: the other pooled connections are probably broken too
+            self.failed_at = time.time()
+            self.discard(conn)
+            conn = None
+            raise
+        except psycopg2.errors.InvalidSqlStatementName:
+            # the statements were deallocated behind the pool, prepare them again
+            conn.prepared = False
+            raise
+        finally:
+            if conn is not None:
+                conn.last_used = time.time()
+                self.pool.putconn(conn)
+            self.available.release()
+
+    # Every pooled connection may be broken, so up to maxconn of them are replaced
+    # before the connection opened last is given up
+    def checkout(self):
+        for attempt in range(self.maxconn + 1):
+            conn = self.pool.getconn()
+            if self.is_healthy(conn):
+                break
+            self.discard(conn)
+        else:
+            raise psycopg2.OperationalError('No healthy database connection')
+        if not conn.prepared:
+            conn.autocommit = True
+            try:
+                self.prepare(conn)
+            except Exception:
+                # some statements may be prepared: the connection would fail the next PREPARE
+                self.discard(conn)
+                raise
+        return conn
+
+    def is_healthy(self, conn):
+        if conn.closed:
+            return False
+        if self.failed_at < conn.last_used and time.time() - conn.last_used < DB_HEALTH_CHECK_INTERVAL:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except CONNECTION_ERRORS:
+            return False
+
+    def discard(self, conn):
+        if conn is None:
+            return
+        self.pool.putconn(conn, close=True)
+
+    def prepare(self, conn):
+        with conn.cursor() as cursor:
+            cursor.execute('DEALLOCATE ALL')
+            for name, (types, query) in self.statements.items():
+                arguments = '({})'.format(', '.join(types)) if types else ''
+                cursor.execute('PREPARE {0} {1} AS {2}'.format(name, arguments, query))
+        conn.prepared = True
+
+    # Runs a prepared statement, retrying once on a checked connection if the
+    # connection was lost (e.g. database restart) or once the statements are
+    # prepared again if they were deallocated (e.g. DISCARD ALL by a proxy)
+    def execute(self, name, params=()):
+        placeholders = '({})'.format(', '.join(['%s'] * len(params))) if params else ''
+        with span('postgres', statement=name):
+            return self.fetch_all('EXECUTE {0} {1}'.format(name, placeholders), params)
+
+    def fetch_all(self, query, params=None):
+        for attempt in range(2):
+            try:
+                with self.connection() as conn, conn.cursor() as cursor:
+                    cursor.execute(query, params)
+                    return cursor.fetchall()
+            except CONNECTION_ERRORS:
+                if attempt > 0:
+                    raise
+                print('Database connection lost, reconnecting ...')
+            except psycopg2.errors.InvalidSqlStatementName:
+                if attempt > 0:
+                    raise
+                print('Prepared statements lost, preparing them again ...')
+
+    # Runs function(cursor) in a transaction, committed if it returns and rolled back if it
+    # raises. Not retried on a lost connection: the writes may have been applied.
+    def transaction(self, function):
+        with span('postgres', statement=getattr(function, '__name__', 'transaction')):
+            with self.connection() as conn, conn.cursor() as cursor:
+                cursor.execute('BEGIN')
+                try:
+                    result = function(cursor)
+                except Exception:
+                    if not conn.closed:
+                        cursor.execute('ROLLBACK')
+                    raise
+                cursor.execute('COMMIT')
+                return result
+
+    def close(self):
+        self.pool.closeall()
@@ -0,0 +1,536 @@
+#!/usr/bin/python
+# coding=utf-8
+
+######   LIBRARIES ########
+import re
+import json
+import copy
+import uuid
+import random
+import functools
+
+######   CONSTANTS ########
+
+ROOT = 'root'
+# Intents below this confidence are irrelevant for #intent conditions (as in Watson)
+INTENT_CONFIDENCE_THRESHOLD = 0.2
+# Maximum number of nodes visited in a turn, protects from jump_to loops
+MAX_DIALOG_STEPS = 50
+
+# Node types holding a dialog response (the rest are slots, handlers and conditioned responses)
+DIALOG_TYPES = ('standard', 'frame')
+
+TOKENS = re.compile(r'\s*(?:(&&|\|\||==|!=|>=|<=|[=><!()+\-*/])|'
+                    r'(#[\w-]+)|'
+                    r'(@[\w-]+(?::[\w-]+|\.literal)?)|'
+                    r'(\$[\w-]+)|'
+                    r'("(?:[^"\\]|\\.)*"|\'[^\']*\')|'
+                    r'(\d+(?:\.\d+)?)|'
+                    r'(\w+))')
+# <? expression ?>
+EXPRESSION = re.compile(r'<\?(.*?)\?>', re.DOTALL)
+# $variable, @entity, @entity.literal or <? expression ?> inside a text
+TEMPLATE = re.compile(r'<\?(.*?)\?>|([$@][A-Za-z_][\w-]*(?:\.literal)?)', re.DOTALL)
+COMPARISONS = {'==': lambda a, b: equals(a, b),
+               '!=': lambda a, b: not equals(a, b),
+               '>': lambda a, b: compare(a, b, lambda x, y: x > y),
+               '<': lambda a, b: compare(a, b, lambda x, y: x < y),
+               '>=': lambda a, b: compare(a, b, lambda x, y: x >= y),
+               '<=': lambda a, b: compare(a, b, lambda x, y: x <= y)}
+ARITHMETIC = {'+': lambda a, b: add(a, b),
+              '-': lambda a, b: number(a) - number(b),
+              '*': lambda a, b: number(a) * number(b),
+              '/': lambda a, b: number(a) / number(b)}
+
+
+######   EXPRESSIONS ########
+
+def number(value):
+    if isinstance(value, bool) or value is None:
+        raise ValueError('{!r} is not a number'.format(value))
+    if isinstance(value, (int, float)):
+        return value
+    return float(value) if '.' in value else int(value)
+
+
+# Text concatenation when one of the operands is a text, numeric sum otherwise
+def add(a, b):
+    if isinstance(a, str) and not a.lstrip('-').replace('.', '', 1).isdigit() or \
+            isinstance(b, str) and not b.lstrip('-').replace('.', '', 1).isdigit():
+        return render(a) + render(b)
+    return number(0 if a is None else a) + number(0 if b is None else b)
+
+
+def is_true(value):
+    return value not in (None, False, '', [], {})
+
+
+# Context variables keep 'true'/'false' as strings, so booleans are compared as text
+def equals(a, b):
+    if isinstance(a, bool) and isinstance(b, str) or isinstance(b, bool) and isinstance(a, str):
+        return str(a).lower() == str(b).lower()
+    if a is None or b is None or isinstance(a, bool) or isinstance(b, bool):
+        return a == b
+    try:
+        return number(a) == number(b)
+    except ValueError:
+        return a == b
+
+
+def compare(a, b, operator):
+    try:
+        return operator(number(a), number(b))
+    except (ValueError, TypeError):
+        return False
+
+
+def render(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return str(value)
+
+
+"""
+    Compiles a condition or a context expression of the workspace
+    (#intent, @entity, @entity:value, @entity.literal, $variable, literals,
+    comparisons, && || !, arithmetic and $variable = expression) into a
+    function of the Turn being processed.
+"""
+class Parser():
+    def __init__(self, source):
+        self.source = source
+        self.tokens = []
+        position = 0
+        source = source.rstrip()
+        while position < len(source):
+            match = TOKENS.match(source, position)
+            if match is None or match.end() == position:
+                raise ValueError('Unexpected character in {!r} at {}'.format(self.source, position))
+            self.tokens.append(match.group(match.lastindex))
+            position = match.end()
+        self.position = 0
+
+    def parse(self):
+        expression = self.assignment()
+        if self.peek() is not None:
+            raise ValueError('Unexpected {!r} in {!r}'.format(self.peek(), self.source))
+        return expression
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def assignment(self):
+        token = self.peek()
+        if token and token.startswith('$') and self.position + 1 < len(self.tokens) \
+                and self.tokens[self.position + 1] == '=':
+            self.position += 2
+            variable = token[1:]
+            value = self.assignment()
+
+            def assign(turn):
+                turn.context[variable] = value(turn)
+                return turn.context[variable]
+            return assign
+        return self.logical_or()
+
+    def logical_or(self):
+        left = self.logical_and()
+        while self.peek() == '||':
+            self.next()
+            left = (lambda a, b: lambda turn: is_true(a(turn)) or is_true(b(turn)))(left, self.logical_and())
+        return left
+
+    def logical_and(self):
+        left = self.negation()
+        while self.peek() == '&&':
+            self.next()
+            left = (lambda a, b: lambda turn: is_true(a(turn)) and is_true(b(turn)))(left, self.negation())
+        return left
+
+    def negation(self):
+        if self.peek() == '!':
+            self.next()
+            operand = self.negation()
+            return lambda turn: not is_true(operand(turn))
+        return self.comparison()
+
+    def comparison(self):
+        left = self.additive()
+        if self.peek() in COMPARISONS:
+            operator = COMPARISONS[self.next()]
+            right = self.additive()
+            return lambda turn: operator(left(turn), right(turn))
+        return left
+
+    def additive(self):
+        left = self.multiplicative()
+        while self.peek() in ('+', '-'):
+            operator = ARITHMETIC[self.next()]
+            left = (lambda a, b, op: lambda turn: op(a(turn), b(turn)))(left, self.multiplicative(), operator)
+        return left
+
+    def multiplicative(self):
+        left = self.operand()
+        while self.peek() in ('*', '/'):
+            operator = ARITHMETIC[self.next()]
+            left = (lambda a, b, op: lambda turn: op(a(turn), b(turn)))(left, self.operand(), operator)
+        return left
+
+    def operand(self):
+        token = self.next()
+        if token is None:
+            raise ValueError('Unexpected end of {!r}'.format(self.source))
+        if token == '(':
+            expression = self.logical_or()
+            if self.next() != ')':
+                raise ValueError('Missing ) in {!r}'.format(self.source))
+            return expression
+        if token == '-':
+            operand = self.operand()
+            return lambda turn: -number(operand(turn))
+        if token.startswith('#'):
+            return lambda turn: turn.intent == token[1:]
+        if token.startswith('@'):
+            if token.endswith('.literal'):
+                return lambda turn: turn.entity_literal(token[1:-len('.literal')])
+            if ':' in token:
+                entity, value = token[1:].split(':', 1)
+                return lambda turn: turn.has_entity_value(entity, value)
+            return lambda turn: turn.entity_value(token[1:])
+        if token.startswith('$'):
+            return lambda turn: turn.context.get(token[1:])
+        if token[0] in '"\'':
+            value = token[1:-1].replace('\\"', '"')
+            return lambda turn: value
+        if token[0].isdigit():
+            value = float(token) if '.' in token else int(token)
+            return lambda turn: value
+        constants = {'true': True, 'false': False, 'null': None}
+        if token in constants:
+            return lambda turn: constants[token]
+        if token == 'welcome':
+            return lambda turn: turn.first
+        if token == 'anything_else':
+            return lambda turn: True
+        raise ValueError('Unsupported {!r} in {!r}'.format(token, self.source))
+
+
+@functools.lru_cache(maxsize=None)
+def compile_expression(source):
+    return Parser(source).parse()
+
+
+# Context values and texts: '<? expression ?>' and '$variable' / '@entity' alone keep the
+# type of their value, anything else is a text where they are replaced
+def evaluate_template(template, turn):
+    if isinstance(template, dict):
+        return {key: evaluate_template(value, turn) for key, value in template.items()}
+    if isinstance(template, list):
+        return [evaluate_template(value, turn) for value in template]
+    if not isinstance(template, str):
+        return template
+    match = TEMPLATE.fullmatch(template.strip())
+    if match is not None:
+        return compile_expression(match.group(1) or match.group(2))(turn)
+    return TEMPLATE.sub(lambda m: render(compile_expression(m.group(1) or m.group(2))(turn)), template)
+
+
+"""
+    Input of a turn: text, intents and entities in the Watson format and
+    the context, updated in place by the visited nodes.
+"""
+class Turn():
+    def __init__(self, text, intents, entities, context, first):
+        self.text = text
+        self.entities = entities
+        self.context = context
+        self.first = first
+        self.intent = None
+        if len(intents) > 0 and intents[0]['confidence'] >= INTENT_CONFIDENCE_THRESHOLD:
+            self.intent = intents[0]['intent']
+
+    def entity(self, name):
+        for entity in self.entities:
+            if entity['entity'] == name:
+                return entity
+        return None
+
+    def entity_value(self, name):
+        entity = self.entity(name)
+        return entity['value'] if entity else None
+
+    def entity_literal(self, name):
+        entity = self.entity(name)
+        return self.text[entity['location'][0]:entity['location'][1]] if entity else None
+
+    def has_entity_value(self, name, value):
+        return any(e['entity'] == name and e['value'] == value for e in self.entities)
+
+
+"""
+    Runs the dialog of an exported Watson Conversation workspace in
+    process. message() takes and returns the same input, context,
+    intents, entities and output as the Conversation message API, so it
+    can replace ConversationV1.message. Intents and entities are given
+    by the caller or predicted with the classifier (a LocalClassifier).
+
+    Supported: standard nodes, frames with slots (input, focus, filled
+    and nomatch handlers, slots without prompt are optional), conditioned
+    responses, jump_to (condition, body and user_input), sequential and
+    random text selection and <? ?> context expressions. When no child of
+    the current node matches, the dialog falls back to the root nodes;
+    digressions do not return.
+
+    The conditions are compiled once and indexed by intent: the
+    candidates of a node for the top intent of a turn are precomputed,
+    so nodes conditioned on other intents are never evaluated.
+"""
+class DialogEngine():
+    def __init__(self, workspace, classifier=None):
+        self.workspace = workspace
+        self.classifier = classifier
+        self.random = random.Random()
+
+        self.nodes = {n['dialog_node']: n for n in workspace['dialog_nodes'] if not n.get('disabled')}
+        # parent -> enabled children in dialog order, every type
+        self.children = {}
+        siblings = {}
+        for node in workspace['dialog_nodes']:
+            siblings.setdefault(node.get('parent') or ROOT, []).append(node)
+        for parent, nodes in siblings.items():
+            self.children[parent] = [n['dialog_node'] for n in self.sibling_order(nodes)
+                                     if n['dialog_node'] in self.nodes]
+
+        self.conditions = {}
+        for node_id, node in self.nodes.items():
+            source = node.get('conditions')
+            self.conditions[node_id] = compile_expression(source) if source else (lambda turn: True)
+
+        # parent -> {intent or None -> candidate dialog nodes in order}
+        self.candidates = {}
+        for parent in self.children:
+            dialog_nodes = self.dialog_children(parent)
+            intents = {self.intent_condition(n) for n in dialog_nodes} - {None}
+            index = {None: [n for n in dialog_nodes if self.intent_condition(n) is None]}
+            for intent in intents:
+                index[intent] = [n for n in dialog_nodes if self.intent_condition(n) in (None, intent)]
+            self.candidates[parent] = index
+
+    @staticmethod
+    def sibling_order(nodes):
+        following = {n.get('previous_sibling'): n for n in nodes}
+        ids = {n['dialog_node'] for n in nodes}
+        ordered = []
+        node = next((n for n in nodes if n.get('previous_sibling') not in ids), None)
+        while node is not None and len(ordered) < len(nodes):
+            ordered.append(node)
+            node = following.get(node['dialog_node'])
+        return ordered if len(ordered) == len(nodes) else nodes
+
+    def children_of_type(self, node_id, types):
+        return [c for c in self.children.get(node_id, []) if self.nodes[c]['type'] in types]
+
+    def dialog_children(self, node_id):
+        return self.children_of_type(node_id, DIALOG_TYPES)
+
+    # Intent of a '#intent' condition, None for any other condition
+    def intent_condition(self, node_id):
+        match = re.fullmatch(r'\s*#([\w-]+)\s*', self.nodes[node_id].get('conditions') or '')
+        return match.group(1) if match else None
+
+    def handlers(self, node_id, event_name):
+        return [self.nodes[h] for h in self.children_of_type(node_id, ('event_handler',))
+                if self.nodes[h].get('event_name') == event_name]
+
+    ######   MESSAGE ########
+
+    def message(self, workspace_id=None, message_input=None, context=None, entities=None,
+                intents=None, output=None, alternate_intents=False, **kwargs):
+        message_input = message_input or {}
+        text = message_input.get('text', '')
+        context = copy.deepcopy(context) if context else {}
+        context.setdefault('conversation_id', str(uuid.uuid4()))
+        system = context.setdefault('system', {})
+        first = 'dialog_stack' not in system
+
+        if intents is None or entities is None:
+            predicted_intents, predicted_entities = [], []
+            if self.classifier is not None and text.strip() != '':
+                predicted_intents, predicted_entities = self.classifier.classify(text)
+            intents = predicted_intents if intents is None else intents
+            entities = predicted_entities if entities is None else entities
+
+        turn = Turn(text, intents, entities, context, first)
+        output = {'text': [], 'nodes_visited': [], 'log_messages': []}
+        self.run(turn, output)
+        system['dialog_turn_counter'] = system.get('dialog_turn_counter', 0) + 1
+        system['dialog_request_counter'] = system.get('dialog_request_counter', 0) + 1
+
+        return {'input': message_input,
+                'intents': intents if alternate_intents else intents[:1],
+                'entities': entities,
+                'context': context,
+                'output': output,
+                'alternate_intents': alternate_intents}
+
+    def run(self, turn, output):
+        system = turn.context['system']
+        stack = system.get('dialog_stack') or [{'dialog_node': ROOT}]
+        top = stack[-1]
+        node_id = top['dialog_node'] if top['dialog_node'] in self.nodes else ROOT
+
+        if node_id != ROOT and top.get('state') == 'in_progress':
+            step = self.fill_slots(node_id, turn, output, top.get('slot'))
+        else:
+            if node_id != ROOT and top.get('state') == 'user_input':
+                match = self.first_match(self.following_siblings(node_id), turn)
+            else:
+                match = self.first_match(self.candidates_of(node_id, turn), turn)
+            if match is None and node_id != ROOT:
+                match = self.first_match(self.candidates_of(ROOT, turn), turn)
+            step = ('visit', match) if match else ('wait', {'dialog_node': ROOT})
+
+        for _ in range(MAX_DIALOG_STEPS):
+            if step[0] == 'wait':
+                system['dialog_stack'] = [step[1]]
+                system['branch_exited'] = step[1]['dialog_node'] == ROOT
+                if system['branch_exited']:
+                    system['branch_exited_reason'] = 'completed'
+                else:
+                    system.pop('branch_exited_reason', None)
+                return
+            step = self.visit(step[1], turn, output)
+        raise RuntimeError('Dialog loop visiting {}'.format(output['nodes_visited'][-MAX_DIALOG_STEPS:]))
+
+    def candidates_of(self, node_id, turn):
+        index = self.candidates.get(node_id, {None: []})
+        return index.get(turn.intent, index[None])
+
+    # The node and the dialog nodes after it, for jump_to
+    def following_siblings(self, node_id):
+        parent = self.nodes[node_id].get('parent') or ROOT
+        siblings = self.dialog_children(parent)
+        return siblings[siblings.index(node_id):]
+
+    def first_match(self, node_ids, turn):
+        for node_id in node_ids:
+            if is_true(self.conditions[node_id](turn)):
+                return node_id
+        return None
+
+    ######   NODES ########
+
+    def visit(self, node_id, turn, output):
+        output['nodes_visited'].append(node_id)
+        if self.children_of_type(node_id, ('slot',)):
+            return self.fill_slots(node_id, turn, output)
+        return self.respond(node_id, turn, output)
+
+    # Fills the slots of a frame with the input. Waits in the frame while a slot
+    # with prompt is empty, otherwise continues with the response of the frame.
+    def fill_slots(self, node_id, turn, output, focused=None):
+        filled = []
+        missing = []
+        for slot_id in self.children_of_type(node_id, ('slot',)):
+            variable = (self.nodes[slot_id].get('variable') or '').lstrip('$')
+            if not variable:
+                continue
+            for handler in self.handlers(slot_id, 'input'):
+                if handler.get('conditions') and is_true(compile_expression(handler['conditions'])(turn)):
+                    for key, value in (handler.get('context') or {}).items():
+                        turn.context[key] = evaluate_template(value, turn)
+                    if turn.context.get(variable) is not None:
+                        filled.append(slot_id)
+                    break
+            prompts = self.handlers(slot_id, 'focus')
+            if turn.context.get(variable) is None and prompts and self.has_text(prompts[0]):
+                missing.append(slot_id)
+
+        for slot_id in filled:
+            for handler in self.handlers(slot_id, 'filled'):
+                self.add_text(handler, turn, output)
+
+        if missing:
+            slot_id = missing[0]
+            nomatch = self.handlers(slot_id, 'nomatch')
+            frame_prompt = self.handlers(node_id, 'focus')
+            if focused == slot_id and not filled and nomatch and self.has_text(nomatch[0]):
+                self.add_text(nomatch[0], turn, output)
+            elif focused is None and not filled and frame_prompt and self.has_text(frame_prompt[0]):
+                self.add_text(frame_prompt[0], turn, output)
+            else:
+                self.add_text(self.handlers(slot_id, 'focus')[0], turn, output)
+            return ('wait', {'dialog_node': node_id, 'state': 'in_progress', 'slot': slot_id})
+        return self.respond(node_id, turn, output)
+
+    def respond(self, node_id, turn, output):
+        node = self.nodes[node_id]
+        for key, value in (node.get('context') or {}).items():
+            turn.context[key] = evaluate_template(value, turn)
+
+        # Multiple conditioned responses replace the output of the node
+        if ((node.get('metadata') or {}).get('_customization') or {}).get('mcr'):
+            for response_id in self.children_of_type(node_id, ('response_condition',)):
+                if is_true(self.conditions[response_id](turn)):
+                    response = self.nodes[response_id]
+                    for key, value in (response.get('context') or {}).items():
+                        turn.context[key] = evaluate_template(value, turn)
+                    self.add_text(response, turn, output)
+                    break
+        else:
+            self.add_text(node, turn, output)
+
+        next_step = node.get('next_step') or {}
+        if next_step.get('behavior') == 'jump_to' and next_step.get('dialog_node') in self.nodes:
+            target = next_step['dialog_node']
+            if next_step.get('selector') == 'user_input':
+                return ('wait', {'dialog_node': target, 'state': 'user_input'})
+            if next_step.get('selector') == 'body':
+                return ('visit', target)
+            match = self.first_match(self.following_siblings(target), turn) or \
+                    self.first_match(self.candidates_of(ROOT, turn), turn)
+            return ('visit', match) if match else ('wait', {'dialog_node': ROOT})
+        if self.dialog_children(node_id):
+            return ('wait', {'dialog_node': node_id})
+        return ('wait', {'dialog_node': ROOT})
+
+    ######   OUTPUT ########
+
+    def has_text(self, node):
+        text = (node.get('output') or {}).get('text')
+        if isinstance(text, dict):
+            return any(value.strip() for value in text.get('values') or [])
+        return bool(text and text.strip())
+
+    def add_text(self, node, turn, output):
+        text = (node.get('output') or {}).get('text')
+        if isinstance(text, str):
+            values = [text]
+        elif isinstance(text, dict) and text.get('values'):
+            values = text['values']
+            policy = text.get('selection_policy', 'sequential')
+            if policy == 'random':
+                values = [self.random.choice(values)]
+            elif policy != 'multiline':
+                # Watson keeps the last sequential response of each node in the context
+                output_map = turn.context['system'].setdefault('_node_output_map', {})
+                index = output_map.get(node['dialog_node'], [-1])[0] + 1
+                output_map[node['dialog_node']] = [index % len(values)]
+                values = [values[index % len(values)]]
+        else:
+            return
+        for value in values:
+            value = render(evaluate_template(value, turn))
+            if value.strip():
+                output['text'].append(value)
@@ -0,0 +1,208 @@
+#!/usr/bin/python
+# coding=utf-8
+
+######   LIBRARIES ########
+import os
+import hmac
+import json
+import time
+import zlib
+import queue
+import hashlib
+import argparse
+import threading
+import multiprocessing
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from cache import TTLCache
+
+######   CONSTANTS ########
+
+# Slack app signing secret, used to verify that the events come from Slack (required: with an
+# empty secret anyone could sign events)
+SLACK_SIGNING_SECRET = os.environ.get('SLACK_SIGNING_SECRET')
+# Port of the Events API request URL (http://<host>:<port>/slack/events)
+EVENTS_PORT = int(os.environ.get('EVENTS_PORT', 3000))
+# Worker processes running the bot (default: one per core)
+EVENT_WORKERS = int(os.environ.get('EVENT_WORKERS', os.cpu_count() or 1))
+# Requests signed more than this many seconds ago are rejected (replay protection)
+MAX_REQUEST_AGE = 5 * 60
+# Seconds an event id is remembered: Slack retries an event for about one hour
+EVENT_ID_TTL = 60 * 60
+# Event ids (and message timestamps) remembered at most
+MAX_EVENT_IDS = 100000
+# Events waiting for each worker; when full the event is refused and Slack retries it
+WORKER_QUEUE_SIZE = 10000
+
+
+# Slack request signature: v0=HMAC-SHA256(secret, 'v0:' + timestamp + ':' + body)
+def slack_signature(secret, timestamp, body):
+    base = b'v0:' + str(timestamp).encode() + b':' + body
+    return 'v0=' + hmac.new(secret.encode(), base, hashlib.sha256).hexdigest()
+
+
+def verify_signature(secret, timestamp, body, signature, now=None):
+    try:
+        age = abs((now or time.time()) - int(timestamp))
+    except (TypeError, ValueError):
+        return False
+    if age > MAX_REQUEST_AGE:
+        return False
+    return hmac.compare_digest(slack_signature(secret, timestamp, body), signature or '')
+
+
+# Event of an Events API callback in the shape of an RTM event
+def rtm_event(payload):
+    event = dict(payload.get('event') or {})
+    event.setdefault('team', payload.get('team_id'))
+    if 'file' not in event and event.get('files'):
+        event['file'] = event['files'][0]
+    return event
+
+
+"""
+    Receives Slack Events API callbacks, verifies their signature,
+    drops the events already received (Slack retries, and the same
+    message delivered as 'message' and 'app_mention') and puts every
+    command, filtered by parse(events), on the queue of a worker.
+
+    Every channel goes to the same worker, so its commands keep their
+    order and the conversation session of its users stays in a single
+    process. handle() answers at once; the commands run in the workers.
+    Requests are handled by concurrent threads: an event is checked,
+    queued and marked as seen under a lock, so a retry arriving at the
+    same time as the original is dropped.
+"""
+class EventIngress():
+    def __init__(self, secret, queues, parse):
+        if not secret:
+            raise ValueError('A Slack signing secret is required')
+        self.secret = secret
+        self.queues = queues
+        self.parse = parse
+        self.lock = threading.Lock()
+        self.seen = TTLCache(maxsize=MAX_EVENT_IDS, ttl=EVENT_ID_TTL)
+        self.received = 0
+        self.duplicates = 0
+
+    def route(self, channel):
+        return self.queues[zlib.crc32((channel or '').encode()) % len(self.queues)]
+
+    # Returns the HTTP status and body of the answer to Slack
+    def handle(self, headers, body):
+        if not verify_signature(self.secret, headers.get('X-Slack-Request-Timestamp'), body,
+                                headers.get('X-Slack-Signature')):
+            return 401, b'invalid signature'
+        try:
+            payload = json.loads(body.decode('utf-8'))
+        except ValueError:
+            return 400, b'invalid json'
+
+        if payload.get('type') == 'url_verification':
+            return 200, payload.get('challenge', '').encode()
+        if payload.get('type') != 'event_callback':
+            return 200, b''
+
+        event = rtm_event(payload)
+        keys = [payload.get('event_id'), '{0}:{1}'.format(event.get('channel'), event.get('ts'))]
+        with self.lock:
+            if any(key in self.seen for key in keys) or event.get('bot_id'):
+                self.duplicates += 1
+                return 200, b''
+            try:
+                for command, event in self.parse([event]):
+                    self.route(event.get('channel')).put_nowait((command, event))
+            except queue.Full:
+                # not marked as seen, so the retry of Slack is accepted
+                return 503, b'busy'
+            for key in keys:
+                self.seen.set(key, True)
+            self.received += 1
+        return 200, b''
+
+
+class EventsHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path.split('?')[0] != '/slack/events':
+            self.send_error(404)
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        status, answer = self.server.ingress.handle(self.headers, body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(answer)))
+        self.end_headers()
+        self.wfile.write(answer)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class EventsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, ingress, host='0.0.0.0', port=EVENTS_PORT):
+        super().__init__((host, port), EventsHandler)
+        self.ingress = ingress
+
+
+# Worker process: runs the bot on the commands of its queue until it receives None
+def run_bot_worker(number, commands):
+    from smart_fridge import SmartFridge, ChannelDispatcher
+
+    smartfridge = SmartFridge()
+    smartfridge.start_expiry_tracker(digests=number == 0)
+    smartfridge.start_recipe_index()
+    smartfridge.start_session_purge()
+    smartfridge.start_metrics(worker=number)
+    dispatcher = ChannelDispatcher()
+    while True:
+        item = commands.get()
+        if item is None:
+            break
+        command, event = item
+        dispatcher.submit(event['channel'], smartfridge.handle_command, command,
+                          event['channel'], event.get('user'), event.get('team'), event.get('file'))
+    dispatcher.shutdown(wait=True)
+    smartfridge.outbox.flush()
+    # worker processes exit without running the atexit handlers
+    smartfridge.sessions.flush()
+
+
+# Starts n_workers processes running worker(number, queue), one queue each
+def start_workers(n_workers, worker=run_bot_worker):
+    queues = [multiprocessing.Queue(WORKER_QUEUE_SIZE) for _ in range(n_workers)]
+    processes = [multiprocessing.Process(target=worker, args=(number, commands), daemon=True)
+                 for number, commands in enumerate(queues)]
+    for process in processes:
+        process.start()
+    return queues, processes
+
+
+def stop_workers(queues, processes, timeout=None):
+    for commands in queues:
+        commands.put(None)
+    for process in processes:
+        process.join(timeout)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Receives Slack events over HTTP (Events API) '
+                                                 'and runs the bot in several worker processes')
+    parser.add_argument('--port', type=int, default=EVENTS_PORT)
+    parser.add_argument('--workers', type=int, default=EVENT_WORKERS)
+    args = parser.parse_args()
+    if not SLACK_SIGNING_SECRET:
+        parser.error('SLACK_SIGNING_SECRET is not set (Slack app > Basic Information > Signing Secret)')
+
+    from smart_fridge import slack_commands
+
+    queues, processes = start_workers(args.workers)
+    server = EventsServer(EventIngress(SLACK_SIGNING_SECRET, queues, slack_commands), port=args.port)
+    print('smartfridge listening for Slack events on port {0} with {1} workers'.format(args.port, args.workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        stop_workers(queues, processes)
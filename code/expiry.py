@@ -0,0 +1,256 @@
+#!/usr/bin/python
+# coding=utf-8
+
+######   LIBRARIES ########
+import heapq
+import datetime
+import threading
+from collections import defaultdict
+
+######   CONSTANTS ########
+
+# Seconds between two incremental refreshes (products modified since the last one)
+EXPIRY_REFRESH_INTERVAL = 60
+# Seconds between two full reloads, needed to notice deleted products
+EXPIRY_FULL_RELOAD_INTERVAL = 60 * 60
+# Seconds read again before the last modification seen by each refresh. products.modified is
+# the start time of the writing transaction, so a write committed after a later one would
+# otherwise be skipped. Longer transactions are picked up by the next full reload
+EXPIRY_REFRESH_OVERLAP = 5 * 60
+
+FRESH = 'fresh'
+TO_EXPIRE = 'to_expire'
+EXPIRED = 'expired'
+
+
+"""
+    Keeps the expiration state of every product in memory. Products
+    not expired yet wait in expiration-ordered heaps, so each tick only
+    looks at the ones crossing the DAYS_TO_EXPIRE window or expiring.
+    The state is refreshed incrementally from products.modified through
+    the prepared statements 'products_modified_since' and 'products_expiry'.
+    Each refresh reads again the last EXPIRY_REFRESH_OVERLAP seconds; the
+    rows already known are skipped by id.
+    Connected to the change feed of the inventory (apply_changes), every
+    write is applied as soon as it is committed instead of at the next tick.
+    The products of every fridge are kept, the summary and the inventory
+    are given per fridge.
+
+    on_change(fridge_id, expired, to_expire) receives, for every fridge,
+    the names of the products that changed bucket since the previous tick.
+"""
+class ExpiryTracker():
+    def __init__(self, database, days_to_expire, on_change=None, interval=EXPIRY_REFRESH_INTERVAL):
+        self.database = database
+        self.days_to_expire = days_to_expire
+        self.on_change = on_change
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.ready = False
+
+        # id -> (name, expiration_date, quantity)
+        self.products = {}
+        # id -> fridge_id, and fridge_id -> ids of its products
+        self.fridge_of = {}
+        self.fridge_products = defaultdict(set)
+        # id -> FRESH, TO_EXPIRE or EXPIRED
+        self.state = {}
+        # (expiration_date, id) of fresh products and of products to expire
+        self.fresh_heap = []
+        self.to_expire_heap = []
+        self.last_modified = None
+        self.last_full_reload = None
+        # fridge_id -> names of the products that changed bucket since the last tick: (expired, to expire)
+        self.changes = defaultdict(lambda: ([], []))
+        # fridge_id -> (n_products, expired names, to expire names), rebuilt only after a change
+        self.cached_summary = {}
+
+    def start(self):
+        self.reload()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.tick()
+            except Exception as inst:
+                print('Expiry tracker: {}'.format(inst))
+
+    def tick(self):
+        if (datetime.datetime.now() - self.last_full_reload).total_seconds() >= EXPIRY_FULL_RELOAD_INTERVAL:
+            self.reload()
+        else:
+            self.refresh()
+        self.advance()
+        with self.lock:
+            changes = self.changes
+            self.changes = defaultdict(lambda: ([], []))
+        if self.on_change:
+            for fridge_id, (expired, to_expire) in sorted(changes.items()):
+                self.on_change(fridge_id, sorted(expired), sorted(to_expire))
+
+    # Day boundaries: expired means date(expiration_date) <= current_date and to expire means
+    # current_date < date(expiration_date) <= current_date + days_to_expire
+    def boundaries(self):
+        now = datetime.datetime.now(datetime.timezone.utc).astimezone()
+        tomorrow = now.replace(hour=0, minute=0, second=0, microsecond=0) + datetime.timedelta(days=1)
+        return tomorrow, tomorrow + datetime.timedelta(days=self.days_to_expire)
+
+    def classify(self, expiration_date):
+        expired_before, to_expire_before = self.boundaries()
+        if expiration_date < expired_before:
+            return EXPIRED
+        if expiration_date < to_expire_before:
+            return TO_EXPIRE
+        return FRESH
+
+    # Loads every product again (initial state, no alerts)
+    def reload(self):
+        rows = self.database.execute('products_expiry')
+        with self.lock:
+            self.products = {}
+            self.fridge_of = {}
+            self.fridge_products = defaultdict(set)
+            self.state = {}
+            self.fresh_heap = []
+            self.to_expire_heap = []
+            self.cached_summary = {}
+            self.last_modified = None
+            self.update(rows, notify=False)
+            self.last_full_reload = datetime.datetime.now()
+            self.ready = True
+
+    def refresh(self):
+        if self.last_modified is None:
+            return self.reload()
+        since = self.last_modified - datetime.timedelta(seconds=EXPIRY_REFRESH_OVERLAP)
+        rows = self.database.execute('products_modified_since', (since,))
+        with self.lock:
+            self.update(rows)
+
+    def update(self, rows, notify=True):
+        for product_id, fridge_id, name, expiration_date, quantity, modified in rows:
+            if modified is not None and (self.last_modified is None or modified > self.last_modified):
+                self.last_modified = modified
+            if self.fridge_of.get(product_id) == fridge_id and \
+                    self.products.get(product_id) == (name, expiration_date, quantity):
+                # read again by the refresh overlap
+                continue
+            if self.fridge_of.get(product_id, fridge_id) != fridge_id:
+                self.forget(product_id)
+            self.products[product_id] = (name, expiration_date, quantity)
+            self.fridge_of[product_id] = fridge_id
+            self.fridge_products[fridge_id].add(product_id)
+            self.cached_summary.pop(fridge_id, None)
+            if expiration_date is None:
+                self.state.pop(product_id, None)
+            else:
+                state = self.classify(expiration_date)
+                if notify and state != FRESH and self.state.get(product_id) != state:
+                    self.changes[fridge_id][0 if state == EXPIRED else 1].append(name)
+                self.state[product_id] = state
+                if state == FRESH:
+                    heapq.heappush(self.fresh_heap, (expiration_date, product_id))
+                elif state == TO_EXPIRE:
+                    heapq.heappush(self.to_expire_heap, (expiration_date, product_id))
+        self.prune()
+
+    # Moves the products whose expiration date has been reached by the window or by today,
+    # recording the change for the fridge. Heap entries of modified products are outdated and skipped.
+    def advance(self):
+        expired_before, to_expire_before = self.boundaries()
+        with self.lock:
+            while self.fresh_heap and self.fresh_heap[0][0] < to_expire_before:
+                expiration_date, product_id = heapq.heappop(self.fresh_heap)
+                if not self.is_current(product_id, expiration_date, FRESH):
+                    continue
+                if expiration_date < expired_before:
+                    self.move(product_id, EXPIRED)
+                else:
+                    self.move(product_id, TO_EXPIRE)
+                    heapq.heappush(self.to_expire_heap, (expiration_date, product_id))
+
+            while self.to_expire_heap and self.to_expire_heap[0][0] < expired_before:
+                expiration_date, product_id = heapq.heappop(self.to_expire_heap)
+                if not self.is_current(product_id, expiration_date, TO_EXPIRE):
+                    continue
+                self.move(product_id, EXPIRED)
+            self.prune()
+
+    def move(self, product_id, state):
+        fridge_id = self.fridge_of[product_id]
+        self.state[product_id] = state
+        self.changes[fridge_id][0 if state == EXPIRED else 1].append(self.products[product_id][0])
+        self.cached_summary.pop(fridge_id, None)
+
+    def is_current(self, product_id, expiration_date, state):
+        product = self.products.get(product_id)
+        return product is not None and product[1] == expiration_date and self.state.get(product_id) == state
+
+    # Notifications of the inventory ChangeFeed: 'upsert' reads the modified products,
+    # 'delete:<id>' drops the product, None (notifications missed) reloads everything
+    def apply_changes(self, notifications):
+        if notifications is None:
+            return self.reload()
+        deleted = [int(n.split(':', 1)[1]) for n in notifications if n.startswith('delete:')]
+        if deleted:
+            self.remove(deleted)
+        if 'upsert' in notifications:
+            self.refresh()
+
+    # Heap entries of removed products are outdated and skipped by advance
+    def remove(self, product_ids):
+        with self.lock:
+            for product_id in product_ids:
+                self.forget(product_id)
+            self.prune()
+
+    # Outdated heap entries are only dropped when they reach the top. When they are
+    # the majority the heaps are rebuilt from the current state, so they do not pile up
+    def prune(self):
+        if len(self.fresh_heap) + len(self.to_expire_heap) <= 2 * len(self.state):
+            return
+        self.fresh_heap = [(self.products[product_id][1], product_id)
+                           for product_id, state in self.state.items() if state == FRESH]
+        self.to_expire_heap = [(self.products[product_id][1], product_id)
+                               for product_id, state in self.state.items() if state == TO_EXPIRE]
+        heapq.heapify(self.fresh_heap)
+        heapq.heapify(self.to_expire_heap)
+
+    def forget(self, product_id):
+        fridge_id = self.fridge_of.pop(product_id, None)
+        self.products.pop(product_id, None)
+        self.state.pop(product_id, None)
+        if fridge_id is not None:
+            self.fridge_products[fridge_id].discard(product_id)
+            if not self.fridge_products[fridge_id]:
+                del self.fridge_products[fridge_id]
+            self.cached_summary.pop(fridge_id, None)
+
+    # Same rows as the 'fridge_inventory' statement, from memory
+    def inventory(self, fridge_id):
+        with self.lock:
+            return [self.products[product_id] for product_id in self.fridge_products.get(fridge_id, ())]
+
+    # Same values as the 'inventory_summary' statement, from memory
+    def summary(self, fridge_id):
+        with self.lock:
+            summary = self.cached_summary.get(fridge_id)
+            if summary is None:
+                expired = []
+                to_expire = []
+                product_ids = self.fridge_products.get(fridge_id, ())
+                for product_id in product_ids:
+                    state = self.state.get(product_id)
+                    if state == EXPIRED:
+                        expired.append(self.products[product_id][0])
+                    elif state == TO_EXPIRE:
+                        to_expire.append(self.products[product_id][0])
+                summary = self.cached_summary[fridge_id] = (len(product_ids), sorted(expired), sorted(to_expire))
+            return summary
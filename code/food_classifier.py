@@ -0,0 +1,223 @@
+#!/usr/bin/python
+# coding=utf-8
+
+######   LIBRARIES ########
+import io
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+# NumPy, Pillow and ONNX Runtime are only needed by the local classifier
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+######   CONSTANTS ########
+
+# Maximum number of images classified together by the local model
+FOOD_BATCH_SIZE = 16
+# Seconds an image waits for other images to fill its batch
+FOOD_BATCH_WAIT = 0.01
+# Seconds a batched image waits for its classification (queue and backend call included)
+FOOD_CLASSIFY_TIMEOUT = 30
+# Name and content type of the images sent to Watson Visual Recognition, which it cannot
+# guess from an in-memory file
+WATSON_IMAGE_FILENAME = 'food.jpg'
+WATSON_IMAGE_CONTENT_TYPE = 'image/jpeg'
+# Normalization of the ONNX models (ImageNet statistics)
+ONNX_MEAN = (0.485, 0.456, 0.406)
+ONNX_STD = (0.229, 0.224, 0.225)
+
+
+# Re-encodes the image as JPEG when it is wider or higher than max_side, so
+# uploads and decoding do not depend on the camera resolution
+def downscale_image(data, max_side, quality=85):
+    if Image is None:
+        return data
+    try:
+        with Image.open(io.BytesIO(data)) as picture:
+            if max(picture.size) <= max_side:
+                return data
+            picture.draft('RGB', (max_side, max_side))
+            picture = picture.convert('RGB')
+            picture.thumbnail((max_side, max_side), Image.BILINEAR)
+            output = io.BytesIO()
+            picture.save(output, format='JPEG', quality=quality)
+            return output.getvalue()
+    except (OSError, ValueError) as inst:
+        print('Image not downscaled: {}'.format(inst))
+        return data
+
+
+def open_image(image):
+    # image: path of the file or its content
+    return open(image, 'rb') if isinstance(image, str) else io.BytesIO(image)
+
+
+"""
+    Food classifier backed by the hosted Watson Visual Recognition
+    'food' classifier. classify(images) takes file paths or image
+    contents and returns one (food, score) per image, (None, None) when
+    nothing is recognized. Each image is a remote call.
+"""
+class WatsonFoodClassifier():
+    def __init__(self, visual_recognition, transport):
+        self.visual_recognition = visual_recognition
+        self.transport = transport
+
+    def classify(self, images):
+        return [self.classify_image(image) for image in images]
+
+    def classify_image(self, image):
+        with open_image(image) as image_file:
+            def classify():
+                # a retry must upload the whole image again
+                image_file.seek(0)
+                return self.visual_recognition.classify(images_file=image_file, classifier_ids=['food'],
+                                                        images_filename=WATSON_IMAGE_FILENAME,
+                                                        images_file_content_type=WATSON_IMAGE_CONTENT_TYPE)
+
+            vr_response = self.transport.call(classify)
+            if vr_response['images'] and len(vr_response['images']) > 0:
+                image = vr_response['images'][0]
+                if image['classifiers'] and len(image['classifiers']) > 0:
+                    classifier = image['classifiers'][0]
+                    if classifier['classes'] and len(classifier['classes']) > 0:
+                        food = classifier['classes'][0]['class']
+                        score = classifier['classes'][0]['score']
+                        return food, score
+        return None, None
+
+
+"""
+    On-CPU food classifier, loaded once and run without network.
+    Two model formats are supported:
+      - .npz NumPy multilayer perceptron: 'labels', 'image_size' and the
+        layers 'w0', 'b0', 'w1', 'b1', ... (ReLU between layers) applied
+        to the RGB pixels scaled to [0, 1], optionally standardized with
+        'mean' and 'std'.
+      - .onnx model (needs onnxruntime) taking a NCHW float batch of
+        ImageNet normalized images, with its labels in <model>.labels,
+        one per line.
+    A list of images is classified as a single batch. Predictions with
+    a probability below min_score are reported as not recognized.
+"""
+class LocalFoodClassifier():
+    def __init__(self, model_path, min_score=0.0):
+        if np is None or Image is None:
+            raise RuntimeError('The local food classifier needs numpy and Pillow')
+        self.min_score = min_score
+        self.session = None
+        if model_path.endswith('.onnx'):
+            if onnxruntime is None:
+                raise RuntimeError('{} needs onnxruntime'.format(model_path))
+            self.session = onnxruntime.InferenceSession(model_path)
+            model_input = self.session.get_inputs()[0]
+            self.input_name = model_input.name
+            self.image_size = model_input.shape[-1] if isinstance(model_input.shape[-1], int) else 224
+            with open(os.path.splitext(model_path)[0] + '.labels', encoding='utf-8') as f:
+                self.labels = [line.strip() for line in f if line.strip()]
+            self.mean = np.array(ONNX_MEAN, dtype=np.float32).reshape(1, 3, 1, 1)
+            self.std = np.array(ONNX_STD, dtype=np.float32).reshape(1, 3, 1, 1)
+        else:
+            with np.load(model_path, allow_pickle=False) as model:
+                self.labels = [str(label) for label in model['labels']]
+                self.image_size = int(model['image_size'])
+                self.layers = []
+                while 'w{}'.format(len(self.layers)) in model:
+                    i = len(self.layers)
+                    self.layers.append((model['w{}'.format(i)].astype(np.float32),
+                                        model['b{}'.format(i)].astype(np.float32)))
+                self.mean = model['mean'].astype(np.float32) if 'mean' in model else 0.0
+                self.std = model['std'].astype(np.float32) if 'std' in model else 1.0
+
+    def preprocess(self, image):
+        with open_image(image) as image_file, Image.open(image_file) as picture:
+            picture = picture.convert('RGB').resize((self.image_size, self.image_size), Image.BILINEAR)
+            return np.asarray(picture, dtype=np.float32) / 255.0
+
+    def classify(self, images):
+        if len(images) == 0:
+            return []
+        batch = np.stack([self.preprocess(image) for image in images])
+        if self.session is not None:
+            batch = (batch.transpose(0, 3, 1, 2) - self.mean) / self.std
+            logits = self.session.run(None, {self.input_name: batch})[0]
+        else:
+            logits = (batch.reshape(len(images), -1) - self.mean) / self.std
+            for i, (weights, bias) in enumerate(self.layers):
+                logits = logits @ weights + bias
+                if i < len(self.layers) - 1:
+                    logits = np.maximum(logits, 0.0)
+
+        logits = logits - logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        results = []
+        for row in probabilities:
+            best = int(row.argmax())
+            if row[best] < self.min_score:
+                results.append((None, None))
+            else:
+                results.append((self.labels[best], round(float(row[best]), 4)))
+        return results
+
+
+"""
+    Groups the images classified concurrently (photos of different
+    channels handled by different threads) into batches of up to
+    max_batch images, waiting at most max_wait seconds for the batch
+    to fill, and classifies each batch with a single backend call.
+    classify() raises concurrent.futures.TimeoutError after timeout seconds.
+"""
+class BatchingClassifier():
+    def __init__(self, backend, max_batch=FOOD_BATCH_SIZE, max_wait=FOOD_BATCH_WAIT, timeout=FOOD_CLASSIFY_TIMEOUT):
+        self.backend = backend
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def classify(self, images):
+        futures = [self.submit(image) for image in images]
+        deadline = time.time() + self.timeout
+        return [future.result(timeout=max(deadline - time.time(), 0)) for future in futures]
+
+    def submit(self, image):
+        future = Future()
+        self.queue.put((image, future))
+        return future
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get(timeout=max(deadline - time.time(), 0)))
+                except queue.Empty:
+                    break
+            try:
+                results = self.backend.classify([image for image, _ in batch])
+                if len(results) != len(batch):
+                    # which result belongs to which image is unknown, fail them all
+                    raise RuntimeError('{0} results for {1} images'.format(len(results), len(batch)))
+            except Exception as inst:
+                for _, future in batch:
+                    future.set_exception(inst)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
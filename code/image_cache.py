@@ -0,0 +1,142 @@
+#!/usr/bin/python
+# coding=utf-8
+
+######   LIBRARIES ########
+import io
+import hashlib
+import threading
+from collections import defaultdict
+from cache import TTLCache
+
+# Pillow is optional, without it only identical images are found
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+######   CONSTANTS ########
+
+# Maximum number of differing bits between the perceptual hashes of two near-identical images
+PERCEPTUAL_HASH_DISTANCE = 6
+# The 64 bits hash is split in bands of 8 bits: two hashes within PERCEPTUAL_HASH_DISTANCE
+# bits share at least one whole band, so only the images sharing a band are compared
+HASH_BANDS = 8
+BAND_BITS = 64 // HASH_BANDS
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+# Difference hash: 9x8 grey thumbnail, one bit per pair of horizontal neighbours.
+# Resizing, recompression and small edits barely change it.
+def perceptual_hash(data):
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            pixels = list(image.convert('L').resize((9, 8)).getdata())
+    except (OSError, ValueError):
+        return None
+    bits = 0
+    for row in range(8):
+        for column in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + column] > pixels[row * 9 + column + 1])
+    return bits
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+"""
+    Visual recognition results, (food, score), of the images already
+    classified. Images are found by the SHA-256 of their content and,
+    when Pillow is available, near-identical images (resent, resized or
+    recompressed photos) by the distance of their perceptual hashes.
+    Entries are kept in a TTLCache (LRU, persisted with dump/load).
+"""
+class ImageCache():
+    def __init__(self, maxsize=1024, ttl=None, max_distance=PERCEPTUAL_HASH_DISTANCE):
+        self.max_distance = max_distance
+        # content hash -> [food, score, perceptual hash]
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl, on_evict=self.unindex)
+        self.lock = threading.Lock()
+        # (band, band value) -> content hashes
+        self.bands = defaultdict(set)
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    # Returns ((food, score) or None when the image is not cached, content hash, perceptual hash)
+    def lookup(self, data):
+        key = content_hash(data)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            return (entry[0], entry[1]), key, entry[2]
+
+        phash = perceptual_hash(data)
+        if phash is not None:
+            similar = self.find_similar(phash)
+            if similar is not None:
+                self.near_hits += 1
+                # the exact content is found directly next time
+                self.set(key, phash, similar[0], similar[1])
+                return (similar[0], similar[1]), key, phash
+        self.misses += 1
+        return None, key, phash
+
+    def find_similar(self, phash):
+        with self.lock:
+            candidates = set()
+            for band in range(HASH_BANDS):
+                candidates |= self.bands.get((band, self.band(phash, band)), set())
+        best = None
+        for key in candidates:
+            entry = self.entries.get(key)
+            if entry is not None and entry[2] is not None:
+                distance = hamming_distance(phash, entry[2])
+                if distance <= self.max_distance and (best is None or distance < best[0]):
+                    best = (distance, entry)
+        return best[1] if best else None
+
+    def set(self, key, phash, food, score):
+        self.entries.set(key, [food, score, phash])
+        self.index(key, phash)
+
+    def band(self, phash, band):
+        return (phash >> (band * BAND_BITS)) & ((1 << BAND_BITS) - 1)
+
+    def index(self, key, phash):
+        if phash is None:
+            return
+        with self.lock:
+            for band in range(HASH_BANDS):
+                self.bands[(band, self.band(phash, band))].add(key)
+
+    def unindex(self, key, entry):
+        if entry[2] is None:
+            return
+        with self.lock:
+            for band in range(HASH_BANDS):
+                keys = self.bands.get((band, self.band(entry[2], band)))
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.bands[(band, self.band(entry[2], band))]
+
+    def stats(self):
+        return {'size': len(self.entries), 'hits': self.hits, 'near_hits': self.near_hits,
+                'misses': self.misses}
+
+    def dump(self, path):
+        self.entries.dump(path)
+
+    def load(self, path):
+        loaded = self.entries.load(path)
+        with self.lock:
+            self.bands.clear()
+        for key, entry in self.entries.values():
+            self.index(key, entry[2])
+        return loaded
@@ -0,0 +1,35 @@
+#!/usr/bin/python
+# coding=utf-8
+
+######   LIBRARIES ########
+import re
+import unicodedata
+
+
+# Plural endings (English and Spanish) -> singular ending, checked in order
+PLURAL_ENDINGS = [('ies', 'y'),
+                  ('oes', 'o'),
+                  ('ches', 'ch'),
+                  ('shes', 'sh'),
+                  ('sses', 'ss'),
+                  ('xes', 'x'),
+                  ('s', '')]
+# Singular words that look like plurals (asparagus, hummus, ...)
+SINGULAR_ENDINGS = ('ss', 'us', 'is')
+
+
+def singularize(word):
+    if len(word) <= 3 or word.endswith(SINGULAR_ENDINGS):
+        return word
+    for plural, singular in PLURAL_ENDINGS:
+        if word.endswith(plural):
+            return word[:-len(plural)] + singular
+    return word
+
+
+# Lower case, without accents and punctuation and with every word in singular,
+# e.g. 'Tomates' -> 'tomate', 'Jamón cocido' -> 'jamon cocido', 'eggs' -> 'egg'
+def normalize_ingredient(text):
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode('ascii')
+    words = re.findall(r'[a-z]+', text.lower())
+    return ' '.join(singularize(word) for word in words)
@@ -0,0 +1,228 @@
+#!/usr/bin/python
+# coding=utf-8
+
+######   LIBRARIES ########
+import io
+import csv
+import sys
+import time
+import select
+import argparse
+import datetime
+import threading
+from collections import OrderedDict
+import psycopg2
+import psycopg2.extras
+from database import DatabasePool, DB_STRING_CONNECTION
+from tenants import DEFAULT_FRIDGE_ID
+
+######   CONSTANTS ########
+
+# Batches with more rows than this are loaded with COPY instead of a multi-row INSERT
+COPY_BATCH_ROWS = 1000
+# Postgres channel of the products change feed (scripts/inventory.sql)
+PRODUCTS_CHANNEL = 'products_changed'
+# Seconds between two checks of the change feed connection when nothing is received
+FEED_POLL_INTERVAL = 5
+# Seconds to wait before reconnecting a lost change feed connection
+FEED_RECONNECT_DELAY = 5
+
+# Unique index of the products (scripts/tenants.sql). The products without expiration date
+# are compared as expiring at 'infinity', a NULL date would never conflict
+PRODUCT_KEY = "(fridge_id, lower(name), coalesce(expiration_date, 'infinity'::timestamp with time zone))"
+# Adds the quantity to the product of the fridge with the same name and expiration date, if any
+UPSERT_PRODUCTS = ("INSERT INTO products (fridge_id, name, expiration_date, quantity) VALUES %s "
+                   "ON CONFLICT {} DO UPDATE "
+                   "SET quantity = coalesce(products.quantity, 0) + EXCLUDED.quantity".format(PRODUCT_KEY))
+COPY_PRODUCTS = [
+    "CREATE TEMPORARY TABLE incoming_products (name text, expiration_date timestamp with time zone, "
+    "quantity double precision) ON COMMIT DROP",
+    "COPY incoming_products FROM STDIN WITH (FORMAT csv)",
+    "INSERT INTO products (fridge_id, name, expiration_date, quantity) "
+    "SELECT %s, min(name), expiration_date, sum(quantity) "
+    "FROM incoming_products "
+    "GROUP BY lower(name), expiration_date "
+    "ON CONFLICT {} DO UPDATE "
+    "SET quantity = coalesce(products.quantity, 0) + EXCLUDED.quantity".format(PRODUCT_KEY),
+]
+# Stock of a product of the fridge not expired yet, first to expire first (locked until the end
+# of the consumption)
+CONSUMABLE_PRODUCTS = ("SELECT id, quantity "
+                       "FROM products "
+                       "WHERE fridge_id = %s "
+                       "AND lower(name) = lower(%s) "
+                       "AND quantity > 0 "
+                       "AND (expiration_date IS NULL OR expiration_date >= current_date + 1) "
+                       "ORDER by expiration_date ASC NULLS LAST, id "
+                       "FOR UPDATE")
+# Same boundary as the expired products of the summary, of a fridge or (NULL) of every fridge
+DISCARD_EXPIRED = ("DELETE FROM products "
+                   "WHERE expiration_date < current_date + 1 "
+                   "AND (fridge_id = %s OR %s IS NULL) "
+                   "RETURNING name")
+
+
+"""
+    Writes to the products table: add (restock), consume and discard,
+    each on the products of one fridge (scripts/tenants.sql).
+    Every operation is a single transaction; the triggers of
+    scripts/inventory.sql keep registered/modified and notify the
+    change feed, so the in-memory fridge state follows every write.
+"""
+class InventoryService():
+    def __init__(self, database):
+        self.database = database
+
+    # items: (name, quantity, expiration_date). The quantities of the same product and
+    # expiration date are added, also to the stock already in the fridge.
+    def add(self, fridge_id, items):
+        batch = OrderedDict()
+        for name, quantity, expiration_date in items:
+            key = (name.strip().lower(), expiration_date)
+            if key in batch:
+                batch[key] = (batch[key][0], expiration_date, batch[key][2] + quantity)
+            else:
+                batch[key] = (name.strip(), expiration_date, quantity)
+        rows = [(fridge_id,) + row for row in batch.values()]
+        if not rows:
+            return 0
+
+        def write(cursor):
+            if len(rows) > COPY_BATCH_ROWS:
+                data = io.StringIO()
+                csv.writer(data).writerows((name, expiration_date.isoformat() if expiration_date else None, quantity)
+                                           for _, name, expiration_date, quantity in rows)
+                data.seek(0)
+                cursor.execute(COPY_PRODUCTS[0])
+                cursor.copy_expert(COPY_PRODUCTS[1], data)
+                cursor.execute(COPY_PRODUCTS[2], (fridge_id,))
+            else:
+                psycopg2.extras.execute_values(cursor, UPSERT_PRODUCTS, rows, page_size=COPY_BATCH_ROWS)
+            return len(rows)
+
+        return self.database.transaction(write)
+
+    # Takes the quantity from the stock of the product that expires first.
+    # Returns the quantity actually taken (less than asked if there is not enough).
+    def consume(self, fridge_id, name, quantity):
+        def take(cursor):
+            cursor.execute(CONSUMABLE_PRODUCTS, (fridge_id, name))
+            remaining = quantity
+            emptied = []
+            for product_id, available in cursor.fetchall():
+                if remaining <= 0:
+                    break
+                taken = min(available, remaining)
+                remaining -= taken
+                if taken >= available:
+                    emptied.append(product_id)
+                else:
+                    cursor.execute("UPDATE products SET quantity = %s WHERE id = %s", (available - taken, product_id))
+            if emptied:
+                cursor.execute("DELETE FROM products WHERE id = ANY(%s)", (emptied,))
+            return quantity - remaining
+
+        return self.database.transaction(take)
+
+    # Removes the expired products of the fridge (of every fridge if None), returns their names
+    def discard_expired(self, fridge_id=None):
+        def discard(cursor):
+            cursor.execute(DISCARD_EXPIRED, (fridge_id, fridge_id))
+            return sorted(name for name, in cursor.fetchall())
+
+        return self.database.transaction(discard)
+
+
+"""
+    Listens to the products change feed (LISTEN products_changed) on a
+    dedicated connection and calls on_change(notifications) with the
+    payloads received together. After a lost connection it reconnects
+    and calls on_change(None), as changes may have been missed.
+"""
+class ChangeFeed():
+    def __init__(self, dsn, on_change, channel=PRODUCTS_CHANNEL):
+        self.dsn = dsn
+        self.on_change = on_change
+        self.channel = channel
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        missed = False
+        while not self.stop_event.is_set():
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute('LISTEN {}'.format(self.channel))
+                if missed:
+                    self.on_change(None)
+                missed = True
+                self.listen(conn)
+            except Exception as inst:
+                print('Change feed: {}'.format(inst))
+                self.stop_event.wait(FEED_RECONNECT_DELAY)
+
+    def listen(self, conn):
+        try:
+            while not self.stop_event.is_set():
+                if select.select([conn], [], [], FEED_POLL_INTERVAL) == ([], [], []):
+                    continue
+                conn.poll()
+                notifications = [notify.payload for notify in conn.notifies]
+                del conn.notifies[:]
+                if notifications:
+                    self.on_change(notifications)
+        finally:
+            conn.close()
+
+
+# YYYY-MM-DD or ISO 8601 timestamp, local time zone if not given
+def parse_date(value):
+    if not value:
+        return None
+    date = datetime.datetime.fromisoformat(value)
+    return date if date.tzinfo else date.astimezone()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fridge inventory')
+    parser.add_argument('--fridge', type=int, default=DEFAULT_FRIDGE_ID, help='fridge id (scripts/tenants.sql)')
+    commands = parser.add_subparsers(dest='command')
+    add = commands.add_parser('add', help='add a product')
+    add.add_argument('name')
+    add.add_argument('quantity', type=float)
+    add.add_argument('expiration_date', nargs='?')
+    load = commands.add_parser('load', help='add the products of a CSV file: name,quantity,expiration_date')
+    load.add_argument('file')
+    consume = commands.add_parser('consume', help='take a quantity of a product')
+    consume.add_argument('name')
+    consume.add_argument('quantity', type=float)
+    discard = commands.add_parser('discard-expired', help='remove the expired products')
+    discard.add_argument('--all', action='store_true', help='of every fridge')
+    args = parser.parse_args()
+
+    inventory = InventoryService(DatabasePool(DB_STRING_CONNECTION, maxconn=1))
+    if args.command == 'add':
+        inventory.add(args.fridge, [(args.name, args.quantity, parse_date(args.expiration_date))])
+    elif args.command == 'load':
+        with open(args.file, encoding='utf-8') as f:
+            start = time.time()
+            n_rows = inventory.add(args.fridge, [(row[0], float(row[1]), parse_date(row[2] if len(row) > 2 else None))
+                                                 for row in csv.reader(f) if row])
+        print('{0} products loaded in {1:.1f}s'.format(n_rows, time.time() - start))
+    elif args.command == 'consume':
+        print('{0:g} taken'.format(inventory.consume(args.fridge, args.name, args.quantity)))
+    elif args.command == 'discard-expired':
+        discarded = inventory.discard_expired(None if args.all else args.fridge)
+        print('Discarded: {}'.format(', '.join(discarded) or 'nothing'))
+    else:
+        parser.print_help()
+        sys.exit(1)
@@ -0,0 +1,195 @@
+#!/usr/bin/python
+# coding=utf-8
+
+######   LIBRARIES ########
+import re
+import csv
+import math
+import json
+from collections import defaultdict
+from ingredients import singularize
+
+######   CONSTANTS ########
+
+# Longest entity synonym, in words
+MAX_ENTITY_WORDS = 5
+# Number of alternative intents returned with their confidence
+MAX_INTENTS = 3
+
+
+def load_workspace(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def tokenize(text):
+    return [singularize(token) for token in re.findall(r"[a-z0-9]+", text.lower().replace("'", ''))]
+
+
+def token_spans(text):
+    lowered = text.lower().replace("'", ' ')
+    return [(singularize(m.group(0)), m.start(), m.end()) for m in re.finditer(r"[a-z0-9]+", lowered)]
+
+
+def features(tokens):
+    return tokens + ['{0} {1}'.format(a, b) for a, b in zip(tokens, tokens[1:])]
+
+
+# Top intent of classify() when its confidence reaches min_confidence and it is ahead of the
+# runner-up intent by min_margin, None otherwise (e.g. an example shared by two intents)
+def confident_intent(intents, min_confidence, min_margin):
+    if len(intents) == 0 or intents[0]['confidence'] < min_confidence:
+        return None
+    runner_up = intents[1]['confidence'] if len(intents) > 1 else 0.0
+    if intents[0]['confidence'] - runner_up < min_margin:
+        return None
+    return intents[0]['intent']
+
+
+"""
+    In-process intent and entity classifier trained with the examples
+    of the Watson Conversation workspace (intents with their examples,
+    entities with their values and synonyms) and, optionally, with the
+    conversation/intents and conversation/entities CSV exports.
+
+    Intents are predicted with a TF-IDF nearest neighbour search over
+    the training examples: the confidence is the cosine similarity with
+    the closest example (1.0 for an exact match). Entities are matched
+    by dictionary lookup of their values and synonyms.
+    classify() returns intents and entities in the Watson format.
+"""
+class LocalClassifier():
+    def __init__(self):
+        # (intent, text) training examples
+        self.examples = []
+        # entity -> {value -> [synonyms]}
+        self.entity_values = defaultdict(dict)
+        self.trained = False
+
+    @classmethod
+    def from_workspace(cls, workspace, intent_csvs=(), entity_csvs=()):
+        classifier = cls()
+        for intent in workspace['intents']:
+            for example in intent['examples']:
+                classifier.add_example(intent['intent'], example['text'])
+        for entity in workspace['entities']:
+            for value in entity['values']:
+                classifier.add_entity_value(entity['entity'], value['value'], value.get('synonyms') or [])
+        for csv_path in intent_csvs:
+            classifier.load_intent_csv(csv_path)
+        for csv_path in entity_csvs:
+            classifier.load_entity_csv(csv_path)
+        classifier.train()
+        return classifier
+
+    def add_example(self, intent, text):
+        self.examples.append((intent, text.strip()))
+        self.trained = False
+
+    def add_entity_value(self, entity, value, synonyms=()):
+        known = self.entity_values[entity].setdefault(value, [])
+        known.extend(s.strip() for s in synonyms if s.strip())
+        self.trained = False
+
+    # Rows: example,intent
+    def load_intent_csv(self, path):
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            for row in csv.reader(f):
+                if len(row) >= 2 and row[-1].strip():
+                    self.add_example(row[-1].strip(), ','.join(row[:-1]))
+
+    # Rows: entity,value,synonym,synonym...
+    def load_entity_csv(self, path):
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            for row in csv.reader(f):
+                if len(row) >= 2:
+                    self.add_entity_value(row[0].strip(), row[1].strip(), row[2:])
+
+    def train(self):
+        # Drop duplicated examples (the same sentence appears in several exports)
+        self.examples = list(dict.fromkeys(self.examples))
+        documents = [features(tokenize(text)) for _, text in self.examples]
+
+        document_frequency = defaultdict(int)
+        for document in documents:
+            for feature in set(document):
+                document_frequency[feature] += 1
+        n_documents = len(documents)
+        self.idf = {feature: math.log((n_documents + 1.0) / (df + 1.0)) + 1.0
+                    for feature, df in document_frequency.items()}
+
+        # feature -> [(example index, weight)] of the normalized example vectors
+        self.index = defaultdict(list)
+        # normalized sentence -> intents it is an example of (a few sentences have several)
+        self.exact = defaultdict(list)
+        for i, document in enumerate(documents):
+            for feature, weight in self.vectorize(document).items():
+                self.index[feature].append((i, weight))
+            intents = self.exact[' '.join(tokenize(self.examples[i][1]))]
+            if self.examples[i][0] not in intents:
+                intents.append(self.examples[i][0])
+
+        # tuple of tokens -> {entity: value}, a phrase can belong to several entities
+        self.entity_phrases = defaultdict(dict)
+        for entity, values in self.entity_values.items():
+            for value, synonyms in values.items():
+                for phrase in [value] + synonyms:
+                    tokens = tuple(tokenize(phrase))
+                    if 0 < len(tokens) <= MAX_ENTITY_WORDS:
+                        self.entity_phrases[tokens].setdefault(entity, value)
+        self.trained = True
+
+    def vectorize(self, document):
+        counts = defaultdict(int)
+        for feature in document:
+            if feature in self.idf:
+                counts[feature] += 1
+        vector = {feature: (1.0 + math.log(count)) * self.idf[feature] for feature, count in counts.items()}
+        norm = math.sqrt(sum(w * w for w in vector.values()))
+        return {feature: w / norm for feature, w in vector.items()} if norm > 0 else {}
+
+    def classify_intent(self, text):
+        tokens = tokenize(text)
+        intents = self.exact.get(' '.join(tokens))
+        if intents:
+            return [{'intent': intent, 'confidence': round(1.0 / len(intents), 4)} for intent in intents]
+
+        scores = defaultdict(float)
+        for feature, weight in self.vectorize(features(tokens)).items():
+            for i, example_weight in self.index[feature]:
+                scores[i] += weight * example_weight
+
+        best = {}
+        for i, score in scores.items():
+            intent = self.examples[i][0]
+            if score > best.get(intent, 0.0):
+                best[intent] = score
+        ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)[:MAX_INTENTS]
+        return [{'intent': intent, 'confidence': round(min(score, 1.0), 4)} for intent, score in ranked]
+
+    def extract_entities(self, text):
+        spans = token_spans(text)
+        tokens = [token for token, _, _ in spans]
+        entities = []
+        i = 0
+        while i < len(tokens):
+            for length in range(min(MAX_ENTITY_WORDS, len(tokens) - i), 0, -1):
+                match = self.entity_phrases.get(tuple(tokens[i:i + length]))
+                if match:
+                    for entity, value in match.items():
+                        entities.append({'entity': entity, 'value': value,
+                                         'location': [spans[i][1], spans[i + length - 1][2]],
+                                         'confidence': 1})
+                    i += length
+                    break
+            else:
+                if tokens[i].isdigit():
+                    entities.append({'entity': 'sys-number', 'value': tokens[i],
+                                     'location': [spans[i][1], spans[i][2]], 'confidence': 1})
+                i += 1
+        return entities
+
+    def classify(self, text):
+        if not self.trained:
+            self.train()
+        return self.classify_intent(text), self.extract_entities(text)
@@ -0,0 +1,186 @@
+#!/usr/bin/python
+# coding=utf-8
+
+######   LIBRARIES ########
+import os
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+######   CONSTANTS ########
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Spans of a trace slower than this many seconds are printed when the trace ends
+SLOW_TRACE_SECONDS = 2
+
+
+"""
+    Cumulative latency histogram (Prometheus style): count of the
+    observations under each bucket bound, total count and sum.
+"""
+class Histogram():
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for name, value in labels) + '}'
+
+
+"""
+    Latency histograms and counters of the bot, with the Prometheus text
+    exposition format.
+
+    span(name, **labels) times a block: an external call (Watson,
+    Food2Fork, Postgres, Slack) or a whole command. The duration goes to
+    the 'smartfridge_span_seconds' histogram labelled with the span name,
+    its labels and the outcome (ok or error). Spans opened by the same
+    thread while another one is open belong to its trace; when the
+    outermost span ends slower than SLOW_TRACE_SECONDS the trace is
+    printed with the time of every inner span, showing which dependency
+    dominated the reply.
+
+    Other components add their own values (e.g. cache statistics) with
+    add_collector(function), function() returning (metric, labels dict,
+    value) tuples.
+"""
+class Metrics():
+    def __init__(self, buckets=LATENCY_BUCKETS, slow_trace=SLOW_TRACE_SECONDS):
+        self.buckets = buckets
+        self.slow_trace = slow_trace
+        self.lock = threading.Lock()
+        # (metric, sorted labels) -> Histogram
+        self.histograms = {}
+        # (metric, sorted labels) -> value
+        self.counters = defaultdict(float)
+        self.collectors = []
+        self.local = threading.local()
+
+    @contextmanager
+    def span(self, name, **labels):
+        trace = getattr(self.local, 'trace', None)
+        root = trace is None
+        if root:
+            trace = self.local.trace = []
+        start = time.perf_counter()
+        outcome = 'ok'
+        try:
+            yield labels
+        except BaseException:
+            outcome = 'error'
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe('smartfridge_span_seconds', elapsed, span=name, outcome=outcome, **labels)
+            if root:
+                self.local.trace = None
+                if elapsed >= self.slow_trace:
+                    print('Slow {0} {1}: {2:.0f} ms [{3}]'.format(
+                        name, format_labels(sorted(labels.items())), elapsed * 1000,
+                        ', '.join('{0} {1:.0f} ms'.format(span, seconds * 1000) for span, seconds in trace)))
+            else:
+                trace.append((name, elapsed))
+
+    def observe(self, metric, value, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def increment(self, metric, value=1, **labels):
+        with self.lock:
+            self.counters[(metric, tuple(sorted(labels.items())))] += value
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    # Prometheus text exposition format
+    def render(self):
+        lines = []
+        with self.lock:
+            histograms = sorted((key, histogram.counts[:], histogram.count, histogram.sum)
+                                for key, histogram in self.histograms.items())
+            counters = sorted(self.counters.items())
+        typed = set()
+        for (metric, labels), counts, count, total in histograms:
+            if metric not in typed:
+                typed.add(metric)
+                lines.append('# TYPE {} histogram'.format(metric))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append('{0}_bucket{1} {2}'.format(metric, format_labels(labels + (('le', le),)), cumulative))
+            lines.append('{0}_count{1} {2}'.format(metric, format_labels(labels), count))
+            lines.append('{0}_sum{1} {2:.6f}'.format(metric, format_labels(labels), total))
+        for (metric, labels), value in counters:
+            if metric not in typed:
+                typed.add(metric)
+                lines.append('# TYPE {} counter'.format(metric))
+            lines.append('{0}{1} {2:g}'.format(metric, format_labels(labels), value))
+        for collector in self.collectors:
+            try:
+                for metric, labels, value in collector():
+                    lines.append('{0}{1} {2:g}'.format(metric, format_labels(sorted(labels.items())), value))
+            except Exception as inst:
+                print('Metrics collector failed: {}'.format(inst))
+        return '\n'.join(lines) + '\n'
+
+    # Serves render() on http://host:port/metrics from a background thread
+    def serve(self, port, host='127.0.0.1'):
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    # Writes render() to path every interval seconds from a background thread
+    def dump_periodically(self, path, interval):
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                        f.write(self.render())
+                    os.replace(path + '.tmp', path)
+                except OSError as inst:
+                    print('Metrics not written: {}'.format(inst))
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+# Registry shared by the bot and its transports
+registry = Metrics()
+span = registry.span
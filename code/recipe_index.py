@@ -0,0 +1,160 @@
+#!/usr/bin/python
+# coding=utf-8
+
+######   LIBRARIES ########
+import os
+import json
+import time
+import threading
+import functools
+from array import array
+from collections import defaultdict
+from ingredients import normalize_ingredient
+
+######   CONSTANTS ########
+
+# Seconds between two checks of the recipe dump for changes
+RECIPE_INDEX_REFRESH_INTERVAL = 10 * 60
+# Terms present in more than 1/DENSE_TERM_RATIO of the recipes are kept as bitsets,
+# the rest as arrays of recipe positions (4 bytes per recipe instead of n_recipes / 8)
+DENSE_TERM_RATIO = 32
+
+
+# Terms of an ingredient line: its words and pairs of consecutive words,
+# e.g. '2 cups chopped onions' -> cup, chopped, onion, cup chopped, chopped onion.
+# The same lines repeat across recipes, so they are normalized once.
+@functools.lru_cache(maxsize=65536)
+def ingredient_terms(line):
+    words = normalize_ingredient(line).split()
+    return frozenset(words) | {'{0} {1}'.format(a, b) for a, b in zip(words, words[1:])}
+
+
+def bitset(positions):
+    if not positions:
+        return 0
+    bits = bytearray(max(positions) // 8 + 1)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, 'little')
+
+
+"""
+    Recipes read from a dump, Food2Fork 'get' responses or recipes
+    (recipe_id, title, ingredients, social_rank), one JSON per line,
+    with an inverted index from ingredient terms to recipes.
+
+    search(ingredients, n) ranks the recipes by how many of the given
+    ingredients they use, without any remote call: each ingredient is a
+    bitset of recipes, and the bitsets are added with a bit-sliced
+    counter (bit plane i holds bit i of the count of every recipe), so
+    a query costs a few big integer operations per ingredient. Recipes
+    are numbered by social rank, which breaks ties.
+
+    start() reloads the dump in a background thread when it changes;
+    queries keep using the previous snapshot until the new one is built.
+"""
+class RecipeIndex():
+    def __init__(self, path=None, interval=RECIPE_INDEX_REFRESH_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.loaded_mtime = None
+        # (recipes [(title, recipe_id)], term -> bitset or array of positions,
+        #  str(recipe_id) -> ingredient lines)
+        self.snapshot = ([], {}, {})
+
+    @property
+    def ready(self):
+        return len(self.snapshot[0]) > 0
+
+    def start(self):
+        self.refresh()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as inst:
+                print('Recipe index: {}'.format(inst))
+
+    def refresh(self):
+        mtime = os.path.getmtime(self.path)
+        if mtime != self.loaded_mtime:
+            start = time.time()
+            self.build(self.read_dump(self.path))
+            self.loaded_mtime = mtime
+            print('Recipe index: {0} recipes loaded in {1:.1f}s'.format(len(self.snapshot[0]), time.time() - start))
+
+    def read_dump(self, path):
+        recipes = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    recipe = json.loads(line)
+                    recipes.append(recipe.get('recipe', recipe))
+        return recipes
+
+    def build(self, recipes):
+        recipes = sorted(recipes, key=lambda recipe: -float(recipe.get('social_rank') or 0))
+        positions = defaultdict(lambda: array('I'))
+        for position, recipe in enumerate(recipes):
+            terms = set()
+            for line in recipe.get('ingredients') or []:
+                terms |= ingredient_terms(line)
+            for term in terms:
+                positions[term].append(position)
+
+        dense = max(1, len(recipes) // DENSE_TERM_RATIO)
+        postings = {term: bitset(ids) if len(ids) >= dense else ids for term, ids in positions.items()}
+        ingredients = {str(recipe['recipe_id']): tuple(recipe.get('ingredients') or []) for recipe in recipes}
+        self.snapshot = ([(recipe['title'], recipe['recipe_id']) for recipe in recipes], postings, ingredients)
+
+    # Ingredient lines of an indexed recipe, None if it is not in the dump
+    def ingredients(self, recipe_id):
+        lines = self.snapshot[2].get(str(recipe_id))
+        return list(lines) if lines is not None else None
+
+    # Recipes using the ingredient: every word of it, in order (consecutive pairs of words)
+    def ingredient_bits(self, postings, ingredient):
+        words = normalize_ingredient(ingredient).split()
+        terms = words if len(words) == 1 else ['{0} {1}'.format(a, b) for a, b in zip(words, words[1:])]
+        bits = None
+        for term in terms:
+            posting = postings.get(term, 0)
+            term_bits = posting if isinstance(posting, int) else bitset(posting)
+            bits = term_bits if bits is None else bits & term_bits
+        return bits or 0
+
+    # Up to n_results (title, recipe_id) using the most ingredients, at least one
+    def search(self, ingredients, n_results):
+        recipes, postings, _ = self.snapshot
+        # planes[i]: recipes whose count has bit i set
+        planes = []
+        for ingredient in set(ingredients):
+            carry = self.ingredient_bits(postings, ingredient)
+            for i in range(len(planes)):
+                if not carry:
+                    break
+                planes[i], carry = planes[i] ^ carry, planes[i] & carry
+            if carry:
+                planes.append(carry)
+
+        results = []
+        everything = (1 << len(recipes)) - 1
+        for count in range((1 << len(planes)) - 1, 0, -1):
+            matches = everything
+            for i, plane in enumerate(planes):
+                matches &= plane if (count >> i) & 1 else ~plane
+            while matches and len(results) < n_results:
+                lowest = matches & -matches
+                results.append(recipes[lowest.bit_length() - 1])
+                matches ^= lowest
+            if len(results) >= n_results:
+                break
+        return results
@@ -0,0 +1,138 @@
+#!/usr/bin/python
+# coding=utf-8
+
+######   LIBRARIES ########
+import re
+import datetime
+import numpy as np
+from ingredients import normalize_ingredient, singularize
+from recipe_index import ingredient_terms
+
+######   CONSTANTS ########
+
+# Grams of a unit of an ingredient line ('2 cups of milk'), liquids as water
+UNIT_GRAMS = {'g': 1, 'gram': 1, 'gr': 1, 'kg': 1000, 'kilogram': 1000,
+              'oz': 28.35, 'ounce': 28.35, 'lb': 453.6, 'pound': 453.6,
+              'ml': 1, 'l': 1000, 'liter': 1000, 'litre': 1000,
+              'cup': 240, 'tablespoon': 15, 'tbsp': 15, 'teaspoon': 5, 'tsp': 5,
+              'pinch': 0.5, 'clove': 5, 'slice': 30, 'can': 400}
+# Grams of a line without unit ('2 tomatoes') or without amount ('salt')
+DEFAULT_UNIT_GRAMS = 100
+# Leading amount of a line: 1/2, 2, 1.5 or 1 1/2, followed by the unit
+AMOUNT = re.compile(r'^\s*(?:(\d+)/(\d+)|(\d+(?:[.,]\d+)?)(?:\s+(\d+)/(\d+))?)\s*([a-zA-Z]+)?')
+
+# Weights of the score: share of the recipe lines in the fridge, share of the needed
+# quantity in the fridge, urgency of the fridge products used and lines to buy
+COVERAGE_WEIGHT = 1.0
+SUFFICIENCY_WEIGHT = 0.5
+URGENCY_WEIGHT = 0.5
+MISSING_PENALTY = 0.05
+
+
+# Approximate grams needed by an ingredient line
+def required_grams(line):
+    match = AMOUNT.match(line)
+    if match is None:
+        return DEFAULT_UNIT_GRAMS
+    numerator, denominator, whole, fraction_numerator, fraction_denominator, unit = match.groups()
+    if whole is None:
+        amount = int(numerator) / int(denominator) if int(denominator) > 0 else 1
+    else:
+        amount = float(whole.replace(',', '.'))
+        if fraction_numerator is not None and int(fraction_denominator) > 0:
+            amount += int(fraction_numerator) / int(fraction_denominator)
+    unit = singularize(unit.lower()) if unit else None
+    return amount * UNIT_GRAMS.get(unit, DEFAULT_UNIT_GRAMS)
+
+
+# Term a product is searched with in the recipe lines: its name, or its last two words
+def product_term(name):
+    words = normalize_ingredient(name).split()
+    return ' '.join(words[-2:])
+
+
+"""
+    Scores candidate recipes against the fridge inventory, rows of
+    (name, expiration_date, quantity in grams) as in the products table.
+    Expired products are left out; products with the same name add up.
+
+    score() finds the (recipe line, product) matches once and computes
+    every metric for the whole batch with NumPy:
+      - coverage: share of the recipe lines found in the fridge
+      - missing: number of recipe lines not in the fridge
+      - sufficiency: mean, over the lines found, of the share of the
+        needed quantity available
+      - urgency: sum, over the products used, of exp(-days left /
+        days_to_expire), so products about to expire weigh the most
+"""
+class FridgeScorer():
+    def __init__(self, inventory, days_to_expire, now=None):
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        # product term -> column
+        self.columns = {}
+        quantities = []
+        days_left = []
+        for name, expiration_date, quantity in inventory:
+            days = (expiration_date - now).total_seconds() / 86400.0 if expiration_date else float(days_to_expire)
+            term = product_term(name or '')
+            if days < 0 or term == '':
+                continue
+            column = self.columns.setdefault(term, len(self.columns))
+            if column == len(quantities):
+                quantities.append(0.0)
+                days_left.append(days)
+            quantities[column] += quantity if quantity is not None else DEFAULT_UNIT_GRAMS
+            days_left[column] = min(days_left[column], days)
+        self.quantities = np.array(quantities, dtype=np.float64)
+        self.urgency = np.exp(-np.array(days_left, dtype=np.float64) / max(days_to_expire, 1))
+
+    # ingredients: list with the ingredient lines of every recipe.
+    # Returns the scores and a dict with every metric, one value per recipe.
+    def score(self, ingredients):
+        n_recipes = len(ingredients)
+        line_recipe = []
+        line_grams = []
+        rows = []
+        columns = []
+        for recipe, lines in enumerate(ingredients):
+            for line in lines:
+                for term in ingredient_terms(line):
+                    column = self.columns.get(term)
+                    if column is not None:
+                        rows.append(len(line_recipe))
+                        columns.append(column)
+                line_recipe.append(recipe)
+                line_grams.append(required_grams(line))
+
+        n_lines = len(line_recipe)
+        line_recipe = np.array(line_recipe, dtype=np.intp)
+        rows = np.array(rows, dtype=np.intp)
+        columns = np.array(columns, dtype=np.intp)
+
+        n_lines_recipe = np.bincount(line_recipe, minlength=n_recipes).astype(np.float64)
+        line_found = np.zeros(n_lines, dtype=bool)
+        line_found[rows] = True
+        covered = np.bincount(line_recipe, weights=line_found, minlength=n_recipes)
+        coverage = np.divide(covered, n_lines_recipe, out=np.zeros(n_recipes), where=n_lines_recipe > 0)
+        missing = n_lines_recipe - covered
+
+        # best available share of the needed quantity of each line, 0 when not found
+        share = np.minimum(self.quantities[columns] / np.array(line_grams)[rows], 1.0)
+        line_sufficiency = np.zeros(n_lines)
+        np.maximum.at(line_sufficiency, rows, share)
+        sufficiency = np.divide(np.bincount(line_recipe, weights=line_sufficiency, minlength=n_recipes), covered,
+                                out=np.zeros(n_recipes), where=covered > 0)
+
+        # recipes x products used, counted once even if several lines use the same product
+        used = np.zeros((n_recipes, len(self.columns)), dtype=bool)
+        used[line_recipe[rows], columns] = True
+        urgency = used @ self.urgency
+
+        scores = (COVERAGE_WEIGHT * coverage + SUFFICIENCY_WEIGHT * coverage * sufficiency +
+                  URGENCY_WEIGHT * urgency - MISSING_PENALTY * missing)
+        return scores, {'coverage': coverage, 'missing': missing, 'sufficiency': sufficiency, 'urgency': urgency}
+
+    # Indexes of the recipes from the best score to the worst (stable for ties)
+    def rank(self, ingredients):
+        scores, _ = self.score(ingredients)
+        return np.argsort(-scores, kind='stable').tolist()
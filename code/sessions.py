@@ -0,0 +1,140 @@
+#!/usr/bin/python
+# coding=utf-8
+
+######   LIBRARIES ########
+import json
+import time
+import sqlite3
+import threading
+from cache import TTLCache
+
+######   CONSTANTS ########
+
+# Seconds of inactivity before a live session is evicted from memory
+SESSION_TTL = 30 * 60
+# Maximum number of sessions kept in memory
+MAX_LIVE_SESSIONS = 1000
+# Seconds of inactivity before a spilled session is removed from the backend
+SESSION_MAX_AGE = 30 * 24 * 60 * 60
+
+
+def session_key(team, channel, user):
+    return '{0}:{1}:{2}'.format(team or '', channel or '', user or '')
+
+
+# Initial Watson Conversation context of every new conversation
+def new_context():
+    return {'search_recipe': False,
+            'image_recipe': False,
+            'suggest_dish': False,
+            'yum_sugest': False,
+            'summary': False,
+            'option': None,
+            'cuisine_type': None,
+            'ingredients': None,
+            'intolerances': None,
+            'dish': None,
+            'counter': 0,
+            'insult_counter': 0}
+
+
+"""
+    Conversation state of a single user in a single channel
+"""
+class Session():
+    def __init__(self, context=None, recipe_options=None, option_dict=None):
+        self.context = context if context is not None else new_context()
+        self.recipe_options = recipe_options if recipe_options is not None else []
+        self.option_dict = option_dict if option_dict is not None else {}
+        self.intents = []
+        self.entities = []
+
+    def to_json(self):
+        return json.dumps({'context': self.context,
+                           'recipe_options': self.recipe_options,
+                           'option_dict': self.option_dict})
+
+    @classmethod
+    def from_json(cls, data):
+        values = json.loads(data)
+        return cls(values['context'], values['recipe_options'], values['option_dict'])
+
+
+######   BACKENDS ########
+"""
+    A session backend stores serialized sessions outside the process
+    memory. Any object with load(key), save(key, data) and delete(key)
+    can be used, e.g. to share sessions between several bot processes.
+"""
+class SQLiteSessionBackend():
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS sessions ('
+                                    'key TEXT PRIMARY KEY, '
+                                    'data TEXT NOT NULL, '
+                                    'updated REAL NOT NULL)')
+
+    def load(self, key):
+        with self.lock:
+            row = self.connection.execute('SELECT data FROM sessions WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def save(self, key, data):
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO sessions (key, data, updated) VALUES (?, ?, ?)',
+                                    (key, data, time.time()))
+
+    def delete(self, key):
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM sessions WHERE key = ?', (key,))
+
+    # Removes sessions not updated in the last max_age seconds
+    def purge(self, max_age):
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM sessions WHERE updated < ?', (time.time() - max_age,))
+
+
+######   SESSION STORE ########
+"""
+    Live sessions are kept in a bounded LRU with TTL eviction. Evicted
+    sessions are spilled to the backend and loaded back on demand, so
+    memory stays flat no matter how many users talk to the bot.
+    With write_through=True every save also reaches the backend, which
+    lets several processes share the same backend.
+"""
+class SessionStore():
+    def __init__(self, backend=None, maxsize=MAX_LIVE_SESSIONS, ttl=SESSION_TTL, write_through=False):
+        self.backend = backend
+        self.write_through = write_through
+        self.live = TTLCache(maxsize=maxsize, ttl=ttl, on_evict=self.spill)
+
+    def get(self, key):
+        session = self.live.get(key)
+        if session is None:
+            data = self.backend.load(key) if self.backend else None
+            session = Session.from_json(data) if data else Session()
+            self.live.set(key, session)
+        return session
+
+    def save(self, key, session):
+        self.live.set(key, session)
+        if self.backend and self.write_through:
+            self.backend.save(key, session.to_json())
+
+    def spill(self, key, session):
+        if self.backend:
+            self.backend.save(key, session.to_json())
+
+    # Writes every live session to the backend (e.g. before shutting down)
+    def flush(self):
+        for key, session in self.live.values():
+            self.spill(key, session)
+
+    # Spills the expired live sessions and removes from the backend the sessions
+    # not used in the last max_age seconds
+    def purge(self, max_age=SESSION_MAX_AGE):
+        self.live.expire()
+        if self.backend:
+            self.backend.purge(max_age)
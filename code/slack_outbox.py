@@ -0,0 +1,141 @@
+#!/usr/bin/python
+# coding=utf-8
+
+######   LIBRARIES ########
+import time
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+######   CONSTANTS ########
+
+# Seconds a reply waits for the next replies to the same channel, to send them together
+SLACK_COALESCE_WINDOW = 0.25
+# Minimum seconds between two messages posted to the same channel (Slack allows about one per second)
+SLACK_CHANNEL_INTERVAL = 1.0
+# Texts are merged up to this length, longer replies are posted as separate messages
+SLACK_MAX_TEXT = 4000
+# Threads posting to different channels at the same time
+SLACK_OUTBOX_WORKERS = 4
+# Seconds to wait when Slack answers 'ratelimited' without a Retry-After header
+SLACK_DEFAULT_RETRY_AFTER = 1
+# Attempts of a message rejected by the rate limit before it is dropped
+SLACK_MAX_ATTEMPTS = 5
+
+
+"""
+    Asynchronous queue of the messages posted to Slack. send() returns
+    at once; the texts sent to a channel within SLACK_COALESCE_WINDOW
+    seconds are merged and posted as a single message, at most one
+    message per channel every SLACK_CHANNEL_INTERVAL seconds, keeping
+    the order of each channel. Messages rejected with 'ratelimited' are
+    retried after the Retry-After seconds given by Slack.
+
+    post(channel, text) does the actual chat.postMessage call and
+    returns the Slack API result.
+"""
+class SlackOutbox():
+    def __init__(self, post, window=SLACK_COALESCE_WINDOW, interval=SLACK_CHANNEL_INTERVAL,
+                 max_text=SLACK_MAX_TEXT, n_workers=SLACK_OUTBOX_WORKERS):
+        self.post = post
+        self.window = window
+        self.interval = interval
+        self.max_text = max_text
+        self.condition = threading.Condition()
+        # channel -> texts waiting to be posted
+        self.pending = {}
+        # (time, channel) of the channels with texts waiting, earliest first
+        self.due = []
+        # channels with a post in progress, their new texts wait until it ends
+        self.busy = set()
+        # channel -> earliest time of its next post
+        self.next_post = {}
+        self.posts = 0
+        self.texts = 0
+        self.rate_limited = 0
+        self.executor = ThreadPoolExecutor(max_workers=n_workers)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def send(self, channel, text):
+        with self.condition:
+            self.texts += 1
+            texts = self.pending.get(channel)
+            if texts is not None:
+                texts.append(text)
+                return
+            self.pending[channel] = [text]
+            if channel not in self.busy:
+                self.schedule(channel, time.time() + self.window)
+
+    def schedule(self, channel, when):
+        heapq.heappush(self.due, (max(when, self.next_post.get(channel, 0)), channel))
+        self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.due or self.due[0][0] > time.time():
+                    self.condition.wait(self.due[0][0] - time.time() if self.due else None)
+                _, channel = heapq.heappop(self.due)
+                texts = self.pending.pop(channel, None)
+                if not texts:
+                    continue
+                self.busy.add(channel)
+            self.executor.submit(self.deliver, channel, texts)
+
+    # Posts the merged texts of a channel, then schedules the texts sent meanwhile
+    def deliver(self, channel, texts):
+        try:
+            for i, text in enumerate(self.merge(texts)):
+                if i > 0:
+                    time.sleep(self.interval)
+                self.post_with_retry(channel, text)
+        finally:
+            with self.condition:
+                self.busy.discard(channel)
+                self.next_post[channel] = time.time() + self.interval
+                if channel in self.pending:
+                    self.schedule(channel, time.time())
+                self.condition.notify_all()
+
+    def post_with_retry(self, channel, text):
+        for attempt in range(SLACK_MAX_ATTEMPTS):
+            try:
+                result = self.post(channel, text)
+            except Exception as inst:
+                print('Slack message not sent: {}'.format(inst))
+                return
+            with self.condition:
+                self.posts += 1
+            if not result or result.get('error') != 'ratelimited':
+                return
+            with self.condition:
+                self.rate_limited += 1
+            retry_after = (result.get('headers') or {}).get('Retry-After', '')
+            time.sleep(int(retry_after) if str(retry_after).isdigit() else SLACK_DEFAULT_RETRY_AFTER)
+        print('Slack message dropped after {} rate limited attempts'.format(SLACK_MAX_ATTEMPTS))
+
+    # Joins consecutive texts in messages of up to max_text characters
+    def merge(self, texts):
+        messages = []
+        for text in texts:
+            if messages and len(messages[-1]) + 1 + len(text) <= self.max_text:
+                messages[-1] = messages[-1] + '\n' + text
+            else:
+                messages.append(text)
+        return messages
+
+    # Waits until every text sent so far has been posted, False on timeout
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while self.pending or self.busy:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def stats(self):
+        return {'texts': self.texts, 'posts': self.posts, 'rate_limited': self.rate_limited}
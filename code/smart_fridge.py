@@ -5,14 +5,36 @@
 import pprint
 import os
 import time
+import select
+import threading
+import collections
 import datetime
-import psycopg2
-import requests
 import urllib.request
 import json
+import random
+import atexit
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from slackclient import SlackClient
+from websocket import WebSocketConnectionClosedException
 from watson_developer_cloud import VisualRecognitionV3 as VisualRecognition
 from watson_developer_cloud import ConversationV1 as Conversation
+from watson_developer_cloud import WatsonException
+from sessions import SessionStore, SQLiteSessionBackend, session_key, SESSION_TTL, MAX_LIVE_SESSIONS
+from cache import TTLCache
+from image_cache import ImageCache
+from food_classifier import WatsonFoodClassifier, LocalFoodClassifier, BatchingClassifier, downscale_image
+from transport import HttpTransport, HTTP_READ_TIMEOUT, TRANSPORT_ERRORS, redact_url
+from metrics import registry, span
+from slack_outbox import SlackOutbox
+from database import DatabasePool, DB_STRING_CONNECTION
+from ingredients import normalize_ingredient
+from expiry import ExpiryTracker
+from inventory import InventoryService, ChangeFeed
+from tenants import FridgeDirectory, DEFAULT_FRIDGE_ID
+from recipe_index import RecipeIndex
+from recipe_scoring import FridgeScorer
+from local_nlu import LocalClassifier, load_workspace, confident_intent
+from dialog import DialogEngine
 
 ######   CONSTANTS ########
 
@@ -22,14 +44,29 @@ BOT_ID = os.environ.get("BOT_ID")
 SLACK_BOT_TOKEN=os.environ.get('SLACK_BOT_TOKEN')
 # String to identify messages with bot as recipient
 AT_BOT = "<@" + BOT_ID + ">"
-# Delay between reading from firehose
-READ_WEBSOCKET_DELAY = 1
+# Maximum time (seconds) to block waiting for a websocket frame before looping again
+READ_WEBSOCKET_TIMEOUT = 5
+# Maximum number of frames drained from the websocket in a single batch
+MAX_EVENTS_PER_BATCH = 100
+# Seconds before the first attempt to reconnect a lost RTM websocket, doubled after every failure
+SLACK_RECONNECT_DELAY = 1
+# Maximum seconds between two attempts to reconnect the RTM websocket
+SLACK_MAX_RECONNECT_DELAY = 60
+# Number of commands (from different channels) handled concurrently
+DISPATCHER_WORKERS = 8
 
 # Food2fork API key
 FOOD2FORK_KEY=os.environ.get('FOOD2FORK_KEY')
-
-# Postgres database connection string
-DB_STRING_CONNECTION = "host='localhost' dbname='smartfridge' user='postgres' password='postgres'"
+# Food2fork API base url
+FOOD2FORK_URL = os.environ.get('FOOD2FORK_URL', 'http://food2fork.com/api')
+# Seconds a Food2fork search result is reused (top rated and trending lists change slowly)
+SEARCH_CACHE_TTL = 30 * 60
+# Seconds a Food2fork recipe detail is reused
+RECIPE_CACHE_TTL = 24 * 60 * 60
+# Maximum number of entries of each Food2fork cache
+FOOD2FORK_CACHE_SIZE = 2048
+# Optional file where the Food2fork caches are persisted between restarts
+FOOD2FORK_CACHE_PATH = os.environ.get('FOOD2FORK_CACHE_PATH')
 
 # Watson Visual Recognition version (to ensure backward compatibility)
 VISUAL_RECOGNITION_VERSION = '2017-10-15'
@@ -37,6 +74,24 @@ VISUAL_RECOGNITION_VERSION = '2017-10-15'
 VISUAL_RECOGNITION_URL = 'https://gateway-a.watsonplatform.net/visual-recognition/api'
 # Watson Visual Recognition API key
 VISUAL_RECOGNITION_KEY = os.environ.get('VISUAL_RECOGNITION_KEY')
+# 'watson' classifies the photos with Watson Visual Recognition, 'local' with FOOD_MODEL_PATH
+IMAGE_CLASSIFIER = os.environ.get('IMAGE_CLASSIFIER', 'watson')
+# Local food classifier model (.npz or .onnx), see food_classifier.LocalFoodClassifier
+FOOD_MODEL_PATH = os.environ.get('FOOD_MODEL_PATH', 'models/food.npz')
+# Minimum probability of a food predicted by the local classifier
+FOOD_MODEL_MIN_SCORE = 0.3
+# Largest photo accepted from Slack, in bytes (the Visual Recognition limit)
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+# Photos are downscaled to this width/height before being classified
+IMAGE_MAX_SIDE = 512
+# Bytes read at once from a Slack file download
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Classified images kept, found by content (and perceptual) hash
+IMAGE_CACHE_SIZE = 1024
+# Seconds an image classification is kept
+IMAGE_CACHE_TTL = 30 * 24 * 60 * 60
+# File where the image classifications are persisted between runs (optional)
+IMAGE_CACHE_PATH = os.environ.get('IMAGE_CACHE_PATH')
 
 # Watson Conversation version (to ensure backward compatibility)
 CONVERSATION_VERSION = '2017-09-23'
@@ -48,43 +103,191 @@ CONVERSATION_PASSWORD = os.environ.get('CONVERSATION_PASSWORD')
 CONVERSATION_WORKSPACE = os.environ.get('CONVERSATION_WORKSPACE')
 # Watson Conversation base url
 CONVERSATION_URL = 'https://gateway.watsonplatform.net/conversation/api'
+# Exported Watson Conversation workspace, used to train the local intent/entity classifier
+CONVERSATION_WORKSPACE_FILE = os.environ.get('CONVERSATION_WORKSPACE_FILE', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'conversation', 'json backups',
+    'workspace-e8744a2e-ace8-43a4-b4e8-8882043e67e7_20180319_B.json'))
+# Minimum confidence of the local classifier to answer a turn without Watson, and minimum lead
+# over the second intent. benchmark.py local_nlu reports the precision of every intent answered
+# locally: the confidence is not lowered below 0.8 until they are as precise as Watson
+LOCAL_NLU_CONFIDENCE = 0.8
+LOCAL_NLU_MARGIN = 0.3
+# Intents answered without Watson, see local_conversation_turn
+LOCAL_NLU_INTENTS = ('select_option', 'available_ingredients', 'negative_reaction')
+# Synonyms of the first option in the workspace that, as an answer, mean any option:
+# the turns choosing an option with them are left to Watson
+UNDECIDED_OPTION_WORDS = ('any', 'whatever')
+# 'watson' sends every turn to Watson Conversation, 'local' runs the exported workspace in process
+CONVERSATION_ENGINE = os.environ.get('CONVERSATION_ENGINE', 'watson')
+# File where the Watson Conversation turns (request and response) are recorded, one JSON per line
+CONVERSATION_RECORD_FILE = os.environ.get('CONVERSATION_RECORD_FILE')
 
 # Number of remaining days to consider a product as next to expire
 DAYS_TO_EXPIRE = 7
+# Slack channel where the expiration digests of DEFAULT_FRIDGE_ID are posted when the fridge has no
+# alert_channel (no digests if not set)
+EXPIRY_ALERT_CHANNEL = os.environ.get('EXPIRY_ALERT_CHANNEL')
+
+# Fixed queries, prepared once per database connection: name -> (argument types, query).
+# The queries of the bot read the products of one fridge ($1), through the indexes leading
+# with fridge_id of scripts/tenants.sql. A statement that cannot be prepared fails every
+# query, so these only use the required schema (scripts/database_bck_plain.sql, summary.sql,
+# ingredient_search.sql, expiry.sql, inventory.sql and tenants.sql)
+DB_STATEMENTS = {
+    # Number of products, expired products and products to expire in next DAYS_TO_EXPIRE days,
+    # in a single round trip. Comparing expiration_date itself against day boundaries
+    # (instead of date(expiration_date)) lets both buckets use products_fridge_expiration_idx
+    'inventory_summary': (['integer'], "SELECT (SELECT count(*) FROM products WHERE fridge_id = $1), "
+                                       "ARRAY(SELECT name "
+                                       "      FROM products "
+                                       "      WHERE fridge_id = $1 "
+                                       "      AND expiration_date < current_date + 1 "
+                                       "      ORDER by name), "
+                                       "ARRAY(SELECT name "
+                                       "      FROM products "
+                                       "      WHERE fridge_id = $1 "
+                                       "      AND expiration_date >= current_date + 1 "
+                                       "      AND expiration_date < current_date + {} "
+                                       "      ORDER by name)".format(DAYS_TO_EXPIRE + 1)),
+    # Products with the closest expiration date and that are in more quantity
+    'top_expired_ingredients': (['integer', 'integer'], "SELECT name "
+                                                        "FROM products "
+                                                        "WHERE fridge_id = $1 "
+                                                        "AND expiration_date >= current_date + 1 "
+                                                        "ORDER by expiration_date ASC, quantity DESC "
+                                                        "LIMIT $2"),
+    # Stock and expiration date of the products matching a normalized ingredient name, best matches
+    # first. The substring and similarity (%) conditions filter the products of the fridge
+    'ingredient_information': (['integer', 'text'], "SELECT name, expiration_date, quantity "
+                                                    "FROM products "
+                                                    "WHERE fridge_id = $1 "
+                                                    "AND (lower(name) LIKE '%' || $2 || '%' "
+                                                    "     OR lower(name) % $2) "
+                                                    "ORDER by similarity(lower(name), $2) DESC, expiration_date ASC"),
+    # Expiration data of every product (of every fridge), and of the products modified since a given time
+    'products_expiry': ([], "SELECT id, fridge_id, name, expiration_date, quantity, modified "
+                            "FROM products"),
+    'products_modified_since': (['timestamp with time zone'], "SELECT id, fridge_id, name, expiration_date, "
+                                                              "quantity, modified "
+                                                              "FROM products "
+                                                              "WHERE modified > $1"),
+    # Stock of the fridge, to rank the suggested recipes
+    'fridge_inventory': (['integer'], "SELECT name, expiration_date, quantity "
+                                      "FROM products "
+                                      "WHERE fridge_id = $1"),
+}
+# Alternative (e.g. Spanish) names of the products, read once at startup. Not a prepared
+# statement: without the table the bot works, without aliases
+INGREDIENT_ALIASES_QUERY = "SELECT alias, name FROM ingredient_aliases"
 # Number of dish options provided to the user
 TOTAL_NUMBER_OPTIONS = 6
+# Number of dish options based on the ingredients about to expire
+AVAILABLE_INGREDIENTS_OPTIONS = 2
+# Seconds to wait for each recipe source (available ingredients, top rated, trending)
+RECIPE_SOURCE_DEADLINE = 3
+# Seconds the details of the displayed options are kept prefetched waiting for a selection
+RECIPE_PREFETCH_TTL = SESSION_TTL
+# Threads prefetching the details of the displayed options
+RECIPE_PREFETCH_WORKERS = 2 * TOTAL_NUMBER_OPTIONS
+# Recipe dump (one Food2Fork recipe per line) indexed locally for the suggestions based on
+# the ingredients about to expire, without a Food2Fork search per request (optional)
+RECIPE_INDEX_PATH = os.environ.get('RECIPE_INDEX_PATH')
+# Number of ingredients about to expire matched against the local recipe index
+INDEXED_EXPIRING_INGREDIENTS = 10
+
+# SQLite file where conversation sessions evicted from memory are kept
+SESSION_DB_PATH = os.environ.get('SESSION_DB_PATH', 'sessions.db')
+# Seconds between two purges of the expired sessions, see start_session_purge
+SESSION_PURGE_INTERVAL = 10 * 60
+
+# Maximum length of the text of a Slack block section
+SLACK_SECTION_TEXT = 3000
+# Seconds given to the Slack outbound queue to post the pending replies when the bot exits
+SLACK_FLUSH_TIMEOUT = 5
+
+# Local port serving the latency metrics at /metrics, Prometheus text format (not served if not set)
+METRICS_PORT = os.environ.get('METRICS_PORT')
+# File where the latency metrics are written every METRICS_DUMP_INTERVAL seconds (optional)
+METRICS_DUMP_FILE = os.environ.get('METRICS_DUMP_FILE')
+METRICS_DUMP_INTERVAL = 60
+
+
+# Commands directed at the bot in a list of Slack events (RTM or Events API), with their event
+def slack_commands(slack_events):
+    output_list = slack_events
+    if output_list and len(output_list) > 0:
+        for output in output_list:
+            if output and 'text' in output and AT_BOT in output['text']:
+                # return text after the @ mention, whitespace removed
+                yield output['text'].split(AT_BOT)[1].strip().lower(), output
+            elif output and 'file' in output and 'url_private_download' in output['file']:
+                down_url = output['file']['url_private_download']
+                extension = os.path.splitext(down_url)[1][1:].strip().lower()
+                if extension in ['jpg', 'png'] and output['file'].get('size', 0) > MAX_IMAGE_BYTES:
+                    yield 'download_file_size_error', output
+                elif extension in ['jpg', 'png']:
+                    yield 'photo', output
+                else:
+                    yield 'download_file_format_error', output
 
 
 class SmartFridge():
     def __init__(self):
-        self.context = {}
-        self.option_dict = {}
-        self.intents = []
-        self.entities = []
-        self.recipe_options = []
-        self.database_cursor = None
-
-
-        # Reset enviroment variables
-
-        self.context['search_recipe'] = False
-        self.context['image_recipe'] = False
-        self.context['suggest_dish'] = False
-        self.context['yum_sugest'] = False
-        self.context['summary'] = False
-        self.context['option'] = None
-        self.context['cuisine_type'] = None
-        self.context['ingredients'] = None
-        self.context['intolerances'] = None
-        self.context['dish'] = None
-        self.context['counter'] = 0
-        self.context['insult_counter'] = 0
+        self.database = None
+        # normalized alternative name -> normalized product name
+        self.ingredient_aliases = {}
+        # In-memory expiration state of the products, see start_expiry_tracker
+        self.expiry_tracker = None
+        self.change_feed = None
+        # Writes to the products table (add, consume, discard)
+        self.inventory = None
+        # Fridge of every Slack team/user, see the fridge_id property
+        self.fridges = None
+
+        # Conversation sessions, one per (team, channel, user)
+        self.sessions = SessionStore(SQLiteSessionBackend(SESSION_DB_PATH))
+        atexit.register(self.sessions.flush)
+        # Session of the conversation handled by the current thread
+        self.local = threading.local()
+
+        # Food2fork responses cache
+        self.search_cache = TTLCache(maxsize=FOOD2FORK_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+        self.recipe_cache = TTLCache(maxsize=FOOD2FORK_CACHE_SIZE, ttl=RECIPE_CACHE_TTL)
+        # Slack renderings of the recipes, see render_recipe
+        self.rendered_recipes = TTLCache(maxsize=FOOD2FORK_CACHE_SIZE, ttl=RECIPE_CACHE_TTL)
+        if FOOD2FORK_CACHE_PATH:
+            self.load_food2fork_cache(FOOD2FORK_CACHE_PATH)
+            atexit.register(self.save_food2fork_cache, FOOD2FORK_CACHE_PATH)
+        # Visual recognition results of the images already classified
+        self.image_cache = ImageCache(maxsize=IMAGE_CACHE_SIZE, ttl=IMAGE_CACHE_TTL)
+        if IMAGE_CACHE_PATH:
+            self.load_image_cache(IMAGE_CACHE_PATH)
+            atexit.register(self.save_image_cache, IMAGE_CACHE_PATH)
+        # Local ingredient -> recipes index, see start_recipe_index
+        self.recipe_index = RecipeIndex(RECIPE_INDEX_PATH)
+        # Recipe sources of a suggestion are fetched concurrently
+        self.source_executor = ThreadPoolExecutor(max_workers=3 * DISPATCHER_WORKERS)
+        # Details of the displayed options being prefetched: session key -> {recipe_id: Future}.
+        # Prefetches not used before they expire (or replaced by new options) are cancelled
+        self.recipe_prefetches = TTLCache(maxsize=MAX_LIVE_SESSIONS, ttl=RECIPE_PREFETCH_TTL,
+                                          on_evict=self.cancel_recipe_prefetch)
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=RECIPE_PREFETCH_WORKERS)
+        registry.add_collector(self.cache_metrics)
 
 
         # Services initialization
 
         #  Slack client instance
         self.slack_client = SlackClient(SLACK_BOT_TOKEN)
+        # Replies are queued, merged per channel and posted in background within the rate limits
+        self.outbox = SlackOutbox(self.post_message)
+        atexit.register(self.outbox.flush, SLACK_FLUSH_TIMEOUT)
+
+        # Outbound HTTP transports (connection pool, timeouts, retries and circuit breaker)
+        self.food2fork_http = HttpTransport('food2fork')
+        self.slack_http = HttpTransport('slack files')
+        self.conversation_http = HttpTransport('watson conversation')
+        self.visual_recognition_http = HttpTransport('watson visual recognition')
 
         # Watson Conversation sevice instance
         self.conversation = Conversation(version = CONVERSATION_VERSION,
@@ -96,6 +299,36 @@ class SmartFridge():
         self.visual_recognition = VisualRecognition(version=VISUAL_RECOGNITION_VERSION,
                                                     url=VISUAL_RECOGNITION_URL,
                                                     api_key=VISUAL_RECOGNITION_KEY)
+
+        # Watson SDK requests do not time out unless configured
+        for service in (self.conversation, self.visual_recognition):
+            if hasattr(service, 'set_http_config'):
+                service.set_http_config({'timeout': HTTP_READ_TIMEOUT})
+
+        # Food image classifier: local model (photos arriving together are batched) or Watson
+        self.food_classifier = WatsonFoodClassifier(self.visual_recognition, self.visual_recognition_http)
+        if IMAGE_CLASSIFIER == 'local':
+            try:
+                self.food_classifier = BatchingClassifier(LocalFoodClassifier(FOOD_MODEL_PATH,
+                                                                              FOOD_MODEL_MIN_SCORE))
+            except Exception as inst:
+                print('Local food classifier not loaded, using Watson: {}'.format(inst))
+        # Local intent/entity classifier trained with the exported workspace
+        self.workspace = None
+        self.local_nlu = None
+        if os.path.exists(CONVERSATION_WORKSPACE_FILE):
+            self.workspace = load_workspace(CONVERSATION_WORKSPACE_FILE)
+            self.local_nlu = LocalClassifier.from_workspace(self.workspace)
+
+        # Dialog of the workspace run in process instead of Watson Conversation
+        self.dialog_engine = None
+        if CONVERSATION_ENGINE == 'local':
+            if self.workspace is None:
+                print('Workspace {} not found, using Watson Conversation'.format(CONVERSATION_WORKSPACE_FILE))
+            else:
+                self.dialog_engine = DialogEngine(self.workspace, self.local_nlu)
+        self.record_lock = threading.Lock()
+
         # Database connection
         self.database_connection(DB_STRING_CONNECTION)
 
@@ -103,10 +336,59 @@ class SmartFridge():
 
     ######   CONVERSATION MANAGEMENT ########
 
+    # Session of the command handled by the current thread. There is no session outside
+    # handle_command: a shared default session would mix the conversations of several users
+    @property
+    def session(self):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            raise RuntimeError('No conversation session outside handle_command')
+        return session
+
+    @property
+    def conversation_key(self):
+        key = getattr(self.local, 'key', None)
+        if key is None:
+            raise RuntimeError('No conversation session outside handle_command')
+        return key
+
+    # Fridge of the user of the command handled by the current thread, looked up the
+    # first time a command reads the products
+    @property
+    def fridge_id(self):
+        fridge_id = getattr(self.local, 'fridge_id', None)
+        if fridge_id is None:
+            team, user = getattr(self.local, 'member', None) or (None, None)
+            fridge_id = self.local.fridge_id = self.fridges.resolve(team, user)
+        return fridge_id
+
+    # Loads the conversation session of the user, processes the command
+    # and stores the updated session back
+    def handle_command(self, command, channel, user=None, team=None, file=None):
+        key = session_key(team, channel, user)
+        self.local.key = key
+        self.local.member = (team, user)
+        self.local.fridge_id = None
+        self.local.branch = 'unknown'
+        self.local.session = self.sessions.get(key)
+        try:
+            # reply latency labelled with the branch of process_command that handled it
+            with span('command') as labels:
+                try:
+                    self.process_command(command, channel, file)
+                finally:
+                    labels['branch'] = self.local.branch
+        finally:
+            self.sessions.save(key, self.local.session)
+            self.local.session = None
+            self.local.key = None
+            self.local.member = None
+            self.local.fridge_id = None
+
     # Receives commands directed at the bot and determines if they
     # are valid commands. If so, then acts on the commands. If not,
     # returns back what it needs for clarification.
-    def handle_command(self, command):
+    def process_command(self, command, channel, file=None):
 
         response = "Not sure what you mean. Please reword your request"
 
@@ -114,66 +396,72 @@ class SmartFridge():
 
         # Processing of the response
         if command == 'download_file_format_error':
+            self.local.branch = 'file_error'
             response = 'The file extension is not valid. Try with JPG or PNG.'
+        elif command == 'download_file_size_error':
+            self.local.branch = 'file_error'
+            response = 'The image is too big. Try with one smaller than {} MB.'.format(MAX_IMAGE_BYTES // (1024 * 1024))
         # Food image recognition
         elif command.startswith('photo'):
-            self.send_response('Please, give me a second... :hourglass_flowing_sand:')
-            self.context['image_recipe'] = "true"
+            self.local.branch = 'photo'
+            self.send_response('Please, give me a second... :hourglass_flowing_sand:', channel)
+            self.session.context['image_recipe'] = "true"
             response_text, intent, entity=self.update_conversation_context()
-            response = self.image_food_recognition()
+            response = self.image_food_recognition(channel, file)
         else:
             response_text, intent, entity = self.msg_to_conversation(command)
             print('intent = {} '.format(intent))
             print('entity = {} '.format(entity))
+            self.local.branch = self.command_branch(intent)
 
             # A suggestion is provide to the user because the required information
             # is not provided by the user after several attempts
             # $yum_sugest
-            if(self.context['yum_sugest'] == 'true'):
-                self.send_response(response_text)
+            if(self.session.context['yum_sugest'] == 'true'):
+                self.send_response(response_text, channel)
                 response = self.yum_suggestion()
 
             # $suggest_dish
-            elif(self.context['suggest_dish'] == 'true'):
-                self.send_response(response_text)
+            elif(self.session.context['suggest_dish'] == 'true'):
+                self.send_response(response_text, channel)
                 response = self.suggest_dish()
 
             # $summary
-            elif(self.context['summary'] == 'true'):
-                self.send_response(response_text)
+            elif(self.session.context['summary'] == 'true'):
+                self.send_response(response_text, channel)
                 response = self.get_db_summary()
 
             # $search_recipe
-            elif(self.context['search_recipe'] == 'true'):
-                self.send_response(response_text)
+            elif(self.session.context['search_recipe'] == 'true'):
+                self.send_response(response_text, channel)
                 response = self.get_recipe()
 
             # #get_recipe
             elif intent == 'get_recipe':
-                if(self.context['search_recipe'] == 'true'):
+                if(self.session.context['search_recipe'] == 'true'):
                     response = self.get_recipe()
-                elif(self.context['yum_sugest'] == 'true'):
+                elif(self.session.context['yum_sugest'] == 'true'):
                     response = self.yum_suggestion()
                 else:
                     response= response_text
 
             # #suggest_dish
             elif intent=='sugest_dish':
-                if(self.context['suggest_dish'] == 'true'):
+                if(self.session.context['suggest_dish'] == 'true'):
                     response = self.suggest_dish()
-                elif(self.context['yum_sugest'] == 'true'):
+                elif(self.session.context['yum_sugest'] == 'true'):
                     response = self.yum_suggestion()
                 else:
                     response = response_text
 
             # #available_ingredients
             elif intent=='available_ingredients':
-                ingredients = self.context['ingredients']
+                ingredients = self.session.context['ingredients']
                 if ingredients != None:
-                    self.send_response(response_text)
+                    self.send_response(response_text, channel)
                     response = self.get_ingredients_information(ingredients)
                 else:
-                    self.send_response(response_text)
+                    self.send_response(response_text, channel)
                     response = self.get_db_summary()
 
             # #needed_ingredients
@@ -197,18 +485,28 @@ class SmartFridge():
                 response = response_text
 
         # Send the corresponding response to the user interface (slack)
-        self.send_response(response)
+        self.send_response(response, channel)
+
+
+    # Name of the branch of process_command taken for this intent and context (metrics label)
+    def command_branch(self, intent):
+        for flag in ('yum_sugest', 'suggest_dish', 'summary', 'search_recipe'):
+            if self.session.context[flag] == 'true':
+                return '$' + flag
+        return '#' + intent if intent else 'anything_else'
 
 
     def select_option(self):
         response = ''
-        if (self.context['option']!= None) and (len(self.recipe_options) > 0):
-            index = self.parse_to_valid_index(self.context['option'])
+        if (self.session.context['option']!= None) and (len(self.session.recipe_options) > 0):
+            index = self.parse_to_valid_index(self.session.context['option'])
             if index != None:
-                selection = self.recipe_options[index]
+                selection = self.session.recipe_options[index]
+                # usually served from recipe_cache, filled by the prefetch while the options were shown
+                self.wait_recipe_prefetch(self.session.option_dict[selection])
                 response = 'Ok, good choice! The {} recipe below: '.format(selection)
-                response = response + '\n' + self.get_ingredients(self.option_dict[selection])
-                self.recipe_options = []
+                response = response + '\n' + self.get_ingredients(self.session.option_dict[selection])
+                self.session.recipe_options = []
 
         return response
 
@@ -232,29 +530,38 @@ class SmartFridge():
         response = ''
         footer = 'Please, provide a valid option from 1 to 6'
 
-        self.recipe_options= []
-        self.context['yum_sugest'] = False
+        self.session.recipe_options= []
+        self.session.context['yum_sugest'] = False
 
         if n_options > 0:
 
-            available_ingredients_options = []
-            top_rated_options = []
-            trending_options = []
-
-            # n_recipes recipe suggestion by using the n_ingredients with closest expiration date and biggest quantity
-            available_ingredients_options = self.get_recipe_options_from_available_ingredients(n_options=2,
-                                                                                               n_ingredients=2)
-
-            top_rated_options = self.get_top_rated_recipe_options\
-                (n_options=((TOTAL_NUMBER_OPTIONS - len(available_ingredients_options)) // 2)
-                           + ((TOTAL_NUMBER_OPTIONS - len(available_ingredients_options)) % 2))
-
-            trending_options = self.get_trending_recipe_options(
-                n_options=((TOTAL_NUMBER_OPTIONS - len(available_ingredients_options)) // 2))
-
-            self.recipe_options = available_ingredients_options + top_rated_options + trending_options
-            print(self.recipe_options)
-            for i, recipe in enumerate(self.recipe_options[:n_options]):
+            # The three sources are requested at the same time, so the user waits for the
+            # slowest one instead of the sum. Every source returns up to n_options candidates
+            # so that the others can fill the gap if one of them fails or times out.
+            start = time.time()
+            available_ingredients_options, top_rated_options, trending_options = self.fetch_recipe_sources(
+                [lambda: self.get_recipe_options_from_available_ingredients(n_options=n_options, n_ingredients=2),
+                 lambda: self.get_top_rated_recipe_options(n_options=n_options),
+                 lambda: self.get_trending_recipe_options(n_options=n_options)])
+
+            n_available = min(AVAILABLE_INGREDIENTS_OPTIONS, len(available_ingredients_options))
+            quotas = [n_available,
+                      ((n_options - n_available) // 2) + ((n_options - n_available) % 2),
+                      (n_options - n_available) // 2]
+            sources = [available_ingredients_options, top_rated_options, trending_options]
+            # Every candidate is ranked by how well the fridge covers it, within what is left of
+            # the deadline of the sources; the quotas are only used when the ranking is not possible
+            candidates = self.merge_recipe_options(sources, [n_options] * len(sources), n_options * len(sources))
+            options = self.rank_recipe_options(candidates, n_options,
+                                               start + RECIPE_SOURCE_DEADLINE - time.time())[:n_options]
+            if not options:
+                options = self.merge_recipe_options(sources, quotas, n_options)
+            for title, recipe_id in options:
+                self.session.recipe_options.append(title)
+                self.session.option_dict[title] = recipe_id
+            print(self.session.recipe_options)
+            self.prefetch_recipes([recipe_id for _, recipe_id in options])
+            for i, recipe in enumerate(self.session.recipe_options[:n_options]):
                 response = response + '\n' + '[{0}] :  {1}'.format(i+1, recipe)
 
         if response == '':
@@ -264,21 +571,159 @@ class SmartFridge():
         return response
 
 
+    # Runs every source concurrently and waits for each one at most its deadline.
+    # A source that fails or does not answer in time provides no options.
+    def fetch_recipe_sources(self, sources, deadline=RECIPE_SOURCE_DEADLINE):
+        start = time.time()
+        futures = [self.source_executor.submit(self.for_member(source)) for source in sources]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result(timeout=max(0, start + deadline - time.time())))
+            except TimeoutError:
+                future.cancel()
+                print('Recipe source timed out')
+                results.append([])
+            except Exception as inst:
+                print(inst)
+                results.append([])
+        return results
+
+
+    # Wraps function to run in another thread for the user of the current command,
+    # so the products it reads are the ones of the user's fridge
+    def for_member(self, function):
+        member = getattr(self.local, 'member', None)
+        fridge_id = getattr(self.local, 'fridge_id', None)
+
+        def run():
+            self.local.member = member
+            self.local.fridge_id = fridge_id
+            try:
+                return function()
+            finally:
+                self.local.member = None
+                self.local.fridge_id = None
+
+        return run
+
+
+    # Fetches in background the details of the options shown to the user, so the selection
+    # does not wait for Food2Fork. Replaces the prefetches of the previous options.
+    def prefetch_recipes(self, recipe_ids):
+        key = self.conversation_key
+        self.cancel_recipe_prefetch(key, self.recipe_prefetches.pop(key, {}))
+        self.recipe_prefetches.expire()
+        futures = {recipe_id: self.prefetch_executor.submit(self.get_recipe_from_id, recipe_id)
+                   for recipe_id in recipe_ids if str(recipe_id) not in self.recipe_cache}
+        if futures:
+            self.recipe_prefetches.set(key, futures)
+
+
+    # Waits for the prefetch of the selected option and cancels the others
+    def wait_recipe_prefetch(self, recipe_id, timeout=RECIPE_SOURCE_DEADLINE):
+        key = self.conversation_key
+        futures = self.recipe_prefetches.pop(key, {})
+        future = futures.pop(recipe_id, None)
+        self.cancel_recipe_prefetch(key, futures)
+        if future is not None:
+            try:
+                future.result(timeout=timeout)
+            except TimeoutError:
+                print('Recipe prefetch timed out')
+            except Exception as inst:
+                print(inst)
+
+
+    # Fetches already running finish (and fill recipe_cache), the queued ones are dropped
+    def cancel_recipe_prefetch(self, key, futures):
+        for future in futures.values():
+            future.cancel()
+
+
+    # Orders the (title, recipe_id) candidates by fridge coverage, quantities and expiry urgency
+    # (see FridgeScorer), scoring the whole batch at once. The ingredients come from the Food2Fork
+    # cache and the local recipe index; only the first n_fetch candidates not found there are
+    # fetched, concurrently and within deadline seconds. Candidates whose ingredients are not
+    # known keep their order after the ranked ones. Returns [] if the fridge inventory is not available.
+    def rank_recipe_options(self, candidates, n_fetch=TOTAL_NUMBER_OPTIONS, deadline=RECIPE_SOURCE_DEADLINE):
+        try:
+            inventory = self.get_fridge_inventory()
+        except Exception as inst:
+            print('Recipes not ranked: {}'.format(inst))
+            return []
+        if not inventory or not candidates:
+            return []
+
+        ingredients = [self.known_recipe_ingredients(recipe_id) for _, recipe_id in candidates]
+        missing = [i for i, known in enumerate(ingredients) if known is None][:n_fetch]
+        if missing and deadline > 0:
+            details = self.fetch_recipe_sources([lambda recipe_id=candidates[i][1]: self.get_recipe_from_id(recipe_id)
+                                                 for i in missing], deadline)
+            for i, detail in zip(missing, details):
+                if detail and 'recipe' in detail:
+                    ingredients[i] = detail['recipe'].get('ingredients') or []
+        scored = []
+        unknown = []
+        for candidate, known in zip(candidates, ingredients):
+            if known is not None:
+                scored.append((candidate, known))
+            else:
+                unknown.append(candidate)
+        if not scored:
+            return []
+
+        order = FridgeScorer(inventory, DAYS_TO_EXPIRE).rank([ingredients for _, ingredients in scored])
+        return [scored[i][0] for i in order] + unknown
+
+
+    # Ingredient lines of a recipe known without a remote call, None if not cached nor indexed
+    def known_recipe_ingredients(self, recipe_id):
+        recipe = self.recipe_cache.get(str(recipe_id))
+        if recipe is not None and 'recipe' in recipe:
+            return recipe['recipe'].get('ingredients') or []
+        return self.recipe_index.ingredients(recipe_id)
+
+
+    def get_fridge_inventory(self):
+        if self.expiry_tracker and self.expiry_tracker.ready:
+            return self.expiry_tracker.inventory(self.fridge_id)
+        return self.database.execute('fridge_inventory', (self.fridge_id,))
+
+
+    # Takes quotas[i] options from sources[i] and, if some source falls short,
+    # fills the remaining places with the other candidates in source order
+    def merge_recipe_options(self, sources, quotas, n_options):
+        options = []
+        titles = set()
+        for fill in (False, True):
+            for candidates, quota in zip(sources, quotas):
+                taken = 0
+                for title, recipe_id in candidates:
+                    if len(options) >= n_options or (not fill and taken >= quota):
+                        break
+                    if title not in titles:
+                        titles.add(title)
+                        options.append((title, recipe_id))
+                        taken += 1
+        return options
+
+
     def suggest_dish(self):
-        print('ingredients={0}, cuisine type={1}, intolerances={2}'.format(self.context['ingredients'],
-                                                                           self.context['cuisine_type'],
-                                                                           self.context['intolerances']))
+        print('ingredients={0}, cuisine type={1}, intolerances={2}'.format(self.session.context['ingredients'],
+                                                                           self.session.context['cuisine_type'],
+                                                                           self.session.context['intolerances']))
 
         query = ''
         response = ':disappointed: Sorry, no recipes found for your request. Please, try a new search'
 
-        if (self.context['suggest_dish']):
-            if self.context['ingredients'] != None:
-                query = query + self.context['ingredients']
-            if self.context['cuisine_type'] != None:
-                query = query + ' ' + self.context['cuisine_type']
-            if self.context['intolerances'] != None:
-                query = query + ' ' + self.context['intolerances']
+        if (self.session.context['suggest_dish']):
+            if self.session.context['ingredients'] != None:
+                query = query + self.session.context['ingredients']
+            if self.session.context['cuisine_type'] != None:
+                query = query + ' ' + self.session.context['cuisine_type']
+            if self.session.context['intolerances'] != None:
+                query = query + ' ' + self.session.context['intolerances']
 
 
             if query != '':
@@ -289,38 +734,23 @@ class SmartFridge():
 
 
     def get_db_summary(self):
-        all_products = []
-        expired_products = []
-        products_to_expire = []
+        if self.expiry_tracker and self.expiry_tracker.ready:
+            n_products, expired_products, products_to_expire = self.expiry_tracker.summary(self.fridge_id)
+        else:
+            n_products, expired_products, products_to_expire = self.database.execute('inventory_summary',
+                                                                                     (self.fridge_id,))[0]
+        return self.format_db_summary(n_products, expired_products, products_to_expire)
+
+
+    def format_db_summary(self, n_products, expired_products, products_to_expire):
         header = ''
         recap = ''
+        footer = ''
 
-        # All products
-        query_all = "SELECT name " \
-                    "FROM products " \
-                    "ORDER by name"
-        all_products = self.fetch_content(query_all)
-
-        # Expired products
-        query_expired = "SELECT name " \
-                        "FROM products " \
-                        "WHERE date(expiration_date)<=current_date " \
-                        "ORDER by name"
-        expired_products = self.fetch_content(query_expired)
-
-        # Products to expire in next DAYS_TO_EXPIRE days
-        query_to_expire = "SELECT name " \
-                          "FROM products " \
-                          "WHERE date(expiration_date)>current_date " \
-                          "AND date(expiration_date)<=current_date + interval '{} days' " \
-                          "ORDER by name".format(DAYS_TO_EXPIRE)
-
-        products_to_expire= self.fetch_content(query_to_expire)
-
-        if len(all_products)>0:
+        if n_products>0:
             header = '\n\nThere are {0} products in total, ' \
                      '{1} products are already expired and {2} products will expire soon. '.\
-                            format(len(all_products), len(expired_products), len(products_to_expire))
+                            format(n_products, len(expired_products), len(products_to_expire))
 
             if(len(expired_products)>0):
                 footer = '\n\nThrow the expired foods out. '
@@ -344,13 +774,21 @@ class SmartFridge():
         return(header + recap + footer)
 
 
-    def image_food_recognition(self):
-        food, score = self.get_food_from_image('./download/food.jpg')
-        if (food != 'non-food'):
+    def image_food_recognition(self, channel, file):
+        image = self.download_image(file['url_private_download']) if file else None
+        if image is None:
+            return 'Sorry, I could not download the image. Please, try again.'
+        try:
+            food, score = self.get_food_from_image(image)
+        except (TimeoutError, WatsonException) + TRANSPORT_ERRORS as inst:
+            print('Image not classified: {}'.format(inst))
+            food, score = None, None
+        # None: nothing recognized, or the classifier did not answer
+        if food not in (None, 'non-food'):
             response = 'Uhm... :yum: :yum: :yum: This looks really good. I think (score: {1}) it is... *{0}*'\
                 .format(food, score)
-            self.send_response(response)
-            response = '\n' + smartfridge.get_ingredients(self.get_recipe_id(food))
+            self.send_response(response, channel)
+            response = '\n' + self.get_ingredients(self.get_recipe_id(food))
         else:
             response = 'Are you sure it is edible? I do not recognize food in this image. \nPlease, try with another one.'
 
@@ -359,31 +797,90 @@ class SmartFridge():
 
     def get_recipe(self):
         recipe = ':disappointed: Sorry, no recipes found for your request. Please, try a new search'
-        print('dish = {}'.format(self.context['dish']))
-        print('search_recipe = {}'.format(self.context['search_recipe']))
-        if (self.context['dish'] != None and self.context['search_recipe']):
-            print('Buscando receta para: << {} >>'.format(self.context['dish']))
-            recipe=self.get_ingredients(self.get_recipe_id(self.context['dish']))
+        print('dish = {}'.format(self.session.context['dish']))
+        print('search_recipe = {}'.format(self.session.context['search_recipe']))
+        if (self.session.context['dish'] != None and self.session.context['search_recipe']):
+            print('Buscando receta para: << {} >>'.format(self.session.context['dish']))
+            recipe=self.get_ingredients(self.get_recipe_id(self.session.context['dish']))
         return recipe
 
     def get_ingredients(self, recipeId):
         print('recipe id = {}'.format(recipeId))
         response = ':disappointed: Sorry, no recipes found for your request. Please, try a new search'
         if recipeId != None:
-            recipe = self.get_recipe_from_id(recipeId)
-            if recipe and 'recipe' in recipe:
-                ingredients=[]
-                source = '\nHere, you can find the *method of cooking*: {}'.format(recipe['recipe']['source_url'])
-                for ingredient in (recipe['recipe']['ingredients']):
-                    ingredients.append(ingredient)
-                    str_ingredients= '\nI found *{}*. To cook this you need the following *ingredients*:'\
-                                         .format(recipe['recipe']['title']) + \
-                                     '\n\n   - {}'.format('\n    - '.join(map(str, ingredients)))
-                response = str_ingredients + '\n' + source
+            rendered = self.render_recipe(recipeId)
+            if rendered is not None:
+                response = rendered['text']
 
         return response
 
 
+    # Slack text and blocks of a recipe, built once per recipe and cached next to the raw
+    # recipe, so selecting it again (any user) neither fetches nor formats it. None if not found.
+    def render_recipe(self, recipeId):
+        key = str(recipeId)
+        rendered = self.rendered_recipes.get(key)
+        if rendered is None:
+            recipe = self.get_recipe_from_id(recipeId)
+            if not recipe or 'recipe' not in recipe:
+                return None
+            rendered = {'text': self.format_recipe_text(recipe['recipe']),
+                        'blocks': self.format_recipe_blocks(recipe['recipe'])}
+            self.rendered_recipes.set(key, rendered)
+        return rendered
+
+
+    def format_recipe_text(self, recipe):
+        source = '\nHere, you can find the *method of cooking*: {}'.format(recipe['source_url'])
+        str_ingredients = '\nI found *{}*. To cook this you need the following *ingredients*:'\
+                              .format(recipe['title']) + \
+                          '\n\n   - {}'.format('\n    - '.join(map(str, recipe['ingredients'] or [])))
+        return str_ingredients + '\n' + source
+
+
+    # Block Kit version of format_recipe_text (section texts are limited to 3000 characters)
+    def format_recipe_blocks(self, recipe):
+        blocks = [{'type': 'section',
+                   'text': {'type': 'mrkdwn',
+                            'text': 'I found *{}*. To cook this you need the following *ingredients*:'
+                                    .format(recipe['title'])}}]
+        section = ''
+        for ingredient in recipe['ingredients'] or []:
+            line = '• {}'.format(ingredient)
+            if section and len(section) + 1 + len(line) > SLACK_SECTION_TEXT:
+                blocks.append({'type': 'section', 'text': {'type': 'mrkdwn', 'text': section}})
+                section = ''
+            section = section + '\n' + line if section else line[:SLACK_SECTION_TEXT]
+        if section:
+            blocks.append({'type': 'section', 'text': {'type': 'mrkdwn', 'text': section}})
+        blocks.append({'type': 'context',
+                       'elements': [{'type': 'mrkdwn',
+                                     'text': 'Here, you can find the *method of cooking*: {}'
+                                             .format(recipe['source_url'])}]})
+        return blocks
+
+
+
+    # Posts a digest to the alert channel of the fridge when products expire or enter the DAYS_TO_EXPIRE window
+    def send_expiry_digest(self, fridge_id, expired_products, products_to_expire):
+        digest = ''
+        if len(expired_products) > 0:
+            digest = digest + '\n' + ':recycle: *Expired today*:  {0}.'.format(', '.join(expired_products))
+        if len(products_to_expire) > 0:
+            digest = digest + '\n' + ':alarm_clock: *Will expire in the next {0} days*:  {1}.'\
+                .format(DAYS_TO_EXPIRE, ', '.join(products_to_expire))
+        if digest == '':
+            return
+        try:
+            channel = self.fridges.alert_channel(fridge_id)
+        except Exception as inst:
+            print('Alert channel of fridge {0} not found: {1}'.format(fridge_id, inst))
+            return
+        if channel is None and fridge_id == DEFAULT_FRIDGE_ID:
+            channel = EXPIRY_ALERT_CHANNEL
+        if channel:
+            self.send_response('Fridge update :bell:' + digest, channel)
+
 
     def get_ingredients_information(self, ingredients):
         info = ""
@@ -414,10 +911,19 @@ class SmartFridge():
     def get_trending_recipe(self):
         return self.get_ingredients(self.get_recipe_id('', 't'))
 
+    # With the local recipe index, recipes are ranked by how many of the ingredients about
+    # to expire they use. Otherwise Food2Fork is searched with the n_ingredients first ones.
     def get_recipe_options_from_available_ingredients(self, n_options=2, n_ingredients=2):
         ingredients = []
         options = []
 
+        if self.recipe_index.ready:
+            ingredients = self.get_top_expired_ingredients_from_db(INDEXED_EXPIRING_INGREDIENTS)
+            terms = [self.ingredient_aliases.get(normalize_ingredient(i), i) for i in ingredients]
+            return self.recipe_index.search(terms, n_options)
+
+        recipes = None
+
         # IMPROVEMENT: add to the query the register user intolerances
         ingredients = self.get_top_expired_ingredients_from_db(n_ingredients)
 
@@ -427,8 +933,7 @@ class SmartFridge():
 
         if recipes and 'recipes' in recipes:
             for recipe in recipes['recipes'][:n_options]:
-                options.append(recipe['title'])
-                self.option_dict[recipe['title']]=recipe['recipe_id']
+                options.append((recipe['title'], recipe['recipe_id']))
         return options
 
     def update_conversation_context(self):
@@ -445,27 +950,44 @@ class SmartFridge():
         if (input_message != ''):
             message['text'] = input_message
 
-        response = self.conversation.message(workspace_id=CONVERSATION_WORKSPACE,
-                                             message_input=message,
-                                             context=self.context,
-                                             alternate_intents=False)
+        if self.dialog_engine is not None:
+            with span('dialog engine'):
+                response = self.dialog_engine.message(workspace_id=CONVERSATION_WORKSPACE,
+                                                      message_input=message,
+                                                      context=self.session.context,
+                                                      alternate_intents=False)
+        else:
+            with span('local nlu'):
+                local_turn = self.local_conversation_turn(input_message)
+            if local_turn is not None:
+                print('#{} (local)'.format(local_turn[1]))
+                return local_turn
+
+            request_context = json.dumps(self.session.context)
+            response = self.conversation_http.call(self.conversation.message,
+                                                   workspace_id=CONVERSATION_WORKSPACE,
+                                                   message_input=message,
+                                                   context=self.session.context,
+                                                   alternate_intents=False)
+            if CONVERSATION_RECORD_FILE:
+                self.record_conversation_turn(message, request_context, response)
 
         self.update_local_context(response['context'])
-        self.intents = response['intents']
-        self.entities = response['entities']
+        self.session.intents = response['intents']
+        self.session.entities = response['entities']
 
         # Print intent and entity
-        if (len(self.intents) > 0 and len(self.entities) > 0):
-            print('#{0}  (@{1}:{2})'.format(self.intents[0]['intent'], self.entities[0]['entity'],
-                                            self.entities[0]['value']))
-            intent = self.intents[0]['intent']
-            entity = self.entities[0]['entity']
-        elif (len(self.intents) > 0):
-            print('#{0}'.format(self.intents[0]['intent']))
-            intent = self.intents[0]['intent']
-        elif (len(self.entities) > 0):
-            print('@{0}:{1}'.format(self.entities[0]['entity'], self.entities[0]['value']))
-            entity = self.entities[0]['entity']
+        if (len(self.session.intents) > 0 and len(self.session.entities) > 0):
+            print('#{0}  (@{1}:{2})'.format(self.session.intents[0]['intent'], self.session.entities[0]['entity'],
+                                            self.session.entities[0]['value']))
+            intent = self.session.intents[0]['intent']
+            entity = self.session.entities[0]['entity']
+        elif (len(self.session.intents) > 0):
+            print('#{0}'.format(self.session.intents[0]['intent']))
+            intent = self.session.intents[0]['intent']
+        elif (len(self.session.entities) > 0):
+            print('@{0}:{1}'.format(self.session.entities[0]['entity'], self.session.entities[0]['value']))
+            entity = self.session.entities[0]['entity']
 
         if (response["output"] and response["output"]["text"]):
             for r in response["output"]["text"]:
@@ -473,27 +995,109 @@ class SmartFridge():
 
         return response_text, intent, entity
 
+    # Appends the turn to CONVERSATION_RECORD_FILE, replayed by conformance.py
+    def record_conversation_turn(self, message, request_context, response):
+        record = {'request': {'input': message, 'context': json.loads(request_context)},
+                  'response': response}
+        try:
+            with self.record_lock, open(CONVERSATION_RECORD_FILE, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + '\n')
+        except (OSError, TypeError) as inst:
+            print('Conversation record: {}'.format(inst))
+
+    # Answers the obvious intents (option selection, fridge questions, insults) without a
+    # Watson round trip. Returns None when the turn must go to Watson: low confidence,
+    # or the dialog is waiting for an answer to a previous question.
+    def local_conversation_turn(self, input_message):
+        if self.local_nlu is None or input_message == '':
+            return None
+        intents, entities = self.local_nlu.classify(input_message)
+        intent = confident_intent(intents, LOCAL_NLU_CONFIDENCE, LOCAL_NLU_MARGIN)
+        if intent not in LOCAL_NLU_INTENTS:
+            return None
+
+        values = {}
+        for e in entities:
+            start, end = e['location']
+            if e['entity'] == 'option' and input_message[start:end].lower() in UNDECIDED_OPTION_WORDS:
+                return None
+            values.setdefault(e['entity'], e['value'])
+        context = self.session.context
+        at_root = self.dialog_at_root(context)
+        response_text = ''
+
+        if intent == 'select_option' and 'option' in values and len(self.session.recipe_options) > 0:
+            context['option'] = int(values['option'])
+            context['counter'] = 0
+        elif intent == 'available_ingredients' and at_root:
+            context['ingredients'] = values.get('ingredients')
+            # every text of the node, as Watson answers it
+            for text in self.workspace_texts('#' + intent):
+                response_text = response_text + '\n' + text
+        # From the third insult on Watson takes over
+        elif intent == 'negative_reaction' and at_root and int(context.get('insult_counter') or 0) < 2:
+            context['insult_counter'] = int(context.get('insult_counter') or 0) + 1
+            response_text = '\n' + random.choice(self.workspace_texts('#' + intent))
+        else:
+            return None
+
+        # Same context updates as the workspace nodes of these intents
+        for flag in ['summary', 'yum_sugest', 'image_recipe', 'suggest_dish', 'search_recipe']:
+            context[flag] = 'false'
+        if 'system' in context:
+            context['system']['dialog_stack'] = [{'dialog_node': 'root'}]
+
+        self.session.intents = intents
+        self.session.entities = entities
+        return response_text, intent, entities[0]['entity'] if len(entities) > 0 else ''
+
+    def dialog_at_root(self, context):
+        stack = context.get('system', {}).get('dialog_stack')
+        return not stack or stack == [{'dialog_node': 'root'}]
+
+    # Responses of the root dialog node with the given condition
+    def workspace_texts(self, conditions):
+        for node in self.workspace['dialog_nodes']:
+            if node['parent'] is None and node['conditions'] == conditions:
+                return node['output']['text']['values']
+        return []
+
     def update_local_context(self, context):
-        self.context = context
-        for key, value in self.context.items():
+        self.session.context = context
+        for key, value in self.session.context.items():
             print('{0} = {1}'.format(key, value))
         print('\n')
 
 
 
     ######   VISUAL RECOGNITION ########
-    def get_food_from_image(self, image_path):
-        with open(image_path, 'rb') as image_file:
-            vr_response = self.visual_recognition.classify(images_file=image_file, classifier_ids=['food'])
-            if vr_response['images'] and len(vr_response['images']) > 0:
-                image = vr_response['images'][0]
-                if image['classifiers'] and len(image['classifiers']) > 0:
-                    classifier = image['classifiers'][0]
-                    if classifier['classes'] and len(classifier['classes']) > 0:
-                        food = classifier['classes'][0]['class']
-                        score = classifier['classes'][0]['score']
-                        return food, score
-        return None, None
+    # Resent or near-identical images are answered from the image cache,
+    # the rest are downscaled before being classified
+    def get_food_from_image(self, image):
+        cached, key, phash = self.image_cache.lookup(image)
+        if cached is not None:
+            print('Image classification cached: {}'.format(self.image_cache.stats()))
+            return cached[0], cached[1]
+
+        with span('food classifier', backend=type(self.food_classifier).__name__):
+            food, score = self.food_classifier.classify([downscale_image(image, IMAGE_MAX_SIDE)])[0]
+        # a photo with nothing recognized is tried again if resent
+        if food is not None:
+            self.image_cache.set(key, phash, food, score)
+        return food, score
+
+
+
+    def load_image_cache(self, path):
+        try:
+            self.image_cache.load(path)
+        except Exception as inst:
+            print('Image cache not loaded: {}'.format(inst))
+
+
+    def save_image_cache(self, path):
+        self.image_cache.dump(path)
+        print('Image cache: {}'.format(self.image_cache.stats()))
 
 
 
@@ -503,49 +1107,96 @@ class SmartFridge():
         this parsing function returns None unless a message is
         directed at the Bot, based on its ID.
     """
-    def parse_slack_output(self, slack_rtm_output, download_path='download/food.jpg'):
-        output_list = slack_rtm_output
-        if output_list and len(output_list) > 0:
-            for output in output_list:
-                if output and 'text' in output and AT_BOT in output['text']:
-                    # return text after the @ mention, whitespace removed
-                    return output['text'].split(AT_BOT)[1].strip().lower(), output['channel']
-                elif output and 'file' in output and 'url_private_download' in output['file']:
-                    down_url = output['file']['url_private_download']
-                    extension = os.path.splitext(down_url)[1][1:].strip().lower()
-                    if extension in ['jpg', 'png']:
-                        self.download_file(down_url, download_path, 'download')
-                        return 'photo', output['channel']
-                    else:
-                        return 'download_file_format_error', output['channel']
+    def parse_slack_output(self, slack_rtm_output):
+        for command, output in self.parse_slack_events(slack_rtm_output):
+            return command, output['channel']
         return None, None
 
+    # Same filtering as parse_slack_output, but yields every command of the batch
+    # together with the Slack event it comes from. Photos are downloaded later,
+    # by the worker handling the command.
+    def parse_slack_events(self, slack_rtm_output):
+        return slack_commands(slack_rtm_output)
+
+    # Blocks until the RTM websocket receives a frame (or the timeout expires)
+    # and then drains every event already available, instead of polling
+    # Raises WebSocketConnectionClosedException when the RTM websocket is closed, see reconnect_slack
+    def read_slack_events(self, timeout=READ_WEBSOCKET_TIMEOUT):
+        events = []
+        websocket = getattr(self.slack_client.server, 'websocket', None)
+        sock = websocket.sock if websocket is not None else None
+        if sock is None:
+            raise WebSocketConnectionClosedException('RTM websocket not connected')
+        if not self.websocket_readable(sock, timeout):
+            return events
+
+        for _ in range(MAX_EVENTS_PER_BATCH):
+            try:
+                events.extend(self.slack_client.rtm_read())
+            except BlockingIOError:
+                # Partial frame on a non-blocking plain socket, wait for the rest
+                pass
+            if not self.websocket_readable(sock, 0):
+                break
+        return events
+
+    # Connects the RTM websocket again, waiting longer after every failed attempt
+    def reconnect_slack(self):
+        delay = SLACK_RECONNECT_DELAY
+        while True:
+            time.sleep(delay)
+            try:
+                if self.slack_client.rtm_connect():
+                    print('Reconnected to Slack')
+                    return
+            except Exception as inst:
+                print('Slack reconnection failed: {}'.format(inst))
+            delay = min(2 * delay, SLACK_MAX_RECONNECT_DELAY)
+
+    def websocket_readable(self, sock, timeout):
+        # SSL sockets may hold already decrypted data that select() cannot see
+        if hasattr(sock, 'pending') and sock.pending() > 0:
+            return True
+        readable, _, _ = select.select([sock], [], [], timeout)
+        return len(readable) > 0
+
     # Provide response
-    def send_response(self, response):
-        result = self.slack_client.api_call("chat.postMessage",
-                                            channel=channel,
-                                            text=response,
-                                            as_user=True)
+    # Queues the reply, see SlackOutbox
+    # Nodes without text (e.g. #available_ingredients) give empty responses, which Slack rejects
+    def send_response(self, response, channel):
+        if response:
+            self.outbox.send(channel, response)
+
+
+    def post_message(self, channel, text):
+        with span('slack', method='chat.postMessage'):
+            result = self.slack_client.api_call("chat.postMessage",
+                                                channel=channel,
+                                                text=text,
+                                                as_user=True)
         return result
 
 
-    def download_file(self, url, local_filename, basedir):
+    # Streams a Slack file into memory, None if it fails or is bigger than MAX_IMAGE_BYTES
+    def download_image(self, url):
         try:
-            os.stat(basedir)
-        except:
-            os.mkdir(basedir)
-        try:
-            print('Savigng to {}'.format(local_filename))
             headers = {'Authorization': 'Bearer '+ os.environ.get('SLACK_BOT_TOKEN')}
-            r = requests.get(url, headers=headers)
-            with open(local_filename, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=1024):
-                    if chunk:
-                        f.write(chunk)
-        except:
-            return False
+            r = self.slack_http.get(url, headers=headers, stream=True)
+            with r:
+                if int(r.headers.get('Content-Length') or 0) > MAX_IMAGE_BYTES:
+                    print('Image too big: {} bytes'.format(r.headers['Content-Length']))
+                    return None
+                data = bytearray()
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    data.extend(chunk)
+                    if len(data) > MAX_IMAGE_BYTES:
+                        print('Image too big: more than {} bytes'.format(MAX_IMAGE_BYTES))
+                        return None
+        except Exception as inst:
+            print(inst)
+            return None
 
-        return True
+        return bytes(data)
 
 
 
@@ -558,23 +1209,60 @@ class SmartFridge():
 
 
     def search_recipes(self, query, sortBy='r'):
-        endpoint = 'http://food2fork.com/api/search'
-        url = self.food2fork_request(endpoint, q=query, sort=sortBy)
-        print(url)
-        return requests.get(url).json()
+        # no ingredients to search for
+        if query is None:
+            return None
+        key = '{0}|{1}'.format(sortBy, query.strip().lower())
+        recipes = self.search_cache.get(key)
+        if recipes is None:
+            endpoint = FOOD2FORK_URL + '/search'
+            url = self.food2fork_request(endpoint, q=query, sort=sortBy)
+            print(redact_url(url))
+            try:
+                recipes = self.food2fork_http.get(url).json()
+            except Exception as inst:
+                print(inst)
+                return None
+            # Errors (e.g. daily limit reached) are not cached
+            if recipes and 'recipes' in recipes:
+                self.search_cache.set(key, recipes)
+        return recipes
 
 
     def get_recipe_from_id(self, recipeId):
-        endpoint = 'http://food2fork.com/api/get'
+        key = str(recipeId)
+        recipe = self.recipe_cache.get(key)
+        if recipe is not None:
+            return recipe
+
+        endpoint = FOOD2FORK_URL + '/get'
         try:
             url = self.food2fork_request(endpoint, rId=recipeId)
-            print(url)
-            return requests.get(url).json()
+            print(redact_url(url))
+            recipe = self.food2fork_http.get(url).json()
+            if recipe and 'recipe' in recipe:
+                self.recipe_cache.set(key, recipe)
+            return recipe
         except Exception as inst:
             print(inst)
             return None
 
 
+    def load_food2fork_cache(self, path):
+        try:
+            self.search_cache.load(path + '.search')
+            self.recipe_cache.load(path + '.recipes')
+        except Exception as inst:
+            print('Food2fork cache not loaded: {}'.format(inst))
+
+
+    def save_food2fork_cache(self, path):
+        self.search_cache.dump(path + '.search')
+        self.recipe_cache.dump(path + '.recipes')
+        print('Food2fork cache: search {0}, recipes {1}'.format(self.search_cache.stats(),
+                                                               self.recipe_cache.stats()))
+
+
     def get_recipe_id(self, query, sortBy='r'):
         recipes=self.search_recipes(query, sortBy)
         if recipes and 'recipes' in recipes and len(recipes['recipes'])>0:
@@ -589,8 +1277,7 @@ class SmartFridge():
         recipes = self.search_recipes('')
         if recipes and 'recipes' in recipes:
             for recipe in recipes['recipes'][:n_options]:
-                options.append(recipe['title'])
-                self.option_dict[recipe['title']] = recipe['recipe_id']
+                options.append((recipe['title'], recipe['recipe_id']))
         return options
 
 
@@ -601,8 +1288,7 @@ class SmartFridge():
 
         if recipes and 'recipes' in recipes:
             for recipe in recipes['recipes'][:n_options]:
-                options.append(recipe['title'])
-                self.option_dict[recipe['title']] = recipe['recipe_id']
+                options.append((recipe['title'], recipe['recipe_id']))
 
         return options
 
@@ -615,49 +1301,144 @@ class SmartFridge():
     def database_connection(self, str_db_connection):
         print('Connecting to database ... ')
         # get a connection, if a connect cannot be made an exception will be raised here
-        db_conn = psycopg2.connect(str_db_connection)
-        # conn.cursor will return a cursor object, you can use this cursor to perform queries
-        self.database_cursor = db_conn.cursor()
-
+        # connections are shared by the dispatcher threads through the pool
+        self.database = DatabasePool(str_db_connection, statements=DB_STATEMENTS)
+        self.inventory = InventoryService(self.database)
+        self.fridges = FridgeDirectory(self.database)
+        self.ingredient_aliases = self.load_ingredient_aliases()
+
+
+    # Serves and/or dumps the latency metrics, see METRICS_PORT and METRICS_DUMP_FILE.
+    # Worker process i of the Events API ingress uses METRICS_PORT + i and METRICS_DUMP_FILE.i
+    def start_metrics(self, worker=None):
+        if METRICS_PORT:
+            port = int(METRICS_PORT) + (worker or 0)
+            registry.serve(port)
+            print('Metrics served at http://127.0.0.1:{}/metrics'.format(port))
+        if METRICS_DUMP_FILE:
+            path = METRICS_DUMP_FILE if worker is None else '{0}.{1}'.format(METRICS_DUMP_FILE, worker)
+            registry.dump_periodically(path, METRICS_DUMP_INTERVAL)
+
+
+    # Hits and misses of the caches, exported with the latency metrics
+    def cache_metrics(self):
+        caches = [('food2fork_search', self.search_cache.stats()), ('food2fork_recipe', self.recipe_cache.stats()),
+                  ('image', self.image_cache.stats())]
+        for cache, stats in caches:
+            for name, value in stats.items():
+                yield 'smartfridge_cache_{}'.format(name), {'cache': cache}, value
+        for name, value in self.outbox.stats().items():
+            yield 'smartfridge_slack_{}_total'.format(name), {}, value
+
+
+    # Periodically spills the expired sessions to the backend and removes the old ones from it
+    def start_session_purge(self, interval=SESSION_PURGE_INTERVAL):
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.sessions.purge()
+                except Exception as inst:
+                    print('Sessions not purged: {}'.format(inst))
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+    def start_recipe_index(self):
+        if RECIPE_INDEX_PATH:
+            try:
+                self.recipe_index.start()
+            except Exception as inst:
+                print('Recipe index not loaded: {}'.format(inst))
+
+
+    # Keeps the expiration state in memory, so the summary does not query the database,
+    # updated by the products change feed (scripts/inventory.sql) as soon as they are written.
+    # When several bot processes run, only one of them posts the expiration digests.
+    def start_expiry_tracker(self, digests=True):
+        self.expiry_tracker = ExpiryTracker(self.database, DAYS_TO_EXPIRE,
+                                            on_change=self.send_expiry_digest if digests else None)
+        self.expiry_tracker.start()
+        self.change_feed = ChangeFeed(self.database.dsn, self.expiry_tracker.apply_changes)
+        self.change_feed.start()
+
+
+    def load_ingredient_aliases(self):
+        try:
+            return {normalize_ingredient(alias): normalize_ingredient(name)
+                    for alias, name in self.database.fetch_all(INGREDIENT_ALIASES_QUERY)}
+        except Exception as inst:
+            print('Ingredient aliases not loaded (run scripts/ingredient_search.sql): {}'.format(inst))
+            return {}
 
-    def fetch_content(self, query):
-        # execute Query
-        self.database_cursor.execute(query)
 
-        # retrieve the records from the database
-        records = self.database_cursor.fetchall()
+    def fetch_content(self, statement, *params):
+        # execute the prepared statement and retrieve the records from the database
+        records = self.database.execute(statement, params)
         record_list=[]
         for r in records:
             record_list.append(r[0])
         return(record_list)
 
 
-    # Obtain the n_ingredients products with the closest expiration date and that are in more quantity
+    # Obtain the n_ingredients products of the fridge with the closest expiration date and that are in more quantity
     def get_top_expired_ingredients_from_db(self, n_ingredients=2):
         ingredients = []
-        db_query = 'SELECT name ' \
-                    'FROM products ' \
-                    'WHERE date(expiration_date) > current_date ' \
-                    'ORDER by expiration_date ASC, quantity DESC ' \
-                    'LIMIT {}'.format(n_ingredients)
-
-        ingredients = self.fetch_content(db_query)
+        ingredients = self.fetch_content('top_expired_ingredients', self.fridge_id, n_ingredients)
 
         return ingredients
 
+    # The normalized name only has letters and spaces, so it never carries LIKE wildcards
     def get_db_information_about_ingredients(self, ingredients):
-        query = "SELECT name, expiration_date, quantity " \
-                "FROM products " \
-                "WHERE name like '%{}%'".format(ingredients)
-
-        self.database_cursor.execute(query)
-        records = self.database_cursor.fetchall()
+        term = normalize_ingredient(ingredients)
+        term = self.ingredient_aliases.get(term, term)
+        if term == '':
+            return []
+        records = self.database.execute('ingredient_information', (self.fridge_id, term))
 
         return records
 
 
 
 
+"""
+    Runs commands of different channels concurrently in a pool of
+    worker threads. Commands of the same channel are queued and
+    executed strictly in arrival order by a single worker at a time.
+"""
+class ChannelDispatcher():
+    def __init__(self, n_workers=DISPATCHER_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=n_workers)
+        self.lock = threading.Lock()
+        # channel -> commands waiting; a channel is present while a worker drains it
+        self.pending = {}
+
+    def submit(self, channel, function, *args):
+        with self.lock:
+            queue = self.pending.get(channel)
+            if queue is not None:
+                queue.append((function, args))
+                return
+            self.pending[channel] = collections.deque([(function, args)])
+        self.executor.submit(self.run_channel, channel)
+
+    def run_channel(self, channel):
+        while True:
+            with self.lock:
+                queue = self.pending[channel]
+                if len(queue) == 0:
+                    del self.pending[channel]
+                    return
+                function, args = queue.popleft()
+            try:
+                function(*args)
+            except Exception as inst:
+                print(inst)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
 
 if __name__ == "__main__":
 
@@ -665,11 +1446,21 @@ if __name__ == "__main__":
 
     if smartfridge.slack_client.rtm_connect():
         print("smartfridge connected and running!")
+        smartfridge.start_expiry_tracker()
+        smartfridge.start_recipe_index()
+        smartfridge.start_session_purge()
+        smartfridge.start_metrics()
+        dispatcher = ChannelDispatcher()
         while True:
-            command, channel = smartfridge.parse_slack_output(smartfridge.slack_client.rtm_read())
-            if command and channel:
-                smartfridge.handle_command(command)
-            time.sleep(READ_WEBSOCKET_DELAY)
+            try:
+                events = smartfridge.read_slack_events()
+            except (WebSocketConnectionClosedException, OSError) as inst:
+                print('Slack connection lost ({}), reconnecting ...'.format(inst))
+                smartfridge.reconnect_slack()
+                continue
+            for command, event in smartfridge.parse_slack_events(events):
+                dispatcher.submit(event['channel'], smartfridge.handle_command, command,
+                                  event['channel'], event.get('user'), event.get('team'), event.get('file'))
     else:
         print("Connection failed. Invalid Slack token or bot ID?")
 
@@ -0,0 +1,139 @@
+#!/usr/bin/python
+# coding=utf-8
+
+######   LIBRARIES ########
+import os
+import sys
+import argparse
+from cache import TTLCache
+from database import DatabasePool, DB_STRING_CONNECTION
+from metrics import span
+
+######   CONSTANTS ########
+
+# Fridge of the products loaded before scripts/tenants.sql, and of the messages without team
+DEFAULT_FRIDGE_ID = 1
+# Fridge of the Slack teams not in fridge_members: 'default' shares DEFAULT_FRIDGE_ID (a single
+# household, as before the tenants), 'create' gives every new team its own empty fridge
+UNMAPPED_TEAMS = os.environ.get('UNMAPPED_TEAMS', 'default')
+# Seconds the fridge of a Slack team/user (and its alert channel) is remembered, so a change
+# made with the command line reaches the running bots within this time
+FRIDGE_CACHE_TTL = 5 * 60
+# Slack team/user pairs whose fridge is remembered
+FRIDGE_CACHE_SIZE = 100000
+
+# Fridge of a team member: the one of the user if assigned, else the one of the whole team
+MEMBER_FRIDGE = ("SELECT fridge_id "
+                 "FROM fridge_members "
+                 "WHERE team_id = %s AND user_id IN (%s, '') "
+                 "ORDER by user_id DESC "
+                 "LIMIT 1")
+FRIDGE_ALERT_CHANNEL = ("SELECT alert_channel "
+                        "FROM fridges "
+                        "WHERE id = %s")
+CREATE_FRIDGE = ("INSERT INTO fridges (name, alert_channel) VALUES (%s, %s) "
+                 "RETURNING id")
+ASSIGN_FRIDGE = ("INSERT INTO fridge_members (team_id, user_id, fridge_id) VALUES (%s, %s, %s) "
+                 "ON CONFLICT (team_id, user_id) DO UPDATE SET fridge_id = EXCLUDED.fridge_id")
+# Serializes the creation of the fridge of a team among the bot processes
+LOCK_TEAM = "SELECT pg_advisory_xact_lock(hashtext(%s))"
+
+
+"""
+    Maps the Slack team and user of a message to its fridge (tenant),
+    through the fridge_members table of scripts/tenants.sql. A user
+    assigned to a fridge uses it, the rest of the team uses the fridge
+    of the team. The answers are cached for FRIDGE_CACHE_TTL seconds,
+    so the queries of a command do not add a round trip.
+"""
+class FridgeDirectory():
+    def __init__(self, database, unmapped=UNMAPPED_TEAMS):
+        self.database = database
+        self.unmapped = unmapped
+        self.members = TTLCache(maxsize=FRIDGE_CACHE_SIZE, ttl=FRIDGE_CACHE_TTL)
+        self.alert_channels = TTLCache(maxsize=FRIDGE_CACHE_SIZE, ttl=FRIDGE_CACHE_TTL)
+
+    def resolve(self, team, user=None):
+        if not team:
+            return DEFAULT_FRIDGE_ID
+        key = (team, user or '')
+        fridge_id = self.members.get(key)
+        if fridge_id is None:
+            with span('postgres', statement='member_fridge'):
+                rows = self.database.fetch_all(MEMBER_FRIDGE, (team, user or ''))
+            if rows:
+                fridge_id = rows[0][0]
+            elif self.unmapped == 'create':
+                fridge_id = self.create_team_fridge(team)
+            else:
+                fridge_id = DEFAULT_FRIDGE_ID
+            self.members.set(key, fridge_id)
+        return fridge_id
+
+    # Slack channel of the expiration digests of the fridge, None if it has none
+    def alert_channel(self, fridge_id):
+        channel = self.alert_channels.get(fridge_id)
+        if channel is None:
+            with span('postgres', statement='fridge_alert_channel'):
+                rows = self.database.fetch_all(FRIDGE_ALERT_CHANNEL, (fridge_id,))
+            channel = (rows[0][0] if rows else None) or ''
+            self.alert_channels.set(fridge_id, channel)
+        return channel or None
+
+    def create(self, name, alert_channel=None):
+        def create_fridge(cursor):
+            cursor.execute(CREATE_FRIDGE, (name, alert_channel))
+            return cursor.fetchone()[0]
+
+        return self.database.transaction(create_fridge)
+
+    # user None assigns the fridge to the whole team
+    def assign(self, fridge_id, team, user=None):
+        def assign_fridge(cursor):
+            cursor.execute(ASSIGN_FRIDGE, (team, user or '', fridge_id))
+
+        self.database.transaction(assign_fridge)
+        self.members.clear()
+
+    # New empty fridge for the team, unless another bot process created it meanwhile
+    def create_team_fridge(self, team):
+        def create_team_fridge(cursor):
+            cursor.execute(LOCK_TEAM, (team,))
+            cursor.execute(MEMBER_FRIDGE, (team, ''))
+            row = cursor.fetchone()
+            if row:
+                return row[0]
+            cursor.execute(CREATE_FRIDGE, ('team {}'.format(team), None))
+            fridge_id = cursor.fetchone()[0]
+            cursor.execute(ASSIGN_FRIDGE, (team, '', fridge_id))
+            print('New fridge {0} for the Slack team {1}'.format(fridge_id, team))
+            return fridge_id
+
+        return self.database.transaction(create_team_fridge)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fridges and their Slack teams/users')
+    commands = parser.add_subparsers(dest='command')
+    create = commands.add_parser('create', help='create a fridge, prints its id')
+    create.add_argument('name')
+    create.add_argument('--alert-channel', help='Slack channel of the expiration digests')
+    assign = commands.add_parser('assign', help='use a fridge for a Slack team, or for a user of the team')
+    assign.add_argument('fridge_id', type=int)
+    assign.add_argument('team')
+    assign.add_argument('user', nargs='?')
+    resolve = commands.add_parser('resolve', help='print the fridge of a Slack team/user')
+    resolve.add_argument('team')
+    resolve.add_argument('user', nargs='?')
+    args = parser.parse_args()
+
+    fridges = FridgeDirectory(DatabasePool(DB_STRING_CONNECTION, maxconn=1), unmapped='default')
+    if args.command == 'create':
+        print(fridges.create(args.name, args.alert_channel))
+    elif args.command == 'assign':
+        fridges.assign(args.fridge_id, args.team, args.user)
+    elif args.command == 'resolve':
+        print(fridges.resolve(args.team, args.user))
+    else:
+        parser.print_help()
+        sys.exit(1)
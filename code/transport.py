@@ -0,0 +1,180 @@
+#!/usr/bin/python
+# coding=utf-8
+
+######   LIBRARIES ########
+import time
+import random
+import threading
+import urllib.parse
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import span, registry
+
+######   CONSTANTS ########
+
+# Seconds to establish a connection (slightly above a multiple of 3, the TCP retransmission window)
+HTTP_CONNECT_TIMEOUT = 3.05
+# Seconds to wait for the server to send data
+HTTP_READ_TIMEOUT = 10
+# Retries after the first attempt of a failed request
+HTTP_RETRIES = 2
+# Base seconds of the exponential backoff between retries
+HTTP_BACKOFF = 0.5
+# Maximum seconds between two attempts. A longer Retry-After fails the call at once
+HTTP_MAX_RETRY_DELAY = 5
+# Maximum connections kept alive per host
+HTTP_POOL_SIZE = 20
+# HTTP status codes worth retrying
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# Consecutive failures that open the circuit
+CIRCUIT_FAILURES = 5
+# Seconds the circuit stays open before letting a trial request through
+CIRCUIT_RESET_TIMEOUT = 30
+# Query parameters holding credentials, hidden when a URL is printed
+SECRET_PARAMETERS = ('key', 'api_key', 'token', 'access_token')
+
+
+# URL with the values of the credential parameters replaced, safe to print
+def redact_url(url):
+    parts = urllib.parse.urlsplit(url)
+    query = [(name, '***' if name.lower() in SECRET_PARAMETERS else value)
+             for name, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)]
+    return urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query, safe='*')))
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class RetryableStatusError(Exception):
+    def __init__(self, response):
+        super().__init__('{0} {1}'.format(response.status_code, response.reason))
+        self.response = response
+
+
+# Errors of a call through HttpTransport: the request failed after its retries, or was not
+# sent because the circuit is open
+TRANSPORT_ERRORS = (requests.exceptions.RequestException, RetryableStatusError, CircuitOpenError)
+
+
+"""
+    Stops calling a service that keeps failing. After max_failures
+    consecutive failures every call is rejected for reset_timeout
+    seconds, then a single trial call decides whether it closes again.
+    The other calls are rejected while the trial is in flight.
+"""
+class CircuitBreaker():
+    def __init__(self, name, max_failures=CIRCUIT_FAILURES, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.max_failures = max_failures
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if self.trial or time.time() - self.opened_at < self.reset_timeout:
+                raise CircuitOpenError('{} circuit is open'.format(self.name))
+            # Half open: only this call goes through, its failure opens the circuit again
+            self.trial = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial = False
+            if self.failures >= self.max_failures:
+                self.opened_at = time.time()
+
+
+"""
+    Shared transport for the outbound calls to an external service:
+    pooled keep-alive connections, connect/read timeouts, bounded
+    retries with jittered exponential backoff and a circuit breaker.
+"""
+class HttpTransport():
+    def __init__(self, name, connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=HTTP_READ_TIMEOUT,
+                 retries=HTTP_RETRIES, backoff=HTTP_BACKOFF, pool_size=HTTP_POOL_SIZE,
+                 max_retry_delay=HTTP_MAX_RETRY_DELAY):
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_retry_delay = max_retry_delay
+        self.breaker = CircuitBreaker(name)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+
+        def send():
+            response = self.session.request(method, url, **kwargs)
+            if response.status_code in RETRY_STATUS:
+                response.close()
+                raise RetryableStatusError(response)
+            return response
+
+        return self.call(send)
+
+    # Runs function() with the retry policy and circuit breaker of this service.
+    # Also used for SDK calls (e.g. Watson) that do their own HTTP requests.
+    # The whole call, retries included, is a metrics span named after the service.
+    def call(self, function, *args, **kwargs):
+        attempt = 0
+        with span(self.name):
+            while True:
+                try:
+                    self.breaker.before_call()
+                except CircuitOpenError:
+                    registry.increment('smartfridge_circuit_open_total', service=self.name)
+                    raise
+                try:
+                    result = function(*args, **kwargs)
+                except Exception as inst:
+                    if not self.is_retryable(inst):
+                        # the service answered, e.g. a client error
+                        self.breaker.record_success()
+                        raise
+                    self.breaker.record_failure()
+                    delay = self.retry_delay(attempt, inst)
+                    if attempt >= self.retries or delay is None:
+                        raise
+                    registry.increment('smartfridge_http_retries_total', service=self.name)
+                    time.sleep(delay)
+                    attempt += 1
+                else:
+                    self.breaker.record_success()
+                    return result
+
+    def is_retryable(self, inst):
+        if isinstance(inst, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                             RetryableStatusError)):
+            return True
+        # Watson SDK exceptions carry the HTTP status code
+        return getattr(inst, 'code', None) in RETRY_STATUS
+
+    # Seconds to wait before the next attempt, None when the server asks to wait longer
+    # than max_retry_delay (the caller would rather fail than block a handler that long)
+    def retry_delay(self, attempt, inst):
+        response = getattr(inst, 'response', None)
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            delay = int(response.headers['Retry-After'])
+            return delay if delay <= self.max_retry_delay else None
+        # "Full jitter" backoff, spreads the retries of concurrent handlers
+        return random.uniform(0, min(self.backoff * (2 ** attempt), self.max_retry_delay))
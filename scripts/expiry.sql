@@ -0,0 +1,11 @@
+--
+-- Incremental refresh of the expiry tracker, see code/expiry.py
+-- Run after database_bck_plain.sql
+--
+
+--
+-- Name: products_modified_idx; Type: INDEX; Schema: public; Owner: postgres
+-- Every refresh reads the products modified since the previous one
+--
+
+CREATE INDEX products_modified_idx ON products USING btree (modified);
@@ -0,0 +1,48 @@
+--
+-- Ingredient search: trigram index on product names and alternative
+-- (Spanish) names of the products, see get_db_information_about_ingredients
+--
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+--
+-- Name: products_name_trgm_idx; Type: INDEX; Schema: public; Owner: postgres
+-- Used by LIKE '%...%' and similarity (%) searches on lower(name)
+--
+
+CREATE INDEX products_name_trgm_idx ON products USING gin (lower(name) gin_trgm_ops);
+
+--
+-- Name: ingredient_aliases; Type: TABLE; Schema: public; Owner: postgres
+--
+
+CREATE TABLE ingredient_aliases (
+    alias character varying(50) NOT NULL,
+    name character varying(50) NOT NULL
+);
+
+ALTER TABLE ingredient_aliases OWNER TO postgres;
+
+ALTER TABLE ONLY ingredient_aliases
+    ADD CONSTRAINT ingredient_aliases_pkey PRIMARY KEY (alias);
+
+-- Spanish names of scripts/products.sql
+INSERT INTO ingredient_aliases (alias, name) VALUES
+    ('cebolla', 'onion'),
+    ('lechuga', 'lettuce'),
+    ('leche', 'milk'),
+    ('mayonesa', 'mayonnaise'),
+    ('aceitunas', 'olives'),
+    ('jamon', 'ham'),
+    ('queso', 'cheese'),
+    ('nata', 'cream'),
+    ('zumo', 'juice'),
+    ('jamon cocido', 'york ham'),
+    ('tomates', 'tomatoes'),
+    ('berenjena', 'eggplant'),
+    ('cerveza', 'beer'),
+    ('cocacola', 'coke'),
+    ('manzana', 'apple'),
+    ('ciruela', 'plum'),
+    ('naranja', 'orange'),
+    ('pepino', 'cucumber');
@@ -0,0 +1,76 @@
+--
+-- Inventory writes and change feed, see code/inventory.py
+-- Run after database_bck_plain.sql
+--
+
+--
+-- Name: products_id_seq; Type: SEQUENCE; Schema: public; Owner: postgres
+-- Identifiers of the products added by the inventory service
+--
+
+CREATE SEQUENCE products_id_seq OWNED BY products.id;
+
+SELECT setval('products_id_seq', coalesce(max(id), 0) + 1, false) FROM products;
+
+ALTER TABLE ONLY products ALTER COLUMN id SET DEFAULT nextval('products_id_seq');
+
+--
+-- Name: products_name_expiration_idx; Type: INDEX; Schema: public; Owner: postgres
+-- A product added again with the same expiration date increases the quantity of the
+-- existing row (INSERT ... ON CONFLICT). The products without expiration date are
+-- indexed as expiring at 'infinity': NULLs are never equal in a unique index
+--
+
+CREATE UNIQUE INDEX products_name_expiration_idx ON products
+    USING btree (lower(name), coalesce(expiration_date, 'infinity'::timestamp with time zone));
+
+--
+-- Name: products_touch(); Type: FUNCTION; Schema: public; Owner: postgres
+-- registered and modified are kept by the database, the incremental refresh of the
+-- expiry tracker reads the products modified since its last refresh
+--
+
+CREATE FUNCTION products_touch() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    NEW.modified := now();
+    IF TG_OP = 'INSERT' THEN
+        NEW.registered := coalesce(NEW.registered, now());
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+CREATE TRIGGER products_touch BEFORE INSERT OR UPDATE ON products
+    FOR EACH ROW EXECUTE PROCEDURE products_touch();
+
+--
+-- Name: products_notify_upsert(), products_notify_delete(); Type: FUNCTION; Schema: public; Owner: postgres
+-- Change feed on the products_changed channel: 'upsert' once per statement (the listeners
+-- read the modified rows) and 'delete:<id>' for every deleted row
+--
+
+CREATE FUNCTION products_notify_upsert() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    PERFORM pg_notify('products_changed', 'upsert');
+    RETURN NULL;
+END;
+$$;
+
+CREATE FUNCTION products_notify_delete() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    PERFORM pg_notify('products_changed', 'delete:' || OLD.id);
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER products_notify_upsert AFTER INSERT OR UPDATE ON products
+    FOR EACH STATEMENT EXECUTE PROCEDURE products_notify_upsert();
+
+CREATE TRIGGER products_notify_delete AFTER DELETE ON products
+    FOR EACH ROW EXECUTE PROCEDURE products_notify_delete();
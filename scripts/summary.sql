@@ -0,0 +1,12 @@
+--
+-- Inventory summary and top expired ingredients, see get_db_summary
+-- Run after database_bck_plain.sql
+--
+
+--
+-- Name: products_expiration_date_idx; Type: INDEX; Schema: public; Owner: postgres
+-- Both buckets of the summary (expired and to expire) and the top expired ingredients
+-- are range scans of this index
+--
+
+CREATE INDEX products_expiration_date_idx ON products USING btree (expiration_date, quantity DESC);
@@ -0,0 +1,87 @@
+--
+-- Several fridges (households) in the same database, see code/tenants.py
+-- Run after inventory.sql
+--
+
+--
+-- Name: fridges; Type: TABLE; Schema: public; Owner: postgres
+-- alert_channel is the Slack channel of the expiration digests of the fridge
+--
+
+CREATE TABLE fridges (
+    id serial NOT NULL,
+    name character varying(100) NOT NULL,
+    alert_channel character varying(20),
+    created timestamp with time zone NOT NULL DEFAULT now()
+);
+
+ALTER TABLE fridges OWNER TO postgres;
+
+ALTER TABLE ONLY fridges
+    ADD CONSTRAINT fridges_pkey PRIMARY KEY (id);
+
+-- The products already in the database belong to the first fridge (DEFAULT_FRIDGE_ID)
+INSERT INTO fridges (id, name) VALUES (1, 'smartfridge');
+
+SELECT setval('fridges_id_seq', 1);
+
+--
+-- Name: fridge_members; Type: TABLE; Schema: public; Owner: postgres
+-- Fridge of a Slack team (user_id '') or of a single user of the team, which takes precedence
+--
+
+CREATE TABLE fridge_members (
+    team_id character varying(20) NOT NULL,
+    user_id character varying(20) NOT NULL DEFAULT '',
+    fridge_id integer NOT NULL REFERENCES fridges (id) ON DELETE CASCADE
+);
+
+ALTER TABLE fridge_members OWNER TO postgres;
+
+ALTER TABLE ONLY fridge_members
+    ADD CONSTRAINT fridge_members_pkey PRIMARY KEY (team_id, user_id);
+
+CREATE INDEX fridge_members_fridge_id_idx ON fridge_members USING btree (fridge_id);
+
+--
+-- Name: products.fridge_id; Type: COLUMN; Schema: public; Owner: postgres
+-- Every product belongs to a fridge, the writes always give it
+--
+
+ALTER TABLE products ADD COLUMN fridge_id integer NOT NULL DEFAULT 1 REFERENCES fridges (id) ON DELETE CASCADE;
+
+ALTER TABLE products ALTER COLUMN fridge_id DROP DEFAULT;
+
+--
+-- Name: products_fridge_expiration_idx; Type: INDEX; Schema: public; Owner: postgres
+-- Every query of the bot reads the products of one fridge: the summary, the top expired
+-- ingredients and the ingredient search are range scans of this index, so their cost
+-- depends on the size of the fridge and not on the number of fridges
+--
+
+DROP INDEX products_expiration_date_idx;
+
+CREATE INDEX products_fridge_expiration_idx ON products USING btree (fridge_id, expiration_date, quantity DESC);
+
+--
+-- Name: products_fridge_name_expiration_idx; Type: INDEX; Schema: public; Owner: postgres
+-- The same product and expiration date can be in several fridges (INSERT ... ON CONFLICT)
+--
+
+DROP INDEX products_name_expiration_idx;
+
+CREATE UNIQUE INDEX products_fridge_name_expiration_idx ON products
+    USING btree (fridge_id, lower(name), coalesce(expiration_date, 'infinity'::timestamp with time zone));
+
+--
+-- Name: products_fridge_name_trgm_idx; Type: INDEX; Schema: public; Owner: postgres
+-- Trigram index scoped by fridge: the LIKE '%...%' and similarity (%) conditions of the
+-- ingredient search and its fridge_id = $1 are answered by the same index scan.
+-- btree_gin provides the GIN operator class of the integer fridge_id
+--
+
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+
+DROP INDEX products_name_trgm_idx;
+
+CREATE INDEX products_fridge_name_trgm_idx ON products USING gin (fridge_id, lower(name) gin_trgm_ops);
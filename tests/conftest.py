@@ -0,0 +1,113 @@
+# coding=utf-8
+
+######   LIBRARIES ########
+import os
+import sys
+import shutil
+import subprocess
+import pytest
+
+######   CONSTANTS ########
+
+# Sources of the bot, imported by the tests as the bot imports them
+CODE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'code')
+# Exported Watson Conversation workspace, same file as CONVERSATION_WORKSPACE_FILE in smart_fridge.py
+WORKSPACE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'conversation', 'json backups',
+                              'workspace-e8744a2e-ace8-43a4-b4e8-8882043e67e7_20180319_B.json')
+# Disposable Postgres database of the database tests, e.g. postgresql://postgres@localhost/test.
+# Its public schema is replaced by the one of the bot (tests skipped if not set)
+TEST_DSN = os.environ.get('TEST_DSN')
+
+sys.path.insert(0, CODE_DIR)
+
+# smart_fridge reads its configuration when imported, so provide dummy credentials
+for variable, value in [('BOT_ID', 'UTESTBOT'),
+                        ('SLACK_BOT_TOKEN', 'xoxb-test'),
+                        ('FOOD2FORK_KEY', 'test'),
+                        ('VISUAL_RECOGNITION_KEY', 'test'),
+                        ('CONVERSATION_USERNAME', 'test'),
+                        ('CONVERSATION_PASSWORD', 'test'),
+                        ('CONVERSATION_WORKSPACE', 'test')]:
+    os.environ.setdefault(variable, value)
+
+
+@pytest.fixture(scope='session')
+def workspace():
+    from local_nlu import load_workspace
+    return load_workspace(WORKSPACE_FILE)
+
+
+@pytest.fixture(scope='session')
+def classifier(workspace):
+    from local_nlu import LocalClassifier
+    return LocalClassifier.from_workspace(workspace)
+
+
+# Bot without database whose Slack replies are recorded (see benchmark.ReplayFridge),
+# with the conversation session of user U1 in channel C1 as inside handle_command
+@pytest.fixture
+def fridge(tmp_path, monkeypatch):
+    import smart_fridge
+    from benchmark import ReplayFridge
+    from sessions import session_key
+    monkeypatch.setattr(smart_fridge, 'SESSION_DB_PATH', str(tmp_path / 'sessions.db'))
+    fridge = ReplayFridge()
+    fridge.local.key = session_key('T1', 'C1', 'U1')
+    fridge.local.member = ('T1', 'U1')
+    fridge.local.session = fridge.sessions.get(fridge.local.key)
+    yield fridge
+    fridge.prefetch_executor.shutdown(wait=True)
+    fridge.source_executor.shutdown(wait=True)
+
+
+# Local Food2Fork stand-in used by the bot instead of food2fork.com. Requested before
+# the fridge fixture, it stops after the recipes prefetched by the bot
+@pytest.fixture
+def food2fork(monkeypatch):
+    import smart_fridge
+    from benchmark import FakeFood2ForkServer
+    server = FakeFood2ForkServer()
+    server.start()
+    monkeypatch.setattr(smart_fridge, 'FOOD2FORK_URL', server.url)
+    yield server
+    server.stop()
+
+
+# TEST_DSN with an empty public schema seeded with the scripts of the bot, as the
+# disposable Postgres of the benchmark
+@pytest.fixture
+def seeded_dsn():
+    if not TEST_DSN:
+        pytest.skip('TEST_DSN not set')
+    if shutil.which('psql') is None:
+        pytest.skip('psql not found')
+    from benchmark import SEED_SQL_FILES
+    psql = ['psql', '-X', '-q', '-v', 'ON_ERROR_STOP=1', '-d', TEST_DSN]
+    subprocess.run(psql + ['-c', 'DROP SCHEMA public CASCADE; CREATE SCHEMA public'],
+                   stdout=subprocess.DEVNULL, check=True)
+    for path in SEED_SQL_FILES:
+        subprocess.run(psql + ['-f', path], stdout=subprocess.DEVNULL, check=True)
+    return TEST_DSN
+
+
+# The fridge fixture connected to the seeded database, reading the products of DEFAULT_FRIDGE_ID
+@pytest.fixture
+def db_fridge(fridge, seeded_dsn):
+    from smart_fridge import SmartFridge
+    from tenants import DEFAULT_FRIDGE_ID
+    SmartFridge.database_connection(fridge, seeded_dsn)
+    fridge.local.fridge_id = DEFAULT_FRIDGE_ID
+    yield fridge
+    fridge.database.close()
+
+
+# Autocommit cursor on the database of db_fridge, without any product
+@pytest.fixture
+def db_cursor(db_fridge):
+    import psycopg2
+    conn = psycopg2.connect(db_fridge.database.dsn)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM products')
+    yield cursor
+    conn.close()
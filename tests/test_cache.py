@@ -0,0 +1,92 @@
+# coding=utf-8
+import cache
+from cache import TTLCache
+
+
+class Clock():
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_least_recently_used_entry_is_evicted(monkeypatch):
+    evicted = []
+    entries = TTLCache(maxsize=2, on_evict=lambda key, value: evicted.append((key, value)))
+    entries.set('a', 1)
+    entries.set('b', 2)
+    assert entries.get('a') == 1
+    entries.set('c', 3)
+    assert evicted == [('b', 2)]
+    assert 'b' not in entries
+    assert entries.get('a') == 1 and entries.get('c') == 3
+
+
+def test_expired_entries_are_evicted(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'time', clock)
+    evicted = []
+    entries = TTLCache(ttl=10, on_evict=lambda key, value: evicted.append(key))
+    entries.set('a', 1)
+    entries.set('b', 2, ttl=100)
+    clock.now += 11
+    assert entries.get('a') is None
+    assert evicted == ['a']
+    assert entries.get('b') == 2
+    clock.now += 100
+    assert entries.expire() == 1
+    assert len(entries) == 0
+
+
+def test_stats_count_hits_and_misses():
+    entries = TTLCache()
+    entries.set('a', 1)
+    entries.get('a')
+    entries.get('b')
+    assert entries.stats() == {'size': 1, 'hits': 1, 'misses': 1}
+
+
+def test_dump_and_load_keep_the_live_entries(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'time', clock)
+    path = str(tmp_path / 'cache.json')
+    entries = TTLCache(ttl=10)
+    entries.set('short', [1, 2])
+    entries.set('long', {'x': 1}, ttl=1000)
+    entries.dump(path)
+
+    clock.now += 20
+    loaded = TTLCache()
+    assert loaded.load(path) == 1
+    assert loaded.get('long') == {'x': 1}
+    assert loaded.get('short') is None
+    assert TTLCache().load(str(tmp_path / 'missing.json')) == 0
+
+
+def test_searches_are_cached_per_query(food2fork, fridge):
+    first = fridge.search_recipes('Onion ')
+    assert fridge.search_recipes('onion') == first
+    assert food2fork.requests == 1
+    fridge.search_recipes('onion', sortBy='t')
+    assert food2fork.requests == 2
+
+
+def test_no_recipe_without_a_query(food2fork, fridge):
+    assert fridge.get_recipe_id(None) is None
+    assert food2fork.requests == 0
+
+
+def test_peek_and_membership_do_not_count(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'time', clock)
+    entries = TTLCache(maxsize=2, ttl=10)
+    entries.set('a', 1)
+    entries.set('b', 2)
+    assert entries.peek('a') == 1 and 'a' in entries and 'c' not in entries
+    assert entries.stats() == {'size': 2, 'hits': 0, 'misses': 0}
+    # 'a' is still the least recently used entry
+    entries.set('c', 3)
+    assert entries.peek('a') is None
+    clock.now += 11
+    assert entries.peek('b') is None and 'b' not in entries
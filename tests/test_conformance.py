@@ -0,0 +1,38 @@
+# coding=utf-8
+import os
+import copy
+import pytest
+from conformance import RecordedConversation, load_records, replay
+from dialog import DialogEngine
+
+# Watson Conversation turns written with CONVERSATION_RECORD_FILE: greeting, recipe request,
+# dish, option, question about an ingredient and goodbye
+RECORDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'recorded_turns.jsonl')
+
+
+@pytest.fixture
+def records():
+    return load_records(RECORDS_FILE)
+
+
+@pytest.fixture
+def engine(workspace, classifier):
+    return DialogEngine(workspace, classifier)
+
+
+@pytest.mark.parametrize('compare_nlu', [False, True])
+def test_recorded_turns_are_replayed_without_mismatches(records, engine, compare_nlu):
+    assert replay(records, engine, RecordedConversation(records), compare_nlu) == 0
+
+
+def test_a_different_answer_is_a_mismatch(records, engine, capsys):
+    changed = copy.deepcopy(records)
+    changed[2]['response']['output']['text'] = ['Which dish?']
+    assert replay(changed, engine, RecordedConversation(changed)) == 1
+    assert "Turn 3 'tacos':" in capsys.readouterr().out
+
+
+def test_turns_are_replayed_in_the_recorded_order(records):
+    remote = RecordedConversation(records)
+    with pytest.raises(ValueError):
+        remote.message(message_input={'text': 'bye'}, context={})
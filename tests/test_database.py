@@ -0,0 +1,61 @@
+# coding=utf-8
+import os
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+
+from database import DatabasePool
+
+# Disposable Postgres database, e.g. postgresql://postgres@localhost/test (tests skipped if not set)
+TEST_DSN = os.environ.get('TEST_DSN')
+
+pytestmark = pytest.mark.skipif(not TEST_DSN, reason='TEST_DSN not set')
+
+STATEMENTS = {'backend_pid': ([], 'SELECT pg_backend_pid()'),
+              'add': (['integer', 'integer'], 'SELECT $1 + $2')}
+
+
+@pytest.fixture
+def database():
+    database = DatabasePool(TEST_DSN, maxconn=2, statements=STATEMENTS)
+    yield database
+    database.close()
+
+
+def test_connections_stay_prepared_in_the_pool(database):
+    assert database.execute('add', (2, 3)) == [(5,)]
+    with database.connection() as first, database.connection() as second:
+        assert first.prepared and second.prepared
+        pids = {first.get_backend_pid(), second.get_backend_pid()}
+    # no connection is closed when returned, nor opened again
+    assert {database.execute('backend_pid')[0][0] for _ in range(10)} <= pids
+
+
+def test_deallocated_statements_are_prepared_again(database):
+    database.fetch_all('DEALLOCATE ALL; SELECT 1')
+    assert database.execute('add', (1, 1)) == [(2,)]
+
+
+def test_failed_prepare_discards_the_connection():
+    database = DatabasePool(TEST_DSN, maxconn=1,
+                            statements=dict(STATEMENTS, broken=([], 'SELECT * FROM missing_table')))
+    try:
+        with pytest.raises(psycopg2.errors.UndefinedTable):
+            database.execute('add', (1, 1))
+        database.statements = STATEMENTS
+        assert database.execute('add', (1, 1)) == [(2,)]
+    finally:
+        database.close()
+
+
+def test_connections_broken_by_a_restart_are_replaced(database):
+    with database.connection() as first, database.connection() as second:
+        pids = [first.get_backend_pid(), second.get_backend_pid()]
+    admin = psycopg2.connect(TEST_DSN)
+    admin.autocommit = True
+    with admin.cursor() as cursor:
+        cursor.execute('SELECT pg_terminate_backend(pid) FROM unnest(%s::integer[]) AS pid', (pids,))
+    admin.close()
+    # both pooled connections are broken: the first one fails the retried query, the second one its health check
+    assert database.execute('add', (1, 2)) == [(3,)]
+    assert database.execute('backend_pid')[0][0] not in pids
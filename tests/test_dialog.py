@@ -0,0 +1,50 @@
+# coding=utf-8
+import pytest
+from dialog import DialogEngine, compile_expression, evaluate_template, Turn
+
+
+def turn(context=None, intents=(), entities=()):
+    return Turn('', list(intents), list(entities), context if context is not None else {}, False)
+
+
+def test_conditions_on_intents_entities_and_context():
+    condition = compile_expression("#greetings && @ingredients:tomato && $counter < 2")
+    matching = turn({'counter': 1}, [{'intent': 'greetings', 'confidence': 1}],
+                    [{'entity': 'ingredients', 'value': 'tomato'}])
+    assert condition(matching)
+    assert not condition(turn({'counter': 2}, [{'intent': 'greetings', 'confidence': 1}], matching.entities))
+    assert not condition(turn({'counter': 1}, [{'intent': 'greetings', 'confidence': 0.1}], matching.entities))
+
+
+def test_templates_render_context_expressions():
+    assert evaluate_template('<? $counter + 1 ?> options', turn({'counter': 2})) == '3 options'
+
+
+@pytest.fixture
+def engine(workspace, classifier):
+    engine = DialogEngine(workspace, classifier)
+    engine.random.seed(0)
+    return engine
+
+
+def test_conversation_follows_the_workspace(engine):
+    context = {}
+    answers = []
+    for text in ['', 'hello', 'I want a recipe', 'paella']:
+        response = engine.message(message_input={'text': text}, context=context)
+        context = response['context']
+        answers.append(response['output']['text'])
+    assert answers[0] == []
+    assert answers[1] == ["Hello, I'm yumyumBot, can I help you?"]
+    assert answers[2][0].startswith('I can take your recipe request')
+    assert 'paella recipe' in answers[3][0]
+    assert context['dish'] == 'paella'
+    assert context['system']['dialog_turn_counter'] == 4
+
+
+def test_given_intents_are_not_predicted(engine):
+    context = engine.message(message_input={'text': ''}, context={})['context']
+    response = engine.message(message_input={'text': 'whatever'}, context=context,
+                              intents=[{'intent': 'greetings', 'confidence': 1}], entities=[])
+    assert response['intents'] == [{'intent': 'greetings', 'confidence': 1}]
+    assert response['output']['text'] == ["Hello, I'm yumyumBot, can I help you?"]
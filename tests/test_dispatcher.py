@@ -0,0 +1,36 @@
+# coding=utf-8
+import time
+import threading
+from smart_fridge import ChannelDispatcher
+
+
+def test_commands_of_a_channel_run_in_arrival_order():
+    replies = {}
+    lock = threading.Lock()
+
+    def command(channel, number):
+        time.sleep(0.001 * (number % 3))
+        with lock:
+            replies.setdefault(channel, []).append(number)
+
+    dispatcher = ChannelDispatcher(n_workers=4)
+    for number in range(30):
+        channel = 'C{}'.format(number % 3)
+        dispatcher.submit(channel, command, channel, number)
+    dispatcher.shutdown(wait=True)
+    assert replies == {'C{}'.format(c): list(range(c, 30, 3)) for c in range(3)}
+
+
+def test_a_failing_command_does_not_stop_the_channel():
+    replies = []
+
+    def command(number):
+        if number == 0:
+            raise ValueError('boom')
+        replies.append(number)
+
+    dispatcher = ChannelDispatcher(n_workers=1)
+    for number in range(3):
+        dispatcher.submit('C1', command, number)
+    dispatcher.shutdown(wait=True)
+    assert replies == [1, 2]
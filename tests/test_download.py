@@ -0,0 +1,63 @@
+# coding=utf-8
+import os
+import threading
+import pytest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import smart_fridge
+
+PHOTO = os.urandom(200 * 1024)
+
+
+"""
+    Slack files stand-in: /photo answers PHOTO with its length, /stream
+    answers it without length (chunked)
+"""
+class FilesHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.authorization = self.headers.get('Authorization')
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        if self.path == '/photo':
+            self.send_header('Content-Length', str(len(PHOTO)))
+            self.end_headers()
+            self.wfile.write(PHOTO)
+        else:
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for start in range(0, len(PHOTO), 32 * 1024):
+                chunk = PHOTO[start:start + 32 * 1024]
+                self.wfile.write('{:x}\r\n'.format(len(chunk)).encode() + chunk + b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def files():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FilesHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:{}'.format(server.server_address[1]), server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize('path', ['/photo', '/stream'])
+def test_images_are_downloaded_in_memory(fridge, files, tmp_path, monkeypatch, path):
+    url, server = files
+    # nothing is written to the working directory
+    (tmp_path / 'cwd').mkdir()
+    monkeypatch.chdir(tmp_path / 'cwd')
+    assert fridge.download_image(url + path) == PHOTO
+    assert server.authorization == 'Bearer ' + os.environ['SLACK_BOT_TOKEN']
+    assert os.listdir('.') == []
+
+
+@pytest.mark.parametrize('path', ['/photo', '/stream'])
+def test_images_too_big_are_dropped(fridge, files, monkeypatch, path):
+    url, server = files
+    monkeypatch.setattr(smart_fridge, 'MAX_IMAGE_BYTES', 100 * 1024)
+    assert fridge.download_image(url + path) is None
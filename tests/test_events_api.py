@@ -0,0 +1,100 @@
+# coding=utf-8
+import json
+import time
+import queue
+import threading
+import pytest
+from events_api import EventIngress, slack_signature, verify_signature, rtm_event
+
+SECRET = 'test-secret'
+
+
+def signed(payload, secret=SECRET, timestamp=None):
+    body = json.dumps(payload).encode()
+    timestamp = str(int(timestamp or time.time()))
+    return {'X-Slack-Request-Timestamp': timestamp,
+            'X-Slack-Signature': slack_signature(secret, timestamp, body)}, body
+
+
+def mention(event_id, ts, text='<@UBOT> hello', channel='C1', kind='app_mention'):
+    return {'type': 'event_callback', 'team_id': 'T1', 'event_id': event_id,
+            'event': {'type': kind, 'channel': channel, 'user': 'U1', 'text': text, 'ts': ts}}
+
+
+def commands(events):
+    for event in events:
+        yield event['text'], event
+
+
+def ingress(n_queues=2, size=10):
+    return EventIngress(SECRET, [queue.Queue(size) for _ in range(n_queues)], commands)
+
+
+def test_signature_is_verified():
+    headers, body = signed({'type': 'event_callback'})
+    assert verify_signature(SECRET, headers['X-Slack-Request-Timestamp'], body, headers['X-Slack-Signature'])
+    assert not verify_signature('other', headers['X-Slack-Request-Timestamp'], body,
+                                headers['X-Slack-Signature'])
+    old, body = signed({'type': 'event_callback'}, timestamp=time.time() - 3600)
+    assert not verify_signature(SECRET, old['X-Slack-Request-Timestamp'], body, old['X-Slack-Signature'])
+
+
+def test_forged_requests_are_refused():
+    headers, body = signed(mention('Ev1', '1.1'), secret='forged')
+    assert ingress().handle(headers, body)[0] == 401
+
+
+def test_url_verification_answers_the_challenge():
+    assert ingress().handle(*signed({'type': 'url_verification', 'challenge': 'abc'})) == (200, b'abc')
+
+
+def test_retries_and_duplicated_events_are_dropped():
+    events = ingress()
+    assert events.handle(*signed(mention('Ev1', '1.1')))[0] == 200
+    assert events.handle(*signed(mention('Ev1', '1.1')))[0] == 200
+    assert events.handle(*signed(mention('Ev2', '1.1', kind='message')))[0] == 200
+    assert events.received == 1 and events.duplicates == 2
+    assert sum(q.qsize() for q in events.queues) == 1
+
+
+def test_a_channel_always_goes_to_the_same_queue():
+    events = ingress(n_queues=4)
+    for i in range(6):
+        events.handle(*signed(mention('Ev{}'.format(i), '1.{}'.format(i), channel='C42')))
+    assert sorted(q.qsize() for q in events.queues) == [0, 0, 0, 6]
+
+
+def test_full_queue_is_refused_and_accepted_on_retry():
+    events = ingress(n_queues=1, size=1)
+    assert events.handle(*signed(mention('Ev1', '1.1')))[0] == 200
+    assert events.handle(*signed(mention('Ev2', '1.2')))[0] == 503
+    events.queues[0].get()
+    assert events.handle(*signed(mention('Ev2', '1.2')))[0] == 200
+
+
+def test_events_api_files_look_like_rtm_events():
+    event = rtm_event({'team_id': 'T1', 'event': {'files': [{'id': 'F1'}]}})
+    assert event == {'team': 'T1', 'files': [{'id': 'F1'}], 'file': {'id': 'F1'}}
+
+
+def test_a_signing_secret_is_required():
+    with pytest.raises(ValueError):
+        EventIngress('', [queue.Queue()], commands)
+
+
+def test_concurrent_retries_queue_the_event_once():
+    events = ingress(n_queues=1, size=100)
+    request = signed(mention('Ev1', '1.1'))
+    start = threading.Barrier(8)
+
+    def send():
+        start.wait()
+        events.handle(*request)
+
+    threads = [threading.Thread(target=send) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert events.queues[0].qsize() == 1
+    assert events.received == 1 and events.duplicates == 7
@@ -0,0 +1,61 @@
+# coding=utf-8
+import datetime
+from expiry import ExpiryTracker, EXPIRY_REFRESH_OVERLAP
+
+NOW = datetime.datetime.now(datetime.timezone.utc)
+
+
+def days(n):
+    return NOW + datetime.timedelta(days=n)
+
+
+"""
+    products table of the 'products_expiry' and 'products_modified_since' statements
+"""
+class FakeDatabase():
+    def __init__(self):
+        self.rows = {}
+
+    def write(self, product_id, name, expiration_date, modified, fridge_id=1, quantity=1):
+        self.rows[product_id] = (product_id, fridge_id, name, expiration_date, quantity, modified)
+
+    def execute(self, name, params=()):
+        if name == 'products_expiry':
+            return list(self.rows.values())
+        return [row for row in self.rows.values() if row[5] > params[0]]
+
+
+def test_writes_committed_late_are_not_skipped():
+    database = FakeDatabase()
+    database.write(1, 'milk', days(30), NOW)
+    tracker = ExpiryTracker(database, 7)
+    tracker.reload()
+    # started before the last refresh, committed after it
+    database.write(2, 'ham', days(3), NOW - datetime.timedelta(seconds=EXPIRY_REFRESH_OVERLAP / 2))
+    database.write(3, 'eggs', days(20), NOW + datetime.timedelta(seconds=1))
+    tracker.refresh()
+    assert tracker.summary(1) == (3, [], ['ham'])
+    assert tracker.changes[1] == ([], ['ham'])
+
+
+def test_products_read_again_are_not_duplicated():
+    database = FakeDatabase()
+    for product_id in range(10):
+        database.write(product_id, 'product {}'.format(product_id), days(30), NOW)
+    tracker = ExpiryTracker(database, 7)
+    tracker.reload()
+    for _ in range(5):
+        tracker.refresh()
+    assert len(tracker.fresh_heap) == 10
+
+
+def test_outdated_heap_entries_are_pruned():
+    database = FakeDatabase()
+    tracker = ExpiryTracker(database, 7)
+    tracker.reload()
+    for n in range(100):
+        database.write(1, 'cheese', days(30 + n), NOW + datetime.timedelta(seconds=n))
+        tracker.refresh()
+    assert len(tracker.fresh_heap) <= 2
+    tracker.remove([1])
+    assert tracker.fresh_heap == []
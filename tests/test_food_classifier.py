@@ -0,0 +1,88 @@
+# coding=utf-8
+import pytest
+import threading
+from concurrent.futures import TimeoutError
+from benchmark import FakeVisualRecognition
+from food_classifier import BatchingClassifier, WatsonFoodClassifier
+from transport import HttpTransport, CircuitOpenError
+
+
+"""
+    Backend answering the label of each image, optionally dropping results or blocking
+"""
+class FakeBackend():
+    def __init__(self, drop=0, block=None):
+        self.drop = drop
+        self.block = block
+        self.batches = []
+
+    def classify(self, images):
+        self.batches.append(len(images))
+        if self.block is not None:
+            self.block.wait()
+        results = [(image.decode(), 0.9) for image in images]
+        return results[:len(results) - self.drop]
+
+
+def test_images_are_classified_in_order():
+    classifier = BatchingClassifier(FakeBackend(), max_wait=0.05)
+    assert classifier.classify([b'pizza', b'salad', b'soup']) == [('pizza', 0.9), ('salad', 0.9), ('soup', 0.9)]
+
+
+def test_missing_results_fail_the_images():
+    classifier = BatchingClassifier(FakeBackend(drop=1), max_wait=0.05, timeout=5)
+    with pytest.raises(RuntimeError):
+        classifier.classify([b'pizza', b'salad'])
+
+
+def test_classification_times_out():
+    block = threading.Event()
+    classifier = BatchingClassifier(FakeBackend(block=block), timeout=0.05)
+    try:
+        with pytest.raises(TimeoutError):
+            classifier.classify([b'pizza'])
+    finally:
+        block.set()
+
+
+def test_watson_gets_the_name_and_type_of_the_image():
+    classifier = WatsonFoodClassifier(FakeVisualRecognition(0), HttpTransport('watson visual recognition'))
+    assert classifier.classify([b'photo']) == [('pizza', 0.9)]
+
+
+"""
+    Food classifier of the bot answering the given result, or raising it
+"""
+class FixedClassifier():
+    def __init__(self, result):
+        self.result = result
+        self.calls = 0
+
+    def classify(self, images):
+        self.calls += 1
+        if isinstance(self.result, Exception):
+            raise self.result
+        return [self.result for image in images]
+
+
+PHOTO = {'url_private_download': 'https://files.slack.com/photo.jpg'}
+
+
+@pytest.fixture
+def fridge(fridge, monkeypatch):
+    monkeypatch.setattr(fridge, 'download_image', lambda url: b'photo')
+    return fridge
+
+
+@pytest.mark.parametrize('result', [(None, None), ('non-food', 0.8), TimeoutError(),
+                                    CircuitOpenError('watson visual recognition')])
+def test_unrecognized_photos_are_reported(fridge, result):
+    fridge.food_classifier = FixedClassifier(result)
+    assert fridge.image_food_recognition('C1', PHOTO).startswith('Are you sure it is edible?')
+
+
+def test_photos_with_nothing_recognized_are_not_cached(fridge):
+    fridge.food_classifier = FixedClassifier((None, None))
+    fridge.image_food_recognition('C1', PHOTO)
+    fridge.image_food_recognition('C1', PHOTO)
+    assert fridge.food_classifier.calls == 2
@@ -0,0 +1,49 @@
+# coding=utf-8
+import io
+import pytest
+from image_cache import ImageCache, hamming_distance
+
+
+def test_identical_images_are_found_by_content():
+    images = ImageCache()
+    result, key, phash = images.lookup(b'not an image')
+    assert result is None
+    images.set(key, phash, 'pizza', 0.9)
+    assert images.lookup(b'not an image')[0] == ('pizza', 0.9)
+    assert images.stats()['hits'] == 1 and images.stats()['misses'] == 1
+
+
+def test_near_identical_images_are_found_by_perceptual_hash():
+    Image = pytest.importorskip('PIL.Image')
+
+    def jpeg(size, quality):
+        image = Image.new('L', (64, 64))
+        image.putdata([(x * 4 + y) % 256 for y in range(64) for x in range(64)])
+        data = io.BytesIO()
+        image.resize(size).save(data, 'JPEG', quality=quality)
+        return data.getvalue()
+
+    images = ImageCache()
+    _, key, phash = images.lookup(jpeg((64, 64), 95))
+    images.set(key, phash, 'salad', 0.8)
+    assert images.lookup(jpeg((48, 48), 60))[0] == ('salad', 0.8)
+    assert images.stats()['near_hits'] == 1
+
+
+def test_evicted_images_leave_the_index():
+    images = ImageCache(maxsize=1)
+    images.set('a', 0xff, 'pizza', 0.9)
+    images.set('b', 0xff00, 'salad', 0.8)
+    assert images.find_similar(0xff) is None
+    assert images.find_similar(0xff00)[0] == 'salad'
+
+
+def test_dump_and_load_rebuild_the_index(tmp_path):
+    path = str(tmp_path / 'images.json')
+    images = ImageCache()
+    images.set('a', 0x0f0f, 'soup', 0.7)
+    images.dump(path)
+    loaded = ImageCache()
+    assert loaded.load(path) == 1
+    assert loaded.find_similar(0x0f0e)[0] == 'soup'
+    assert hamming_distance(0x0f0f, 0x0f0e) == 1
@@ -0,0 +1,33 @@
+# coding=utf-8
+import pytest
+from tenants import DEFAULT_FRIDGE_ID
+
+
+@pytest.fixture
+def db_fridge(db_fridge, db_cursor):
+    for name, days in [('Onions', 3), ('spring onion', 1), ('Tomatoes', 5), ('milk', 2)]:
+        db_cursor.execute("INSERT INTO products (name, expiration_date, quantity, fridge_id) "
+                          "VALUES (%s, now() + %s * interval '1 day', 1, %s)", (name, days, DEFAULT_FRIDGE_ID))
+    return db_fridge
+
+
+def names(records):
+    return [name for name, expiration_date, quantity in records]
+
+
+def test_substring_matches_best_match_first(db_fridge):
+    assert names(db_fridge.get_db_information_about_ingredients('onion')) == ['Onions', 'spring onion']
+
+
+def test_misspelled_and_plural_names_match(db_fridge):
+    assert names(db_fridge.get_db_information_about_ingredients('tomatto')) == ['Tomatoes']
+    assert names(db_fridge.get_db_information_about_ingredients('MILKS')) == ['milk']
+
+
+def test_alternative_names_are_translated(db_fridge):
+    assert db_fridge.ingredient_aliases['cebolla'] == 'onion'
+    assert names(db_fridge.get_db_information_about_ingredients('cebollas')) == ['Onions', 'spring onion']
+
+
+def test_nothing_to_search(db_fridge):
+    assert db_fridge.get_db_information_about_ingredients('!!') == []
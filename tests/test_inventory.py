@@ -0,0 +1,66 @@
+# coding=utf-8
+import queue
+import datetime
+import pytest
+import inventory
+from inventory import ChangeFeed
+from tenants import DEFAULT_FRIDGE_ID
+
+TODAY = datetime.datetime.now(datetime.timezone.utc)
+NEXT_WEEK = TODAY + datetime.timedelta(days=7)
+
+
+def stock(db_cursor):
+    db_cursor.execute('SELECT name, expiration_date, quantity FROM products ORDER by name, expiration_date')
+    return db_cursor.fetchall()
+
+
+@pytest.mark.parametrize('copy_rows', [inventory.COPY_BATCH_ROWS, 1])
+def test_products_added_again_increase_the_stock(db_fridge, db_cursor, monkeypatch, copy_rows):
+    # with copy_rows=1 every batch is loaded with COPY
+    monkeypatch.setattr(inventory, 'COPY_BATCH_ROWS', copy_rows)
+    items = [('Milk', 1, NEXT_WEEK), ('milk', 2, NEXT_WEEK), ('salt', 100, None)]
+    assert db_fridge.inventory.add(DEFAULT_FRIDGE_ID, items) == 2
+    db_fridge.inventory.add(DEFAULT_FRIDGE_ID, [('MILK', 1, NEXT_WEEK), ('Salt', 50, None), ('salt', 5, None)])
+    assert stock(db_cursor) == [('Milk', NEXT_WEEK, 4), ('salt', None, 155)]
+
+
+def test_consume_takes_the_first_to_expire(db_fridge, db_cursor):
+    db_fridge.inventory.add(DEFAULT_FRIDGE_ID, [('eggs', 6, NEXT_WEEK), ('eggs', 6, TODAY + datetime.timedelta(days=2)),
+                                                ('eggs', 6, None), ('eggs', 6, TODAY - datetime.timedelta(days=1))])
+    assert db_fridge.inventory.consume(DEFAULT_FRIDGE_ID, 'Eggs', 8) == 8
+    assert [quantity for _, _, quantity in stock(db_cursor)] == [6, 4, 6]
+    # the expired eggs are not taken
+    assert db_fridge.inventory.consume(DEFAULT_FRIDGE_ID, 'eggs', 20) == 10
+
+
+def test_discard_removes_the_expired_products(db_fridge, db_cursor):
+    db_fridge.inventory.add(DEFAULT_FRIDGE_ID, [('ham', 1, TODAY - datetime.timedelta(days=1)), ('ham', 1, NEXT_WEEK),
+                                                ('yogurt', 1, TODAY)])
+    assert db_fridge.inventory.discard_expired(DEFAULT_FRIDGE_ID) == ['ham', 'yogurt']
+    assert stock(db_cursor) == [('ham', NEXT_WEEK, 1)]
+
+
+def test_change_feed_notifies_every_write(db_fridge):
+    changes = queue.Queue()
+    feed = ChangeFeed(db_fridge.database.dsn, changes.put)
+    feed.start()
+    try:
+        # the first notification may arrive before the feed listens: write until one is received
+        for _ in range(50):
+            db_fridge.inventory.add(DEFAULT_FRIDGE_ID, [('rice', 1, None)])
+            try:
+                assert 'upsert' in changes.get(timeout=0.1)
+                break
+            except queue.Empty:
+                pass
+        else:
+            pytest.fail('No change notified')
+        db_fridge.inventory.consume(DEFAULT_FRIDGE_ID, 'rice', 1000)
+        # upserts of the previous writes may still be arriving
+        deleted = []
+        while not deleted:
+            deleted = [change for change in changes.get(timeout=5) if change.startswith('delete:')]
+        assert len(deleted) == 1
+    finally:
+        feed.stop()
@@ -0,0 +1,86 @@
+# coding=utf-8
+import pytest
+from local_nlu import LocalClassifier, tokenize, confident_intent
+from smart_fridge import SmartFridge
+
+
+def small_classifier():
+    classifier = LocalClassifier()
+    classifier.add_example('greetings', 'hello')
+    classifier.add_example('greetings', 'good morning')
+    classifier.add_example('get_recipe', 'I want a recipe')
+    classifier.add_example('get_recipe', 'give me the recipe of a dish')
+    classifier.add_entity_value('ingredients', 'tomato', ['tomatoes'])
+    classifier.add_entity_value('cuisine_type', 'tex mex', [])
+    classifier.train()
+    return classifier
+
+
+def test_tokens_are_lowercased_and_singular():
+    assert tokenize("I'd like Tomatoes") == ['id', 'like', 'tomato']
+
+
+def test_exact_example_has_full_confidence():
+    intents, _ = small_classifier().classify('Hello')
+    assert intents[0] == {'intent': 'greetings', 'confidence': 1.0}
+
+
+def test_closest_example_gives_the_intent():
+    intents, _ = small_classifier().classify('I want the recipe of lasagna')
+    assert intents[0]['intent'] == 'get_recipe'
+    assert 0 < intents[0]['confidence'] < 1
+
+
+def test_entities_are_found_by_value_and_synonym():
+    _, entities = small_classifier().classify('tex mex with tomatoes for 2')
+    assert [(e['entity'], e['value']) for e in entities] == [('cuisine_type', 'tex mex'),
+                                                            ('ingredients', 'tomato'),
+                                                            ('sys-number', '2')]
+    assert entities[1]['location'] == [13, 21]
+
+
+def test_workspace_examples_are_classified(classifier):
+    assert classifier.classify('hello')[0][0]['intent'] == 'greetings'
+    assert classifier.classify('I want a recipe')[0][0]['intent'] == 'get_recipe'
+    assert classifier.classify('what do I have in the fridge?')[0][0]['intent'] == 'available_ingredients'
+
+
+def test_confident_intent_needs_a_margin_over_the_runner_up():
+    tied = [{'intent': 'not_specified', 'confidence': 0.5}, {'intent': 'select_option', 'confidence': 0.5}]
+    assert confident_intent(tied, 0.5, 0.1) is None
+    assert confident_intent([{'intent': 'greetings', 'confidence': 0.9}], 0.8, 0.1) == 'greetings'
+    assert confident_intent([{'intent': 'greetings', 'confidence': 0.7}], 0.8, 0.1) is None
+    assert confident_intent([], 0.8, 0.1) is None
+
+
+OPTIONS = ['Recipe {}'.format(i) for i in range(1, 7)]
+
+
+# "any" and "whatever" are synonyms of the first option in the workspace
+@pytest.mark.parametrize('text', ['any', 'whatever', 'Whatever you like', 'any of them'])
+def test_undecided_answers_are_left_to_watson(fridge, text):
+    fridge.session.recipe_options = list(OPTIONS)
+    assert fridge.local_conversation_turn(text) is None
+
+
+def test_an_option_named_by_an_undecided_word_is_left_to_watson(fridge, monkeypatch):
+    def classify(text):
+        return [{'intent': 'select_option', 'confidence': 1.0}], [{'entity': 'option', 'value': '1',
+                                                                   'location': [0, len(text)], 'confidence': 1}]
+    monkeypatch.setattr(fridge.local_nlu, 'classify', classify)
+    fridge.session.recipe_options = list(OPTIONS)
+    assert fridge.local_conversation_turn('Whatever') is None
+    assert fridge.local_conversation_turn('1st')[1] == 'select_option'
+
+
+@pytest.mark.parametrize('text, option', [('the second', 2), ('2', 2)])
+def test_options_are_selected_locally(fridge, text, option):
+    fridge.session.recipe_options = list(OPTIONS)
+    response_text, intent, entity = fridge.local_conversation_turn(text)
+    assert intent == 'select_option'
+    assert fridge.session.context['option'] == option
+
+
+def test_empty_responses_are_not_sent(fridge):
+    SmartFridge.send_response(fridge, '', 'C1')
+    assert fridge.outbox.texts == 0
@@ -0,0 +1,72 @@
+# coding=utf-8
+import urllib.request
+import urllib.error
+import pytest
+from metrics import Metrics
+from transport import redact_url
+
+
+def test_spans_are_timed_with_their_outcome():
+    metrics = Metrics()
+    with metrics.span('food2fork', kind='search'):
+        pass
+    with pytest.raises(ValueError):
+        with metrics.span('food2fork', kind='search'):
+            raise ValueError('boom')
+    text = metrics.render()
+    assert '# TYPE smartfridge_span_seconds histogram' in text
+    assert 'smartfridge_span_seconds_count{kind="search",outcome="ok",span="food2fork"} 1' in text
+    assert 'smartfridge_span_seconds_count{kind="search",outcome="error",span="food2fork"} 1' in text
+    assert 'smartfridge_span_seconds_bucket{kind="search",outcome="ok",span="food2fork",le="+Inf"} 1' in text
+
+
+def test_slow_traces_show_their_inner_spans(capsys):
+    metrics = Metrics(slow_trace=0)
+    with metrics.span('command') as labels:
+        labels['branch'] = '#get_recipe'
+        with metrics.span('watson conversation'):
+            pass
+        with metrics.span('food2fork'):
+            pass
+    out = capsys.readouterr().out
+    assert out.startswith('Slow command {branch="#get_recipe"}')
+    assert 'watson conversation' in out and 'food2fork' in out
+    assert 'smartfridge_span_seconds_count{branch="#get_recipe",outcome="ok",span="command"} 1' in metrics.render()
+
+
+def test_counters_collectors_and_label_escaping():
+    metrics = Metrics()
+    metrics.increment('smartfridge_http_retries_total', service='say "hi"')
+    metrics.add_collector(lambda: [('smartfridge_cache_hits', {'cache': 'recipes'}, 3)])
+    metrics.add_collector(lambda: 1 / 0)
+    text = metrics.render()
+    assert 'smartfridge_http_retries_total{service="say \\"hi\\""} 1' in text
+    assert 'smartfridge_cache_hits{cache="recipes"} 3' in text
+
+
+def test_metrics_are_served():
+    metrics = Metrics()
+    metrics.increment('smartfridge_commands_total')
+    server = metrics.serve(0)
+    url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    try:
+        with urllib.request.urlopen(url + '/metrics') as response:
+            assert b'smartfridge_commands_total 1' in response.read()
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(url + '/other')
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_credentials_are_redacted():
+    url = redact_url('http://food2fork.com/api/search?key=secret&q=chicken')
+    assert 'secret' not in url
+    assert 'q=chicken' in url
+
+
+def test_printed_food2fork_urls_hide_the_key(food2fork, fridge, capsys):
+    fridge.search_recipes('chicken')
+    out = capsys.readouterr().out
+    assert 'q=chicken' in out
+    assert 'key=test' not in out and 'key=***' in out
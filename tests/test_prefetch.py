@@ -0,0 +1,35 @@
+# coding=utf-8
+import smart_fridge
+
+
+def test_displayed_options_are_prefetched(food2fork, fridge):
+    fridge.recipe_cache.set('r1', {'recipe': {'recipe_id': 'r1', 'ingredients': []}})
+    fridge.prefetch_recipes(['r1', 'r2', 'r3'])
+    assert sorted(fridge.recipe_prefetches.peek(fridge.conversation_key)) == ['r2', 'r3']
+    # finding r1 in the cache is not a hit (the prefetches of r2 and r3 are the misses)
+    assert fridge.recipe_cache.hits == 0
+    fridge.wait_recipe_prefetch('r2')
+    assert 'r2' in fridge.recipe_cache
+    assert fridge.recipe_prefetches.peek(fridge.conversation_key) is None
+
+
+def test_selected_option_is_served_from_the_prefetch(food2fork, fridge):
+    fridge.session.recipe_options = ['Recipe r1', 'Recipe r2']
+    fridge.session.option_dict = {'Recipe r1': 'r1', 'Recipe r2': 'r2'}
+    fridge.session.context['option'] = 2
+    fridge.prefetch_recipes(['r1', 'r2'])
+    fridge.prefetch_executor.shutdown(wait=True)
+    requests = food2fork.requests
+    assert fridge.select_option().startswith('Ok, good choice! The Recipe r2 recipe below:')
+    assert food2fork.requests == requests
+
+
+def test_new_options_cancel_the_queued_prefetches(food2fork, fridge):
+    food2fork.delays['get'] = 0.2
+    n_queued = smart_fridge.RECIPE_PREFETCH_WORKERS + 4
+    fridge.prefetch_recipes(['old{}'.format(i) for i in range(n_queued)])
+    fridge.prefetch_recipes(['new'])
+    fridge.wait_recipe_prefetch('new')
+    fridge.prefetch_executor.shutdown(wait=True)
+    assert 'new' in fridge.recipe_cache
+    assert food2fork.requests < n_queued + 1
@@ -0,0 +1,60 @@
+# coding=utf-8
+import json
+from recipe_index import RecipeIndex, ingredient_terms, bitset, DENSE_TERM_RATIO
+
+
+def recipe(recipe_id, ingredients, rank):
+    return {'recipe_id': recipe_id, 'title': 'Recipe {}'.format(recipe_id), 'ingredients': ingredients,
+            'social_rank': rank}
+
+
+RECIPES = [recipe('soup', ['2 onions', '1 carrot', 'salt'], 50),
+           recipe('salad', ['1 tomato', '1 onion', 'olive oil'], 90),
+           recipe('cake', ['3 eggs', '200 g sugar', '100 g butter'], 99),
+           recipe('omelette', ['4 eggs', '1 onion', '2 potatoes'], 70)]
+
+
+def test_terms_are_words_and_pairs_of_words():
+    assert {'olive', 'oil', 'olive oil'} <= ingredient_terms('2 tbsp olive oil')
+    assert bitset([0, 3, 9]) == (1 << 0) | (1 << 3) | (1 << 9)
+
+
+def test_recipes_using_more_ingredients_come_first():
+    index = RecipeIndex()
+    index.build(RECIPES)
+    assert index.search(['egg', 'onion', 'potato'], 2) == [('Recipe omelette', 'omelette'),
+                                                           ('Recipe cake', 'cake')]
+
+
+def test_ties_are_broken_by_social_rank():
+    index = RecipeIndex()
+    index.build(RECIPES)
+    assert [recipe_id for _, recipe_id in index.search(['onion'], 5)] == ['salad', 'omelette', 'soup']
+
+
+def test_multi_word_ingredients_match_in_order():
+    index = RecipeIndex()
+    index.build(RECIPES)
+    assert index.search(['olive oil'], 5) == [('Recipe salad', 'salad')]
+    assert index.search(['oil olive'], 5) == []
+
+
+def test_sparse_and_dense_postings_give_the_same_results():
+    recipes = [recipe(str(i), ['{} eggs'.format(i % 3 + 1), 'water'], i) for i in range(4 * DENSE_TERM_RATIO)]
+    recipes.append(recipe('rare', ['saffron', 'water'], -1))
+    index = RecipeIndex()
+    index.build(recipes)
+    assert index.search(['saffron'], 5) == [('Recipe rare', 'rare')]
+    assert index.search(['water', 'saffron'], 1) == [('Recipe rare', 'rare')]
+    assert len(index.search(['egg'], 1000)) == 4 * DENSE_TERM_RATIO
+
+
+def test_dump_is_reloaded(tmp_path):
+    path = tmp_path / 'recipes.jsonl'
+    path.write_text('\n'.join(json.dumps({'recipe': r}) for r in RECIPES) + '\n')
+    index = RecipeIndex(str(path))
+    index.refresh()
+    assert index.ready
+    assert index.search(['sugar'], 1) == [('Recipe cake', 'cake')]
+    assert index.ingredients('cake') == ['3 eggs', '200 g sugar', '100 g butter']
+    assert index.ingredients('lasagna') is None
@@ -0,0 +1,47 @@
+# coding=utf-8
+import datetime
+import pytest
+
+TODAY = datetime.datetime.now(datetime.timezone.utc)
+INVENTORY = [('onion', TODAY + datetime.timedelta(days=2), 500),
+             ('eggs', TODAY + datetime.timedelta(days=20), 600)]
+
+
+# The fridge inventory is given and the recipe details are counted instead of requested
+@pytest.fixture
+def fridge(fridge, monkeypatch):
+    fridge.fetched = []
+
+    def get_recipe_from_id(recipe_id):
+        fridge.fetched.append(recipe_id)
+        return {'recipe': {'recipe_id': recipe_id, 'ingredients': ['1 onion']}}
+
+    monkeypatch.setattr(fridge, 'get_fridge_inventory', lambda: INVENTORY)
+    monkeypatch.setattr(fridge, 'get_recipe_from_id', get_recipe_from_id)
+    return fridge
+
+
+def candidates(n):
+    return [('Recipe {}'.format(i), 'r{}'.format(i)) for i in range(n)]
+
+
+def test_cached_and_indexed_recipes_are_not_fetched(fridge):
+    fridge.recipe_index.build([{'recipe_id': 'r0', 'title': 'Recipe 0', 'ingredients': ['3 eggs']}])
+    fridge.recipe_cache.set('r1', {'recipe': {'recipe_id': 'r1', 'ingredients': ['2 onions', '2 eggs']}})
+    ranked = fridge.rank_recipe_options(candidates(3), n_fetch=6)
+    assert fridge.fetched == ['r2']
+    assert ranked[0] == ('Recipe 1', 'r1')
+    assert sorted(ranked) == candidates(3)
+
+
+def test_fetches_are_capped_at_the_options_shown(fridge):
+    ranked = fridge.rank_recipe_options(candidates(18), n_fetch=6)
+    assert fridge.fetched == ['r{}'.format(i) for i in range(6)]
+    assert ranked[6:] == candidates(18)[6:]
+
+
+def test_nothing_is_fetched_after_the_deadline(fridge):
+    fridge.recipe_cache.set('r1', {'recipe': {'recipe_id': 'r1', 'ingredients': ['2 onions']}})
+    ranked = fridge.rank_recipe_options(candidates(3), n_fetch=6, deadline=0)
+    assert fridge.fetched == []
+    assert ranked == [('Recipe 1', 'r1'), ('Recipe 0', 'r0'), ('Recipe 2', 'r2')]
@@ -0,0 +1,44 @@
+# coding=utf-8
+import pytest
+import smart_fridge
+
+RECIPE = {'recipe': {'recipe_id': 'r1', 'title': 'Lasagna', 'source_url': 'http://localhost/recipes/r1',
+                     'ingredients': ['1 onion', '2 eggs', '500 g minced meat']}}
+
+
+# The recipe details are counted instead of requested
+@pytest.fixture
+def fridge(fridge, monkeypatch):
+    fridge.fetched = []
+
+    def get_recipe_from_id(recipe_id):
+        fridge.fetched.append(recipe_id)
+        return RECIPE if recipe_id == 'r1' else {'error': 'not found'}
+
+    monkeypatch.setattr(fridge, 'get_recipe_from_id', get_recipe_from_id)
+    return fridge
+
+
+def test_recipe_text_is_unchanged(fridge):
+    assert fridge.get_ingredients('r1') == ('\nI found *Lasagna*. To cook this you need the following *ingredients*:'
+                                            '\n\n   - 1 onion\n    - 2 eggs\n    - 500 g minced meat\n'
+                                            '\nHere, you can find the *method of cooking*: http://localhost/recipes/r1')
+
+
+def test_recipes_are_rendered_once(fridge):
+    first = fridge.get_ingredients('r1')
+    assert fridge.get_ingredients('r1') == first
+    assert fridge.fetched == ['r1']
+
+
+def test_missing_recipes_are_not_cached(fridge):
+    assert fridge.get_ingredients('r2').startswith(':disappointed: Sorry, no recipes found')
+    assert fridge.render_recipe('r2') is None
+    assert fridge.fetched == ['r2', 'r2']
+
+
+def test_long_ingredient_lists_are_split_in_sections(fridge, monkeypatch):
+    monkeypatch.setattr(smart_fridge, 'SLACK_SECTION_TEXT', 20)
+    blocks = fridge.render_recipe('r1')['blocks']
+    assert [block['type'] for block in blocks] == ['section', 'section', 'section', 'context']
+    assert [block['text']['text'] for block in blocks[1:3]] == ['• 1 onion\n• 2 eggs', '• 500 g minced meat']
@@ -0,0 +1,66 @@
+# coding=utf-8
+import cache
+import sessions
+from sessions import SessionStore, SQLiteSessionBackend, Session, session_key
+
+
+def test_sessions_are_separated_by_team_channel_and_user():
+    store = SessionStore()
+    first = store.get(session_key('T1', 'C1', 'U1'))
+    first.context['dish'] = 'paella'
+    assert store.get(session_key('T1', 'C1', 'U2')).context['dish'] is None
+    assert store.get(session_key('T1', 'C1', 'U1')) is first
+
+
+def test_session_round_trips_through_json():
+    session = Session()
+    session.context['option'] = 2
+    session.recipe_options = ['Paella']
+    session.option_dict = {'Paella': 'r1'}
+    loaded = Session.from_json(session.to_json())
+    assert loaded.context == session.context
+    assert loaded.recipe_options == ['Paella']
+    assert loaded.option_dict == {'Paella': 'r1'}
+
+
+def test_evicted_sessions_are_spilled_and_loaded_back(tmp_path):
+    backend = SQLiteSessionBackend(str(tmp_path / 'sessions.db'))
+    store = SessionStore(backend, maxsize=1)
+    store.get('a').context['dish'] = 'lasagna'
+    store.get('b')
+    assert backend.load('a') is not None
+    assert store.get('a').context['dish'] == 'lasagna'
+
+
+def test_write_through_saves_every_session(tmp_path):
+    backend = SQLiteSessionBackend(str(tmp_path / 'sessions.db'))
+    store = SessionStore(backend, write_through=True)
+    session = store.get('a')
+    session.context['dish'] = 'gazpacho'
+    store.save('a', session)
+    assert Session.from_json(backend.load('a')).context['dish'] == 'gazpacho'
+
+
+def test_flush_saves_the_live_sessions(tmp_path):
+    backend = SQLiteSessionBackend(str(tmp_path / 'sessions.db'))
+    store = SessionStore(backend)
+    store.get('a').context['dish'] = 'risotto'
+    assert backend.load('a') is None
+    store.flush()
+    assert Session.from_json(backend.load('a')).context['dish'] == 'risotto'
+
+
+def test_purge_spills_expired_sessions_and_removes_old_ones(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sessions.time, 'time', lambda: now[0])
+    monkeypatch.setattr(cache.time, 'time', lambda: now[0])
+    backend = SQLiteSessionBackend(str(tmp_path / 'sessions.db'))
+    store = SessionStore(backend, ttl=60)
+    backend.save('old', Session().to_json())
+    now[0] += 100
+    store.get('idle').context['dish'] = 'curry'
+    now[0] += 100
+    store.purge(max_age=150)
+    assert len(store.live) == 0
+    assert backend.load('old') is None
+    assert Session.from_json(backend.load('idle')).context['dish'] == 'curry'
@@ -0,0 +1,68 @@
+# coding=utf-8
+import time
+import threading
+from slack_outbox import SlackOutbox
+
+
+"""
+    chat.postMessage stand-in recording (time, channel, text), answering
+    'ratelimited' to the first rate_limited calls
+"""
+class FakePost():
+    def __init__(self, rate_limited=0):
+        self.rate_limited = rate_limited
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, channel, text):
+        with self.lock:
+            self.calls.append((time.time(), channel, text))
+            if self.rate_limited > 0:
+                self.rate_limited -= 1
+                return {'ok': False, 'error': 'ratelimited', 'headers': {'Retry-After': '0'}}
+        return {'ok': True}
+
+    def texts(self, channel):
+        return [text for _, posted, text in self.calls if posted == channel]
+
+
+def test_replies_of_a_turn_are_merged():
+    post = FakePost()
+    outbox = SlackOutbox(post, window=0.05, interval=0.05)
+    for text in ['Give me a second', 'Recipe 1', 'Recipe 2']:
+        outbox.send('C1', text)
+    outbox.send('C2', 'Hello')
+    assert outbox.flush(5)
+    assert post.texts('C1') == ['Give me a second\nRecipe 1\nRecipe 2']
+    assert post.texts('C2') == ['Hello']
+    assert outbox.stats() == {'texts': 4, 'posts': 2, 'rate_limited': 0}
+
+
+def test_long_replies_are_split_in_order():
+    post = FakePost()
+    outbox = SlackOutbox(post, window=0.05, interval=0.05, max_text=10)
+    for text in ['aaaa', 'bbbb', 'cccccccc', 'dd']:
+        outbox.send('C1', text)
+    assert outbox.flush(5)
+    assert post.texts('C1') == ['aaaa\nbbbb', 'cccccccc', 'dd']
+
+
+def test_posts_to_a_channel_are_spaced():
+    post = FakePost()
+    outbox = SlackOutbox(post, window=0.01, interval=0.2)
+    outbox.send('C1', 'first')
+    time.sleep(0.05)
+    outbox.send('C1', 'second')
+    assert outbox.flush(5)
+    (first, _, _), (second, _, _) = post.calls
+    assert second - first >= 0.19
+    assert post.texts('C1') == ['first', 'second']
+
+
+def test_rate_limited_messages_are_retried():
+    post = FakePost(rate_limited=2)
+    outbox = SlackOutbox(post, window=0.01, interval=0.01)
+    outbox.send('C1', 'Hello')
+    assert outbox.flush(5)
+    assert post.texts('C1') == ['Hello'] * 3
+    assert outbox.stats() == {'texts': 1, 'posts': 3, 'rate_limited': 2}
@@ -0,0 +1,36 @@
+# coding=utf-8
+import time
+
+
+def sleeping(seconds, options):
+    def source():
+        time.sleep(seconds)
+        return options
+    return source
+
+
+def test_sources_are_fetched_concurrently(fridge):
+    begin = time.perf_counter()
+    results = fridge.fetch_recipe_sources([sleeping(0.3, ['a']), sleeping(0.3, ['b']), sleeping(0.3, ['c'])])
+    assert results == [['a'], ['b'], ['c']]
+    assert time.perf_counter() - begin < 0.6
+
+
+def test_late_or_failing_sources_give_no_options(fridge):
+    def failing():
+        raise ValueError('boom')
+
+    begin = time.perf_counter()
+    results = fridge.fetch_recipe_sources([sleeping(0, ['a']), failing, sleeping(2, ['c'])], deadline=0.2)
+    assert results == [['a'], [], []]
+    assert time.perf_counter() - begin < 1
+
+
+def test_other_sources_fill_the_options_of_a_late_one(food2fork, fridge, monkeypatch):
+    food2fork.delays['trending'] = 1
+    fetch = fridge.fetch_recipe_sources
+    monkeypatch.setattr(fridge, 'fetch_recipe_sources', lambda sources, deadline=None: fetch(sources, 0.3))
+    response = fridge.yum_suggestion()
+    assert len(fridge.session.recipe_options) == 6
+    assert not [title for title in fridge.session.recipe_options if 'trending' in title]
+    assert '[6]' in response
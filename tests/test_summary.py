@@ -0,0 +1,28 @@
+# coding=utf-8
+from benchmark import LEGACY_SUMMARY_QUERIES
+from smart_fridge import DAYS_TO_EXPIRE
+from tenants import DEFAULT_FRIDGE_ID
+
+# Products around the limits of the expired and to expire buckets: (name, expiration date)
+PRODUCTS = [('milk', "now() - interval '2 days'"),
+            ('yogurt', 'current_date'),
+            ('ham', "current_date + interval '1 day' - interval '1 second'"),
+            ('eggs', "current_date + interval '1 day'"),
+            ('cheese', "current_date + interval '{} days' - interval '1 second'".format(DAYS_TO_EXPIRE + 1)),
+            ('rice', "current_date + interval '{} days'".format(DAYS_TO_EXPIRE + 1))]
+
+
+def test_single_pass_summary_matches_the_former_queries(db_fridge, db_cursor):
+    for name, expiration_date in PRODUCTS:
+        db_cursor.execute('INSERT INTO products (name, expiration_date, quantity, fridge_id) '
+                          'VALUES (%s, {}, 1, %s)'.format(expiration_date), (name, DEFAULT_FRIDGE_ID))
+    legacy = []
+    for query in LEGACY_SUMMARY_QUERIES:
+        db_cursor.execute(query)
+        legacy.append([name for name, in db_cursor.fetchall()])
+    n_products, expired_products, products_to_expire = db_fridge.database.execute('inventory_summary',
+                                                                                  (DEFAULT_FRIDGE_ID,))[0]
+    assert n_products == len(legacy[0]) == len(PRODUCTS)
+    assert expired_products == legacy[1] == ['ham', 'milk', 'yogurt']
+    assert products_to_expire == legacy[2] == ['cheese', 'eggs']
+    assert 'There are 6 products in total, 3 products are already expired' in db_fridge.get_db_summary()
@@ -0,0 +1,52 @@
+# coding=utf-8
+import datetime
+import pytest
+from tenants import DEFAULT_FRIDGE_ID
+
+NEXT_WEEK = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=7)
+
+
+# A second fridge for the team T2, and for the user U2 of the team T1
+@pytest.fixture
+def other_fridge(db_fridge, db_cursor):
+    db_cursor.execute('DELETE FROM fridge_members')
+    fridge_id = db_fridge.fridges.create('second fridge')
+    db_fridge.fridges.assign(fridge_id, 'T2')
+    db_fridge.fridges.assign(fridge_id, 'T1', 'U2')
+    db_fridge.inventory.add(DEFAULT_FRIDGE_ID, [('Onions', 1, NEXT_WEEK), ('milk', 2, NEXT_WEEK)])
+    db_fridge.inventory.add(fridge_id, [('onion', 3, NEXT_WEEK + datetime.timedelta(days=1))])
+    return fridge_id
+
+
+def use_fridge(fridge, team, user):
+    fridge.local.member = (team, user)
+    fridge.local.fridge_id = None
+
+
+def test_members_resolve_to_their_fridge(db_fridge, other_fridge):
+    assert db_fridge.fridges.resolve('T2', 'U1') == other_fridge
+    assert db_fridge.fridges.resolve('T1', 'U2') == other_fridge
+    assert db_fridge.fridges.resolve('T1', 'U1') == DEFAULT_FRIDGE_ID
+    assert db_fridge.fridges.resolve(None) == DEFAULT_FRIDGE_ID
+
+
+def test_queries_only_read_the_products_of_the_fridge(db_fridge, other_fridge):
+    use_fridge(db_fridge, 'T1', 'U1')
+    assert db_fridge.database.execute('inventory_summary', (db_fridge.fridge_id,))[0][0] == 2
+    assert [r[0] for r in db_fridge.get_db_information_about_ingredients('onion')] == ['Onions']
+    assert db_fridge.get_top_expired_ingredients_from_db(5) == ['milk', 'Onions']
+
+    use_fridge(db_fridge, 'T2', 'U1')
+    assert db_fridge.fridge_id == other_fridge
+    assert db_fridge.database.execute('inventory_summary', (db_fridge.fridge_id,))[0][0] == 1
+    assert [r[0] for r in db_fridge.get_db_information_about_ingredients('onion')] == ['onion']
+    assert db_fridge.get_top_expired_ingredients_from_db(5) == ['onion']
+
+
+def test_the_same_product_is_kept_in_each_fridge(db_fridge, db_cursor, other_fridge):
+    db_fridge.inventory.add(other_fridge, [('milk', 1, NEXT_WEEK)])
+    db_fridge.inventory.add(DEFAULT_FRIDGE_ID, [('MILK', 1, NEXT_WEEK)])
+    db_cursor.execute("SELECT fridge_id, quantity FROM products WHERE lower(name) = 'milk' ORDER by fridge_id")
+    assert db_cursor.fetchall() == [(DEFAULT_FRIDGE_ID, 3), (other_fridge, 1)]
+    assert db_fridge.inventory.consume(other_fridge, 'milk', 5) == 1
+    assert db_fridge.inventory.discard_expired(other_fridge) == []
@@ -0,0 +1,113 @@
+# coding=utf-8
+import pytest
+
+requests = pytest.importorskip('requests')
+
+import transport
+from transport import HttpTransport, CircuitBreaker, CircuitOpenError, RetryableStatusError
+
+
+class FakeResponse():
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.reason = 'Fake'
+        self.headers = headers or {}
+
+
+def flaky(failures, result='ok'):
+    calls = []
+
+    def function():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise requests.exceptions.ConnectionError('down')
+        return result
+
+    return function, calls
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    slept = []
+    monkeypatch.setattr(transport.time, 'sleep', slept.append)
+    return slept
+
+
+def test_failed_calls_are_retried():
+    function, calls = flaky(2)
+    assert HttpTransport('test', retries=2).call(function) == 'ok'
+    assert len(calls) == 3
+
+
+def test_retries_are_bounded():
+    function, calls = flaky(5)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        HttpTransport('test', retries=2).call(function)
+    assert len(calls) == 3
+
+
+def test_other_errors_are_not_retried():
+    calls = []
+
+    def function():
+        calls.append(1)
+        raise ValueError('bad request')
+
+    with pytest.raises(ValueError):
+        HttpTransport('test').call(function)
+    assert len(calls) == 1
+
+
+def test_retry_after_header_gives_the_delay():
+    http = HttpTransport('test')
+    inst = RetryableStatusError(FakeResponse(503, {'Retry-After': '2'}))
+    assert http.retry_delay(0, inst) == 2
+
+
+def test_long_retry_after_fails_at_once(no_sleep):
+    calls = []
+
+    def function():
+        calls.append(1)
+        raise RetryableStatusError(FakeResponse(429, {'Retry-After': '3600'}))
+
+    with pytest.raises(RetryableStatusError):
+        HttpTransport('test', retries=2).call(function)
+    assert len(calls) == 1 and no_sleep == []
+
+
+def test_backoff_is_capped():
+    http = HttpTransport('test', backoff=10, max_retry_delay=1)
+    assert all(http.retry_delay(5, ValueError()) <= 1 for _ in range(20))
+
+
+def test_circuit_opens_after_consecutive_failures(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(transport.time, 'time', lambda: now[0])
+    breaker = CircuitBreaker('test', max_failures=2, reset_timeout=30)
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    now[0] += 31
+    breaker.before_call()
+    breaker.record_success()
+    breaker.before_call()
+
+
+def test_half_open_circuit_lets_a_single_trial_through(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(transport.time, 'time', lambda: now[0])
+    breaker = CircuitBreaker('test', max_failures=1, reset_timeout=30)
+    breaker.record_failure()
+    now[0] += 31
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    now[0] += 31
+    breaker.before_call()
+